@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.SQLTimingMiddleware',
+    'store.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +89,38 @@ DATABASES = {
     }
 }
 
+# реплики только для чтения: BOOKS_REPLICA_HOSTS=db-replica-1,db-replica-2,
+# та же база и пользователь; в тестах - зеркала default
+for number, host in enumerate(filter(None, os.environ.get('BOOKS_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host.strip(),
+                                     'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['store.routers.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# кэш ответов /book/: локальная память по умолчанию (тесты, разработка),
+# общий Redis в продакшене через BOOKS_CACHE_URL=redis://...
+BOOKS_CACHE_URL = os.environ.get('BOOKS_CACHE_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'books': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': BOOKS_CACHE_URL,
+    } if BOOKS_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'books',
+    },
+}
+
+BOOKS_CACHE_ALIAS = 'books'
+BOOKS_RESPONSE_CACHE = True
+BOOKS_CACHE_TIMEOUT = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -131,13 +167,80 @@ STATIC_URL = 'static/'
 # DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
-    'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
-    ),
-    'DEFAULT_PARSER_CLASSES': (
+    'DEFAULT_RENDERER_CLASSES': [
+        # тот же JSON, что у rest_framework.renderers.JSONRenderer, только быстрее
+        'store.renderers.ORJSONRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
-    )
+    ]
 }
+# Accept / Content-Type: application/msgpack - если установлен msgpack
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('store.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('store.renderers.MessagePackParser')
+
+# /book/ без ?cursor= и ?page_size= отдает обычный список (старые клиенты).
+# Число - ограничить такой список, None - отдавать целиком.
+BOOKS_LEGACY_PAGE_SIZE = None
+
+# 'auto' - tsvector + GIN на PostgreSQL, in-process индекс на остальных БД;
+# либо путь к классу из store.search
+BOOKS_SEARCH_BACKEND = 'auto'
+
+# максимум элементов в POST /book_relation/bulk/
+BOOKS_BULK_MAX_ITEMS = 500
+
+# сколько строк за раз читает GET /book/export/
+BOOKS_EXPORT_CHUNK_SIZE = 2000
+
+# /library/ в кэше до записи пользователя в свои связи; данные книг
+# (цена, лайки других) могут отставать не больше чем на столько секунд
+BOOKS_LIBRARY_CACHE_TIMEOUT = 60
+
+# Server-Timing и лог store.timing: число запросов, время БД/view/serialize/render.
+# Выключено - middleware отключается при старте и ничего не стоит.
+BOOKS_SQL_TIMING = False
+# столько одинаковых SQL за запрос - предупреждение о N+1
+BOOKS_SQL_TIMING_NPLUSONE = 10
+
+# Write-behind для PATCH /book_relation/<id>/: ответ сразу после записи в журнал,
+# в базу - пачкой раз в BOOKS_WRITE_BEHIND_INTERVAL секунд. Буфер живет в памяти
+# процесса, поэтому только с одним worker-процессом (потоков - сколько угодно):
+# второй процесс на том же BOOKS_WRITE_BEHIND_DIR получит ImproperlyConfigured.
+BOOKS_WRITE_BEHIND = False
+BOOKS_WRITE_BEHIND_DIR = BASE_DIR / 'write_behind'
+BOOKS_WRITE_BEHIND_INTERVAL = 1.0
+# столько разных (user, book) в буфере - сохранить не дожидаясь таймера
+BOOKS_WRITE_BEHIND_MAX_PENDING = 10000
+
+# /book/top/?by=rating - только книги с не меньшим числом оценок;
+# by=bayesian - (PRIOR_VOTES * PRIOR_MEAN + сумма оценок) / (PRIOR_VOTES + число оценок).
+# Оценки хранятся в Book: после изменения - manage.py rebuild_leaderboard
+BOOKS_LEADERBOARD_MIN_VOTES = 5
+BOOKS_LEADERBOARD_PRIOR_MEAN = 3.0
+BOOKS_LEADERBOARD_PRIOR_VOTES = 10
+# максимум ?limit= в /book/top/
+BOOKS_LEADERBOARD_MAX_LIMIT = 100
+
+# /book/<id>/similar/: столько соседей на книгу хранит manage.py build_similar_books
+BOOKS_SIMILAR_TOP_K = 20
+
+# /book/?facets=price,author: границы интервалов цены (от границы включительно
+# до следующей) и сколько самых частых авторов отдавать
+BOOKS_FACET_PRICE_BUCKETS = [10, 25, 50, 100]
+BOOKS_FACET_AUTHORS = 10
+
+# чтения BookViewSet - со случайной из этих реплик (алиасы DATABASES);
+# пусто - все с default, ReplicaMiddleware отключается при старте
+BOOKS_DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# на сколько секунд реплика может отставать: столько после своей записи
+# пользователь читает с primary (cookie books_primary), ответы реплик в кэше живут не дольше
+BOOKS_REPLICA_LAG = 5
+
+# /admin/: список без фильтров таблицы от стольких строк считается
+# по статистике PostgreSQL, а не COUNT(*)
+BOOKS_ADMIN_ESTIMATED_COUNT = 100000
 
 SOCIAL_AUTH_POSTGRES_JSONFIELD_ENABLED = True
 
@@ -18,18 +18,26 @@ from django.contrib import admin
 from rest_framework.routers import SimpleRouter
 from django.urls import path, include, re_path  # Add the necessary import
 
-from store.views import BookViewSet, auth, UserBookRelationView
+from store import async_views
+from store.views import AuthorViewSet, BookViewSet, LibraryView, auth, UserBookRelationView
 
 router = SimpleRouter()
 
 router.register(r'book', BookViewSet)
+router.register(r'author', AuthorViewSet)
 router.register(r'book_relation', UserBookRelationView)
+router.register(r'library', LibraryView, basename='library')
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     re_path('', include('social_django.urls', namespace='social')),
-    path('auth/', auth)
+    path('auth/', auth),
+    # те же книги и лайки/оценки без пула потоков под ASGI
+    path('async/book/', async_views.book_list, name='async-book-list'),
+    path('async/book/<int:pk>/', async_views.book_detail, name='async-book-detail'),
+    path('async/book_relation/<int:book>/', async_views.book_relation,
+         name='async-book-relation'),
 ]
 
 urlpatterns += router.urls
@@ -1,14 +1,88 @@
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin import ModelAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-from store.models import Book, UserBookRelation
+from store.models import Author, Book, UserBookRelation
+from store.search import get_search_backend
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for tables too big for ``COUNT(*)`` on every page: the
+    unfiltered changelist of a table with at least
+    ``BOOKS_ADMIN_ESTIMATED_COUNT`` rows takes the row count from the
+    PostgreSQL statistics. Filtered lists and other databases count exactly.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = self.estimated_count()
+        if estimate is not None and estimate >= getattr(settings, 'BOOKS_ADMIN_ESTIMATED_COUNT', 100000):
+            return estimate
+        return super().count
+
+    def estimated_count(self):
+        queryset = self.object_list
+        if queryset.query.has_filters():
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [connection.ops.quote_name(queryset.model._meta.db_table)])
+            row = cursor.fetchone()
+        # -1 - таблицу еще не анализировали
+        if row is None or row[0] < 0:
+            return None
+        return int(row[0])
+
+
+class LargeTableAdmin(ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # иначе при фильтре - второй COUNT(*) по всей таблице
+    show_full_result_count = False
+    ordering = ['-id']
+
+
+@admin.register(Author)
+class AuthorAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'books_count', 'likes_count', 'rating_count']
+    # name уникален - поиск по индексу
+    search_fields = ['=name']
 
 
 @admin.register(Book)
-class BookAdmin(ModelAdmin):
-    pass
+class BookAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'author_name', 'price', 'owner', 'likes_count', 'rating_count']
+    list_select_related = ['owner']
+    # у фильтра по дате нет запроса вариантов, updated_at в индексе
+    list_filter = ['updated_at']
+    # поиск как у /book/?search= (см. get_search_results), а не icontains по таблице
+    search_fields = ['name', 'author_name']
+    autocomplete_fields = ['owner']
+
+    def get_search_results(self, request, queryset, search_term):
+        # и для autocomplete книги в форме связи
+        if not search_term.strip():
+            return queryset, False
+        return get_search_backend().search(queryset, [search_term]), False
 
 
 @admin.register(UserBookRelation)
-class BookAdmin(ModelAdmin):
-    pass
+class UserBookRelationAdmin(LargeTableAdmin):
+    list_display = ['id', 'user', 'book', 'like', 'in_bookmarks', 'rate']
+    # __str__ связи читает user и book
+    list_select_related = ['user', 'book']
+    # без list_filter: у like/in_bookmarks/rate нет своих индексов, и фильтр
+    # по ним - точный COUNT(*) и выборка полным сканированием таблицы
+    # username уникален - поиск по индексу
+    search_fields = ['=user__username']
+    autocomplete_fields = ['user', 'book']
+
+    def get_queryset(self, request):
+        # заголовок и "история" формы изменения тоже через __str__
+        return super().get_queryset(request).select_related('user', 'book')
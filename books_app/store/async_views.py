@@ -0,0 +1,187 @@
+"""
+Async versions of the hot read paths and of the like/rate endpoint for
+ASGI deployments (``books_app/asgi.py``): ``/async/book/``,
+``/async/book/<id>/`` and ``/async/book_relation/<book>/``.
+
+They answer the same way as BookViewSet and UserBookRelationView, reusing
+their filter backends, pagination, validators and permission classes, but
+run on the event loop instead of taking a worker thread per request.
+Only session authentication is supported here.
+"""
+from functools import wraps
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import BACKEND_SESSION_KEY, get_user as load_user
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from django.views.decorators.http import require_http_methods
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAcceptable, \
+    NotAuthenticated, NotFound, ParseError, PermissionDenied
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from store.cache import acached_response
+from store.conditional import abook_validators, conditional_response, list_validators, \
+    set_validators
+from store.facets import book_facets, with_facets
+from store.logic import upsert_relation
+from store.models import Book
+from store.serializers import BookFastReader, BookSerializer, BulkUserBookRelationSerializer, \
+    UserBookRelationSerializer
+from store.views import BookViewSet, UserBookRelationView, only_fields, requested_fields
+from store.write_behind import get_buffer, relation_data
+
+
+def api_request(request):
+    # парсеры тела - из настроек DRF, как у синхронных view
+    return Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+
+
+def render_response(request, data, status=status.HTTP_200_OK, force=False):
+    """
+    ``data`` rendered by the renderer DRF would pick for ``request`` from
+    ``Accept`` and ``?format=``; ``force`` falls back to the first one
+    instead of raising 406, as DRF does for errors.
+    """
+    request = Request(request)
+    renderers = [renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES]
+    try:
+        renderer, media_type = request.negotiator.select_renderer(request, renderers)
+    except NotAcceptable:
+        if not force:
+            raise
+        renderer, media_type = renderers[0], renderers[0].media_type
+    content_type = media_type if renderer.charset is None else f'{media_type}; charset={renderer.charset}'
+    return HttpResponse(renderer.render(data, media_type), content_type=content_type,
+                        status=status)
+
+
+def api_errors(view_func):
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view_func(request, *args, **kwargs)
+        except APIException as exc:
+            status_code = exc.status_code
+            if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+                # как DRF с SessionAuthentication: без WWW-Authenticate - 403
+                status_code = status.HTTP_403_FORBIDDEN
+            return render_response(request, exc.detail if isinstance(exc.detail, (list, dict))
+                                   else {'detail': exc.detail}, status_code, force=True)
+    return wrapper
+
+
+async def get_user(request):
+    backend_path = await request.session.aget(BACKEND_SESSION_KEY)
+    if backend_path and not hasattr(import_string(backend_path), 'aget_user'):
+        # бекенды social-auth (GithubOAuth2) не умеют aget_user
+        return await sync_to_async(lambda: load_user(request))()
+    return await request.auser()
+
+
+async def check_permissions(request, permission_classes, view, obj=None):
+    # DRF-классам прав нужны только user и method
+    shim = SimpleNamespace(user=await get_user(request), method=request.method)
+    for permission in permission_classes:
+        permission = permission()
+        allowed = permission.has_permission(shim, view)
+        if allowed and obj is not None:
+            allowed = permission.has_object_permission(shim, view, obj)
+        if not allowed:
+            if not shim.user.is_authenticated:
+                raise NotAuthenticated()
+            raise PermissionDenied(getattr(permission, 'message', None))
+    return shim.user
+
+
+def book_view(request, action, **kwargs):
+    # BookViewSet как источник настроек filter/search/ordering/pagination
+    return BookViewSet(request=Request(request), action=action, format_kwarg=None,
+                       args=(), kwargs=kwargs)
+
+
+async def filter_books(view, queryset):
+    # индекс поиска в памяти может читать базу - это синхронный код
+    if view.request.query_params.get('search'):
+        return await sync_to_async(view.filter_queryset)(queryset)
+    return view.filter_queryset(queryset)
+
+
+@require_http_methods(['GET', 'HEAD'])
+@api_errors
+async def book_list(request):
+    view = book_view(request, 'list')
+    await check_permissions(request, BookViewSet.permission_classes, view)
+    facets = view.requested_facets(view.request)
+    fields = requested_fields(view.request, BookSerializer)
+    etag, last_modified = list_validators(request)
+    response = conditional_response(request, etag, last_modified)
+    if response is None:
+        response = await acached_response(request, lambda: fast_list(view, facets, fields))
+    return set_validators(response, etag, last_modified)
+
+
+async def fast_list(view, facets=None, fields=None):
+    reader = BookFastReader(fields)
+    books = await filter_books(view, view.get_queryset())
+    paginator = view.paginator
+    queryset = reader.queryset(books, paginator.get_ordering(view.request, books, view))
+    page = await paginator.apaginate_queryset(queryset, view.request, view=view)
+    if page is not None:
+        data = paginator.get_paginated_data(reader.many(page))
+    else:
+        data = reader.many([row async for row in queryset.aiterator()])
+    if facets:
+        data = with_facets(data, await sync_to_async(book_facets)(books, facets))
+    return render_response(view.request._request, data)
+
+
+@require_http_methods(['GET', 'HEAD'])
+@api_errors
+async def book_detail(request, pk):
+    view = book_view(request, 'retrieve', pk=pk)
+    fields = requested_fields(view.request, BookSerializer)
+    etag, last_modified = await abook_validators(request, pk)
+    response = conditional_response(request, etag, last_modified)
+    if response is None:
+        response = await acached_response(request, lambda: fast_retrieve(request, view, pk, fields))
+    return set_validators(response, etag, last_modified)
+
+
+async def fast_retrieve(request, view, pk, fields=None):
+    reader = BookFastReader(fields)
+    row = await reader.queryset(view.get_queryset()).filter(pk=pk).afirst()
+    if row is None:
+        raise NotFound('No Book matches the given query.')
+    await check_permissions(request, BookViewSet.permission_classes, view, obj=row)
+    return render_response(request, reader.to_representation(row))
+
+
+@require_http_methods(['PATCH'])
+@api_errors
+async def book_relation(request, book):
+    user = await check_permissions(request, UserBookRelationView.permission_classes, None)
+    drf_request = api_request(request)
+    fields = requested_fields(drf_request, UserBookRelationSerializer)
+    data = drf_request.data
+    if not isinstance(data, dict):
+        raise ParseError('Expected an object.')
+    # книга берется из URL, как в UserBookRelationView
+    data.pop('book', None)
+    serializer = BulkUserBookRelationSerializer(data=data, partial=True)
+    serializer.is_valid(raise_exception=True)
+    if not await Book.objects.filter(pk=book).aexists():
+        raise NotFound('No Book matches the given query.')
+
+    buffer = get_buffer()
+    if buffer is not None:
+        # write-behind, как в UserBookRelationView.update
+        if serializer.validated_data:
+            await sync_to_async(buffer.add)(user.id, book, serializer.validated_data)
+        return render_response(request, await sync_to_async(relation_data)(user.id, book, fields))
+
+    # транзакций в async ORM нет: upsert и кэш-поля книги одним синхронным блоком
+    relation = await sync_to_async(upsert_relation)(user.id, book, serializer.validated_data)
+    return render_response(request, only_fields(UserBookRelationSerializer(relation).data, fields))
@@ -0,0 +1,52 @@
+"""
+Authors of the books. ``Book.author`` follows ``Book.author_name`` (see
+``Book.save``), and every Author row holds the number of its books and
+the sums of their counters, moved by ``store.logic.apply_counters_delta``
+together with the book counters.
+
+Rows written with ``bulk_create`` (imports, seeds) skip ``Book.save``:
+``link_books`` creates their authors and links them afterwards.
+"""
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from store.models import COUNTER_FIELDS, Author, Book
+
+
+def author_counters():
+    """``update()`` kwargs that recompute the author counters from the books."""
+    books = Book.objects.filter(author=OuterRef('pk')).order_by().values('author')
+
+    def total(aggregate):
+        return Coalesce(Subquery(books.annotate(total=aggregate).values('total')), Value(0),
+                        output_field=IntegerField())
+
+    return {'books_count': total(Count('id')),
+            **{field: total(Sum(field)) for field in COUNTER_FIELDS}}
+
+
+def rebuild_author_counters(authors=None):
+    """Recompute the counters of ``authors`` (all by default) with one UPDATE."""
+    if authors is None:
+        authors = Author.objects.all()
+    return authors.update(**author_counters())
+
+
+def link_books(batch_size=1000):
+    """
+    Create the missing authors of the books without one and link them,
+    ``batch_size`` distinct names at a time. Returns the number of linked books.
+    """
+    unlinked = Book.objects.filter(author__isnull=True).exclude(author_name='')
+    linked = 0
+    while True:
+        # связанные книги из выборки уходят, так что следующая пачка - снова первая
+        names = list(unlinked.order_by('author_name').values_list('author_name', flat=True)
+                     .distinct()[:batch_size])
+        if not names:
+            return linked
+        Author.objects.bulk_create([Author(name=name) for name in names], ignore_conflicts=True)
+        authors = Author.objects.filter(name__in=names)
+        linked += unlinked.filter(author_name__in=names).update(
+            author=Subquery(authors.filter(name=OuterRef('author_name')).values('id')[:1]))
+        rebuild_author_counters(authors)
@@ -0,0 +1,135 @@
+"""
+Latency, throughput and SQL query counts of the store API, driven through
+the Django test client against the current database. Seed it first:
+
+    python manage.py seed_store --books 100000 --relations 500000
+    python manage.py benchmark api --repeat 200 --output bench.json
+    python manage.py benchmark api --repeat 200 --baseline bench.json
+
+Writes (create, relation PATCH) are rolled back at the end. The response
+cache is switched off so every request reaches the database.
+"""
+import json
+import platform
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store.benchmarks.utils import rollback
+from store.models import Book
+
+# p95 хуже базового на столько - регрессия
+REGRESSION_THRESHOLD = 0.10
+
+
+def endpoints(rnd, book_ids):
+    search_words = ('python', 'war', 'Tolstoy', 'garden', 'secret stars')
+    yield 'list', lambda client: client.get(reverse('book-list'), {'page_size': 50})
+    yield 'search', lambda client: client.get(reverse('book-list'),
+                                              {'search': rnd.choice(search_words), 'page_size': 50})
+    yield 'ordering', lambda client: client.get(reverse('book-list'),
+                                                {'ordering': rnd.choice(('price', '-price', 'author_name')),
+                                                 'page_size': 50})
+    yield 'detail', lambda client: client.get(reverse('book-detail', args=(rnd.choice(book_ids),)))
+    yield 'create', lambda client: client.post(
+        reverse('book-list'),
+        data=json.dumps({'name': f'Bench {rnd.random()}', 'price': 10, 'author_name': 'Bench'}),
+        content_type='application/json')
+    yield 'relation_patch', lambda client: client.patch(
+        reverse('userbookrelation-detail', args=(rnd.choice(book_ids),)),
+        data=json.dumps({'like': rnd.random() < 0.5}),
+        content_type='application/json')
+
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def measure(client, request, repeat):
+    timings = []
+    queries = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = request(client)
+            timings.append(time.perf_counter() - start)
+        assert response.status_code < 400, (response.status_code, response.content[:200])
+        queries.append(len(captured))
+    total = time.perf_counter() - started
+    return {
+        'requests': repeat,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'rps': repeat / total,
+        'queries_avg': sum(queries) / repeat,
+        'queries_max': max(queries),
+    }
+
+
+def compare(results, baseline, stdout):
+    regressions = 0
+    for name, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(name)
+        if not previous:
+            continue
+        change = current['p95_ms'] / previous['p95_ms'] - 1 if previous['p95_ms'] else 0
+        flag = ''
+        if change > REGRESSION_THRESHOLD or current['queries_max'] > previous['queries_max']:
+            flag = '  REGRESSION'
+            regressions += 1
+        stdout.write(f'{name:16} p95 {previous["p95_ms"]:8.2f} -> {current["p95_ms"]:8.2f}ms '
+                     f'({change:+.0%})  queries {previous["queries_max"]} -> '
+                     f'{current["queries_max"]}{flag}')
+    return regressions
+
+
+def run(repeat=100, output=None, baseline=None, stdout=None):
+    book_ids = list(Book.objects.values_list('id', flat=True)[:10000])
+    if not book_ids:
+        stdout.write('No books, run "manage.py seed_store" first.')
+        return
+    rnd = random.Random(0)
+    results = {
+        'meta': {
+            'books': Book.objects.count(),
+            'repeat': repeat,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'endpoints': {},
+    }
+
+    allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+    with override_settings(BOOKS_RESPONSE_CACHE=False, ALLOWED_HOSTS=allowed_hosts), rollback():
+        user = User.objects.create(username=f'bench_{time.time_ns()}')
+        client = Client()
+        client.force_login(user)
+        for name, request in endpoints(rnd, book_ids):
+            request(client)  # прогрев
+            stats = measure(client, request, repeat)
+            results['endpoints'][name] = stats
+            stdout.write(f'{name:16} p50 {stats["p50_ms"]:8.2f}ms  p95 {stats["p95_ms"]:8.2f}ms  '
+                         f'p99 {stats["p99_ms"]:8.2f}ms  {stats["rps"]:8.1f} req/s  '
+                         f'queries {stats["queries_avg"]:.1f} (max {stats["queries_max"]})')
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        stdout.write(f'Saved to {output}')
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), stdout)
+        stdout.write(f'{regressions} regressions against {baseline}')
+    return results
@@ -0,0 +1,191 @@
+"""
+Throughput of the book list/detail under many concurrent clients: the
+sync views through the WSGI handler with a fixed thread pool (like
+gunicorn --threads) against the async views through the ASGI handler on
+one event loop. Both go through the full middleware stack in process, so
+the numbers compare request handling, not the network. Seed it first:
+
+    python manage.py seed_store --books 10000
+    python manage.py benchmark concurrency --concurrency 200 --repeat 20
+
+Read-only: the writes are measured by ``benchmark api``.
+"""
+import asyncio
+import io
+import json
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import close_old_connections, connection
+from django.test import override_settings
+
+from store.models import Book
+
+# потоков у WSGI-сервера
+WSGI_THREADS = 8
+HOST = 'testserver'
+
+
+def requests(rnd, book_ids, count, prefix):
+    paths = []
+    for _ in range(count):
+        if rnd.random() < 0.5:
+            paths.append((f'{prefix}book/', 'page_size=50'))
+        else:
+            paths.append((f'{prefix}book/{rnd.choice(book_ids)}/', ''))
+    return paths
+
+
+def wsgi_get(app, path, query):
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': '80',
+        'HTTP_HOST': HOST,
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+    }
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result['status'] = int(status.split()[0])
+
+    body = app(environ, start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return result['status']
+
+
+async def asgi_get(app, path, query):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [(b'host', HOST.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (HOST, 80),
+    }
+    disconnected = asyncio.Event()
+    sent = False
+    result = {}
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # дальше сервер ждет только разрыва соединения
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        disconnected.set()
+    return result['status']
+
+
+def stats(timings, total):
+    timings = sorted(timings)
+    quantiles = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'requests': len(timings),
+        'rps': len(timings) / total,
+        'p50_ms': quantiles[49] * 1000,
+        'p95_ms': quantiles[94] * 1000,
+        'p99_ms': quantiles[98] * 1000,
+    }
+
+
+def run_wsgi(paths, concurrency):
+    app = get_wsgi_application()
+    timings = []
+
+    # concurrency клиентов ждут WSGI_THREADS потоков сервера, очередь входит в задержку
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WSGI_THREADS) as server, \
+            ThreadPoolExecutor(max_workers=concurrency) as clients:
+        def client(own_paths):
+            for path, query in own_paths:
+                start = time.perf_counter()
+                status = server.submit(wsgi_get, app, path, query).result()
+                timings.append(time.perf_counter() - start)
+                assert status == 200, (path, status)
+
+        for future in [clients.submit(client, paths[i::concurrency]) for i in range(concurrency)]:
+            future.result()
+    return stats(timings, time.perf_counter() - started)
+
+
+async def run_asgi(paths, concurrency):
+    app = get_asgi_application()
+    timings = []
+
+    async def client(own_paths):
+        for path, query in own_paths:
+            start = time.perf_counter()
+            status = await asgi_get(app, path, query)
+            timings.append(time.perf_counter() - start)
+            assert status == 200, (path, status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(paths[i::concurrency]) for i in range(concurrency)))
+    return stats(timings, time.perf_counter() - started)
+
+
+def run(concurrency=100, repeat=20, output=None, stdout=None):
+    book_ids = list(Book.objects.values_list('id', flat=True)[:10000])
+    if not book_ids:
+        stdout.write('No books, run "manage.py seed_store" first.')
+        return
+    results = {
+        'meta': {
+            'books': Book.objects.count(),
+            'concurrency': concurrency,
+            'repeat': repeat,
+            'wsgi_threads': WSGI_THREADS,
+            'database': connection.vendor,
+        },
+        'servers': {},
+    }
+    # обработчики сами открывают и закрывают соединения в своих потоках
+    close_old_connections()
+    allowed_hosts = [*settings.ALLOWED_HOSTS, HOST]
+    with override_settings(BOOKS_RESPONSE_CACHE=False, ALLOWED_HOSTS=allowed_hosts):
+        count = concurrency * repeat
+        results['servers']['wsgi'] = run_wsgi(
+            requests(random.Random(0), book_ids, count, '/'), concurrency)
+        results['servers']['asgi'] = asyncio.run(run_asgi(
+            requests(random.Random(0), book_ids, count, '/async/'), concurrency))
+
+    for name, server in results['servers'].items():
+        stdout.write(f'{name}  {concurrency} clients  {server["rps"]:8.1f} req/s  '
+                     f'p50 {server["p50_ms"]:8.2f}ms  p95 {server["p95_ms"]:8.2f}ms  '
+                     f'p99 {server["p99_ms"]:8.2f}ms')
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        stdout.write(f'Saved to {output}')
+    return results
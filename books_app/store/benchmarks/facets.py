@@ -0,0 +1,48 @@
+"""
+Facets of the book list on ``size`` books, response cache off: GET /book/
+with and without ``?facets=price,author`` on the whole catalog and on a
+price range, and the facet counts as one grouped query against one query
+per facet.
+
+    python manage.py benchmark facets --size 1000000
+"""
+from django.conf import settings
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from store.benchmarks.leaderboard import report
+from store.benchmarks.utils import fake_books, rollback, timeit
+from store.facets import authors_limit, book_facets, bucket_expression, price_buckets
+from store.models import Book
+
+
+def run(size=1000000, repeat=10, stdout=None):
+    allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+    with override_settings(BOOKS_RESPONSE_CACHE=False, ALLOWED_HOSTS=allowed_hosts), rollback():
+        Book.objects.bulk_create(fake_books(size), batch_size=10000)
+        stdout.write(f'{Book.objects.count()} books')
+        client = Client()
+        url = reverse('book-list')
+        for name, params in (('all', {}),
+                             ('price 50-60', {'price_min': 50, 'price_max': 60})):
+            params = {**params, 'page_size': 50}
+            report(stdout, f'{name}', lambda: client.get(url, params), repeat)
+            report(stdout, f'{name} +facets',
+                   lambda: client.get(url, {**params, 'facets': 'price,author'}), repeat)
+
+        for name, books in (('all', Book.objects.all()),
+                            ('price 50-60', Book.objects.filter(price__gte=50, price__lte=60))):
+            grouped, _ = timeit(lambda: book_facets(books, ['price', 'author']), repeat)
+            separate, _ = timeit(lambda: per_facet(books), repeat)
+            stdout.write(f'{name:12} facets: one query {grouped * 1000:8.2f}ms  '
+                         f'query per facet {separate * 1000:8.2f}ms')
+
+
+def per_facet(books):
+    # как без общего запроса: отдельный GROUP BY по книгам на каждую грань
+    prices = list(books.order_by().annotate(bucket=bucket_expression(price_buckets()))
+                  .values('bucket').annotate(n=Count('id')))
+    authors = list(books.order_by().values('author_name').annotate(n=Count('id'))
+                   .order_by('-n', 'author_name')[:authors_limit()])
+    return prices, authors
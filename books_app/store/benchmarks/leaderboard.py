@@ -0,0 +1,55 @@
+"""
+GET /book/top/?limit=100 on every board with 1000 books and with ``size``
+books, response cache off: the time should not grow with the catalog.
+
+    python manage.py benchmark leaderboard --size 1000000
+"""
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from store.benchmarks.utils import fake_books, rollback
+from store.leaderboard import BOARDS, rebuild_scores
+from store.models import Book
+
+
+def run(size=200000, repeat=50, stdout=None):
+    allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+    with override_settings(BOOKS_RESPONSE_CACHE=False, ALLOWED_HOSTS=allowed_hosts):
+        for count in sorted({1000, size}):
+            with rollback():
+                fill(count)
+                stdout.write(f'{count} books')
+                client = Client()
+                url = reverse('book-top')
+                for by in BOARDS:
+                    report(stdout, by, lambda: client.get(url, {'by': by, 'limit': 100}), repeat)
+
+
+def fill(count):
+    # счетчики как после реальных лайков/оценок, оценки - rebuild_scores
+    rnd = random.Random(0)
+    books = []
+    for book in fake_books(count):
+        book.likes_count = rnd.randint(0, 500)
+        book.rating_count = rnd.choice((0, 1, 3, 10, 50, 200))
+        book.rating_sum = sum(rnd.randint(1, 5) for _ in range(book.rating_count))
+        books.append(book)
+    Book.objects.bulk_create(books, batch_size=5000)
+    rebuild_scores()
+
+
+def report(stdout, name, request, repeat):
+    request()  # прогрев
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = request()
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    stdout.write(f'{name:10} p50 {statistics.median(timings) * 1000:7.2f}ms  '
+                 f'max {max(timings) * 1000:7.2f}ms')
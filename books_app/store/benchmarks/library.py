@@ -0,0 +1,58 @@
+"""
+GET /library/ for a user with ``size`` relations, response cache off:
+the first page, a filtered page and a page deep in the keyset.
+
+    python manage.py benchmark library --size 50000
+"""
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from store.benchmarks.utils import fake_books, rollback
+from store.models import Book, UserBookRelation
+
+
+def run(size=50000, repeat=50, stdout=None):
+    rnd = random.Random(0)
+    allowed_hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+    with override_settings(BOOKS_RESPONSE_CACHE=False, ALLOWED_HOSTS=allowed_hosts), rollback():
+        user = User.objects.create(username=f'bench_{time.time_ns()}')
+        books = Book.objects.bulk_create(fake_books(size), batch_size=5000)
+        UserBookRelation.objects.bulk_create(
+            (UserBookRelation(user=user, book=book, like=rnd.random() < 0.5,
+                              in_bookmarks=rnd.random() < 0.1,
+                              rate=rnd.choice((None, None, 3, 4, 5)))
+             for book in books),
+            batch_size=5000)
+        client = Client()
+        client.force_login(user)
+        url = reverse('library-list')
+        # курсор на середину библиотеки - пролистать до нее большими страницами
+        middle_url = f'{url}?page_size=1000'
+        for _ in range(size // 2000):
+            middle_url = client.get(middle_url).data['next'] or middle_url
+        middle_url = middle_url.replace('page_size=1000', 'page_size=50')
+
+        stdout.write(f'{size} relations')
+        for name, params in (('first page', {}),
+                             ('liked', {'like': 'true'}),
+                             ('rated 5', {'rate': 5})):
+            report(stdout, name, lambda: client.get(url, params), repeat)
+        report(stdout, 'middle page', lambda: client.get(middle_url), repeat)
+
+
+def report(stdout, name, request, repeat):
+    request()  # прогрев
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = request()
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    stdout.write(f'{name:12} p50 {statistics.median(timings) * 1000:7.2f}ms  '
+                 f'max {max(timings) * 1000:7.2f}ms')
@@ -0,0 +1,46 @@
+"""
+icontains (the old SearchFilter path) vs the configured search backend.
+
+    python manage.py benchmark search --size 100000
+"""
+import time
+
+from django.db.models import Q
+
+from store.benchmarks.utils import fake_books, rollback, timeit
+from store.models import Book
+from store.search import get_search_backend
+
+QUERIES = ('python', 'war peace', 'Tolstoy', 'garden 12', 'secret stars Austen')
+
+
+def icontains(queryset, terms):
+    for term in terms:
+        queryset = queryset.filter(Q(name__icontains=term) | Q(author_name__icontains=term))
+    return queryset
+
+
+def run(size=100000, repeat=5, stdout=None):
+    backend = get_search_backend()
+    with rollback():
+        Book.objects.bulk_create(fake_books(size), batch_size=5000)
+        backend.reset()
+
+        start = time.perf_counter()
+        if hasattr(backend, 'build'):
+            backend.build()
+        stdout.write(f'{size} books, {type(backend).__name__}, '
+                     f'index build {time.perf_counter() - start:.3f}s')
+
+        for query in QUERIES:
+            terms = query.split()
+            old_time, old_ids = timeit(
+                lambda: list(icontains(Book.objects.all(), terms).values_list('id', flat=True)),
+                repeat)
+            new_time, new_ids = timeit(
+                lambda: list(backend.search(Book.objects.all(), terms).values_list('id', flat=True)),
+                repeat)
+            stdout.write(f'{query!r:24} icontains {old_time * 1000:8.2f}ms ({len(old_ids)} rows)  '
+                         f'backend {new_time * 1000:8.2f}ms ({len(new_ids)} rows)  '
+                         f'x{old_time / new_time:.1f}')
+    backend.reset()
@@ -0,0 +1,45 @@
+"""
+BookSerializer vs BookFastReader on the annotated book list, then the
+rendering of that list: DRF's JSONRenderer, ORJSONRenderer and, when
+msgpack is installed, MessagePackRenderer.
+
+    python manage.py benchmark serialization --size 10000
+"""
+from importlib.util import find_spec
+
+from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
+
+from store.benchmarks.utils import fake_books, rollback, timeit
+from store.models import Book
+from store.renderers import MessagePackRenderer, ORJSONRenderer
+from store.serializers import BookFastReader, BookSerializer
+
+
+def run(size=10000, repeat=5, stdout=None):
+    with rollback():
+        owners = [User.objects.create(username=f'bench_owner_{i}') for i in range(10)]
+        created = Book.objects.bulk_create(fake_books(size, owners=owners), batch_size=5000)
+        # только свои книги, даже если каталог уже не пуст
+        books = Book.objects.annotated().filter(id__gte=created[0].id).order_by('id')
+
+        serializer_time, expected = timeit(
+            lambda: BookSerializer(books.all(), many=True).data, repeat)
+        reader = BookFastReader()
+        reader_time, data = timeit(lambda: reader.many(reader.queryset(books.all())), repeat)
+        assert expected == data, 'BookFastReader output differs from BookSerializer'
+
+        stdout.write(f'{size} books')
+        stdout.write(f'BookSerializer  {serializer_time * 1000:9.1f}ms')
+        stdout.write(f'BookFastReader  {reader_time * 1000:9.1f}ms  x{serializer_time / reader_time:.1f}')
+
+        renderers = [JSONRenderer(), ORJSONRenderer()]
+        if find_spec('msgpack') is not None:
+            renderers.append(MessagePackRenderer())
+        json_time, json_content = timeit(lambda: renderers[0].render(data), repeat)
+        for renderer in renderers:
+            render_time, content = timeit(lambda: renderer.render(data), repeat)
+            if renderer.format == 'json':
+                assert content == json_content, f'{type(renderer).__name__} output differs'
+            stdout.write(f'{type(renderer).__name__:20} {render_time * 1000:7.1f}ms  '
+                         f'x{json_time / render_time:.1f}  {len(content) / 1024:.0f}KB')
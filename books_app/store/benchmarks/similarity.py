@@ -0,0 +1,33 @@
+"""
+Similar books index build: ``neighbours`` over ``size`` users x ``size``
+books with 20 likes/rates per user on average and a long-tail book
+popularity. Only the matrix work, the relations are generated in memory.
+
+    python manage.py benchmark similarity --size 100000
+"""
+import time
+
+from store.similarity import _scientific, neighbours
+
+
+def run(size=100000, repeat=1, stdout=None):
+    np, _ = _scientific()
+    rng = np.random.default_rng(0)
+    count = size * 20
+    # популярность книг - длинный хвост
+    popularity = 1 / (np.arange(size) + 10) ** 0.8
+    users = rng.integers(0, size, count)
+    books = rng.choice(size, count, p=popularity / popularity.sum())
+    weights = rng.choice([1.0, 1.5, 2.0, 0.5, -0.5], count)
+    # одна связь на пару (user, book)
+    _, unique = np.unique(users * size + books, return_index=True)
+    users, books, weights = users[unique], books[unique], weights[unique]
+
+    stdout.write(f'{size} users x {size} books, {len(users)} relations')
+    for k in (10, 20):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = neighbours(users, books, weights, k)
+            timings.append(time.perf_counter() - start)
+        stdout.write(f'top {k:2}: {min(timings):7.2f}s, {len(result[0])} neighbours')
@@ -0,0 +1,44 @@
+import random
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+WORDS = ('python', 'django', 'rest', 'framework', 'history', 'war', 'peace',
+         'design', 'patterns', 'cooking', 'garden', 'ocean', 'mountain',
+         'night', 'city', 'secret', 'stars', 'love', 'code', 'data')
+FIRST_NAMES = ('Leo', 'Anna', 'Mark', 'Fyodor', 'Jane', 'Ivan', 'Maria', 'Olga')
+LAST_NAMES = ('Tolstoy', 'Summerfield', 'Austen', 'Dostoevsky', 'Orwell',
+              'Pushkin', 'Lutz', 'Beazley', 'Martin', 'Knuth')
+
+
+def fake_books(count, seed=0, owners=None):
+    from store.models import Book
+
+    rnd = random.Random(seed)
+    for i in range(count):
+        yield Book(
+            name=' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))) + f' {i}',
+            price=rnd.randint(100, 20000) / 100,
+            author_name=f'{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}',
+            owner=rnd.choice(owners) if owners else None,
+        )
+
+
+@contextmanager
+def rollback():
+    # данные для бенчмарка не должны оставаться в базе
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def timeit(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
@@ -0,0 +1,150 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+from store.routers import current_replica, replica_lag
+
+GENERATION_KEY = 'books:generation'
+HITS_KEY = 'books:stats:hits'
+MISSES_KEY = 'books:stats:misses'
+
+
+def get_cache():
+    return caches[getattr(settings, 'BOOKS_CACHE_ALIAS', 'default')]
+
+
+def _incr(cache, key, initial):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, initial, timeout=None)
+        return cache.get(key, initial)
+
+
+def user_generation_key(user_id):
+    # своя версия у библиотеки каждого пользователя
+    return f'books:generation:user:{user_id}'
+
+
+def generation(key=GENERATION_KEY):
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        # после вытеснения ключа поколение не должно начаться заново с 1,
+        # иначе ожили бы старые записи
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+def bump_generation(key=GENERATION_KEY):
+    _incr(get_cache(), key, int(time.time() * 1000))
+
+
+def invalidate():
+    """
+    Make every cached book response stale. Called right away and once more
+    after commit, so a reader can't cache pre-commit data under the new
+    generation.
+    """
+    bump_generation()
+    transaction.on_commit(bump_generation)
+
+
+def invalidate_user(*user_ids):
+    """Same as ``invalidate`` for the cached libraries of ``user_ids``."""
+    keys = [user_generation_key(user_id) for user_id in set(user_ids)]
+
+    def bump():
+        for key in keys:
+            bump_generation(key)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def response_cache_key(request, generation_key=GENERATION_KEY):
+    query = sorted(request.GET.lists())
+    raw = '|'.join([
+        request.method,
+        request.path,
+        repr(query),
+        request.META.get('HTTP_ACCEPT', ''),
+    ])
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return f'books:response:{generation_key}:{generation(generation_key)}:{digest}'
+
+
+def cached_response(request, view_func, generation_key=GENERATION_KEY, timeout=None):
+    """
+    Return the cached rendered response for ``request`` or call
+    ``view_func`` and store its rendered content once it is rendered.
+    Entries go stale when the generation under ``generation_key`` is bumped.
+    """
+    if not getattr(settings, 'BOOKS_RESPONSE_CACHE', True):
+        return view_func()
+    if getattr(request, 'reads_primary', False):
+        # после своей записи - мимо кэша: в нем может быть ответ реплики
+        cache = get_cache()
+        return cache_store(cache, response_cache_key(request, generation_key), view_func(), timeout)
+    cache, key, response = cache_lookup(request, generation_key)
+    if response is not None:
+        return response
+    return cache_store(cache, key, view_func(), timeout)
+
+
+async def acached_response(request, view_func):
+    """``cached_response`` for an async ``view_func``."""
+    if not getattr(settings, 'BOOKS_RESPONSE_CACHE', True):
+        return await view_func()
+    cache, key, response = cache_lookup(request)
+    if response is not None:
+        return response
+    return cache_store(cache, key, await view_func())
+
+
+def cache_lookup(request, generation_key=GENERATION_KEY):
+    cache = get_cache()
+    key = response_cache_key(request, generation_key)
+    cached = cache.get(key)
+    if cached is None:
+        _incr(cache, MISSES_KEY, 1)
+        return cache, key, None
+    _incr(cache, HITS_KEY, 1)
+    content, content_type, status = cached
+    response = HttpResponse(content, content_type=content_type, status=status)
+    response['X-Cache'] = 'HIT'
+    return cache, key, response
+
+
+def cache_store(cache, key, response, timeout=None):
+    response['X-Cache'] = 'MISS'
+    if response.status_code == 200:
+        if timeout is None:
+            timeout = getattr(settings, 'BOOKS_CACHE_TIMEOUT', 300)
+        if current_replica() is not None:
+            # ответ реплики может отставать - хранится не дольше ее лага
+            timeout = min(timeout, replica_lag())
+
+        def store(rendered):
+            cache.set(key, (rendered.content, rendered['Content-Type'], rendered.status_code),
+                      timeout)
+
+        if hasattr(response, 'add_post_render_callback'):
+            response.add_post_render_callback(store)
+        else:
+            store(response)
+    return response
+
+
+def cache_stats():
+    cache = get_cache()
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+        'generation': generation(),
+    }
@@ -0,0 +1,96 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+
+from store.cache import generation
+from store.models import Book
+
+
+def digest(*parts):
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def make_etag(*parts):
+    return '"%s"' % digest(*parts)
+
+
+def timestamp(value):
+    return int(value.timestamp()) if value is not None else None
+
+
+def list_validators(request):
+    """
+    ETag for a book list without touching the table: the response cache
+    generation, bumped by every write to books and relations (deletes
+    included), plus the request. No Last-Modified: the newest updated_at
+    doesn't move when a book is deleted or leaves the filter.
+    """
+    etag = make_etag(generation(), request.get_full_path(), request.META.get('HTTP_ACCEPT', ''))
+    return etag, None
+
+
+def book_validators(request, book_id, lock=False):
+    # нечисловой id падает уже в filter(): без валидаторов, 404 отдаст view
+    try:
+        queryset = Book.objects.filter(pk=book_id)
+        if lock:
+            queryset = queryset.select_for_update()
+        updated_at = queryset.values_list('updated_at', flat=True).first()
+    except (TypeError, ValueError):
+        updated_at = None
+    return book_etag(request, book_id, updated_at)
+
+
+async def abook_validators(request, book_id):
+    try:
+        updated_at = await Book.objects.filter(pk=book_id).values_list('updated_at', flat=True).afirst()
+    except (TypeError, ValueError):
+        updated_at = None
+    return book_etag(request, book_id, updated_at)
+
+
+def book_etag(request, book_id, updated_at):
+    if updated_at is None:
+        return None, None
+    # "<версия книги>-<представление>": свой ETag у каждого представления
+    # (?fields=, ?format=, Accept) для 304, а If-Match записи сверяет только версию.
+    # Путь не входит - /book/<id>/ и /async/book/<id>/ отдают одно и то же
+    representation = digest(request.META.get('QUERY_STRING', ''), request.META.get('HTTP_ACCEPT', ''))
+    etag = '"%s-%s"' % (digest(book_id, updated_at), representation[:16])
+    return etag, timestamp(updated_at)
+
+
+def etag_version(etag):
+    return etag.removeprefix('W/').strip('"').split('-')[0]
+
+
+def write_etag(request, etag):
+    """
+    The ETag to check a write's If-Match against: the sent one whose book
+    version is current (any representation of it), otherwise ``etag``.
+    """
+    version = etag_version(etag)
+    for sent in parse_etags(request.META.get('HTTP_IF_MATCH', '')):
+        if sent != '*' and etag_version(sent) == version:
+            return sent
+    return etag
+
+
+def conditional_response(request, etag, last_modified):
+    """304 for a fresh GET, 412 for a failed If-Match, otherwise None."""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    # представление и ETag зависят от Accept - и у 304 тоже
+    patch_vary_headers(response, ('Accept',))
+    if etag is not None and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if last_modified is not None and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,29 @@
+import csv
+import json
+
+
+class Echo:
+    """File-like object for csv.writer that hands the line back."""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(reader, rows):
+    for row in rows:
+        yield json.dumps(reader.to_representation(row), ensure_ascii=False,
+                         separators=(',', ':')) + '\n'
+
+
+def csv_lines(reader, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(reader.field_names)
+    for row in rows:
+        data = reader.to_representation(row)
+        yield writer.writerow([data[name] for name in reader.field_names])
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson', 'books.ndjson'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8', 'books.csv'),
+}
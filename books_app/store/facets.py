@@ -0,0 +1,94 @@
+"""
+Facet counts for the book list sidebar: ``?facets=price,author`` adds
+the number of books in every price bucket and the most frequent authors
+of the filtered list to the response.
+
+All requested facets come from one query and one pass over the filtered
+books: a CTE groups them by (price bucket, author), and each facet sums
+that small result. GROUPING SETS would need no CTE, but PostgreSQL sorts
+the whole list for one of the sets and does not run it in parallel.
+"""
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import Case, IntegerField, Value, When
+
+FACETS = ('price', 'author')
+# столбец группировки каждой грани во внутреннем запросе
+COLUMNS = {'price': 'facet_bucket', 'author': 'author_name'}
+# пустые столбцы других граней; NULL в подзапросе PostgreSQL считает текстом
+NULLS = {'price': 'CAST(NULL AS integer)', 'author': 'NULL'}
+
+
+def price_buckets():
+    return list(getattr(settings, 'BOOKS_FACET_PRICE_BUCKETS', [10, 25, 50, 100]))
+
+
+def authors_limit():
+    return getattr(settings, 'BOOKS_FACET_AUTHORS', 10)
+
+
+def bucket_expression(bounds):
+    # номер интервала: 0 - дешевле первой границы, len(bounds) - от последней
+    return Case(*(When(price__lt=bound, then=Value(number)) for number, bound in enumerate(bounds)),
+                default=Value(len(bounds)), output_field=IntegerField())
+
+
+def facets_sql(inner, names):
+    """
+    SQL of the rows ``(price bucket, author_name, count)`` of the ``names``
+    facets over the ``inner`` select, one facet column set per row and the
+    others NULL. The authors limit is the last parameter when ``author``
+    is requested.
+    """
+    columns = ', '.join(COLUMNS[name] for name in names)
+    selects = []
+    for name in names:
+        values = ', '.join(COLUMNS[other] if other == name else NULLS[other] for other in FACETS)
+        select = f'SELECT {values}, SUM(n) AS n FROM grouped GROUP BY {COLUMNS[name]}'
+        if name == 'author':
+            select = f'SELECT * FROM ({select} ORDER BY n DESC, author_name LIMIT %s) authors'
+        selects.append(select)
+    return (f'WITH grouped AS (SELECT {columns}, COUNT(*) AS n FROM ({inner}) books '
+            f'GROUP BY {columns}) ' + ' UNION ALL '.join(selects))
+
+
+def book_facets(queryset, names):
+    """``{facet: [...]}`` for the books of ``queryset``, in the order of ``FACETS``."""
+    names = [name for name in FACETS if name in names]
+    bounds = price_buckets()
+    counts = {name: {} for name in names}
+    rows = queryset.order_by().annotate(facet_bucket=bucket_expression(bounds)) \
+        .values_list(*COLUMNS.values())
+    try:
+        inner, params = rows.query.sql_with_params()
+    except EmptyResultSet:
+        # фильтр заведомо пустой (поиск ничего не нашел)
+        pass
+    else:
+        params = [*params, authors_limit()] if 'author' in names else list(params)
+        with connections[rows.db].cursor() as cursor:
+            cursor.execute(facets_sql(inner, names), params)
+            for *values, count in cursor.fetchall():
+                for name, value in zip(FACETS, values):
+                    if value is not None:
+                        counts[name][value] = int(count)
+
+    result = {}
+    if 'price' in counts:
+        lower = [None, *bounds]
+        upper = [*bounds, None]
+        result['price'] = [{'min': lower[number], 'max': upper[number],
+                            'count': counts['price'].get(number, 0)}
+                           for number in range(len(bounds) + 1)]
+    if 'author' in counts:
+        authors = sorted(counts['author'].items(), key=lambda item: (-item[1], item[0]))
+        result['author'] = [{'author_name': name, 'count': count} for name, count in authors]
+    return result
+
+
+def with_facets(data, facets):
+    # простой список (старые клиенты) оборачивается, у страницы - еще одно поле
+    if isinstance(data, list):
+        return {'results': data, 'facets': facets}
+    return {**data, 'facets': facets}
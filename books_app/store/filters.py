@@ -0,0 +1,14 @@
+from django_filters import rest_framework as filters
+
+from store.models import Book
+
+
+class BookFilter(filters.FilterSet):
+    # ?price= - точная цена, ?price_min=&price_max= - диапазон, границы включительно;
+    # ?author=<id> - книги автора
+    price_min = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    price_max = filters.NumberFilter(field_name='price', lookup_expr='lte')
+
+    class Meta:
+        model = Book
+        fields = ['price', 'price_min', 'price_max', 'author']
@@ -0,0 +1,67 @@
+"""
+Top books by likes, by average rating and by Bayesian score.
+
+The scores live on Book next to the counters and are moved by the same
+UPDATE in ``store.logic.apply_counters_delta``. Each board has an index in
+its own order, so top N is an index walk of N rows whatever the catalog
+size. The scores depend on the ``BOOKS_LEADERBOARD_*`` settings: after
+changing them run ``manage.py rebuild_leaderboard``.
+"""
+from django.conf import settings
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+
+from store.models import Book
+
+# поле оценки и условие попадания в таблицу; порядок - как у индексов Book.Meta
+BOARDS = {
+    'likes': ('likes_count', {'likes_count__gt': 0}),
+    'rating': ('rating_rank', {'rating_rank__isnull': False}),
+    'bayesian': ('bayesian_score', {'bayesian_score__isnull': False}),
+}
+
+
+def min_votes():
+    return getattr(settings, 'BOOKS_LEADERBOARD_MIN_VOTES', 5)
+
+
+def score_updates(rating_sum, rating_count):
+    """
+    ``update()`` kwargs for the stored scores, given expressions for the
+    book's new ``rating_sum`` and ``rating_count``.
+    """
+    prior_mean = float(getattr(settings, 'BOOKS_LEADERBOARD_PRIOR_MEAN', 3.0))
+    prior_votes = float(getattr(settings, 'BOOKS_LEADERBOARD_PRIOR_VOTES', 10))
+    total = Cast(rating_sum, FloatField())
+    votes = Cast(rating_count, FloatField())
+    return {
+        'rating_rank': Case(
+            When(GreaterThanOrEqual(rating_count, max(min_votes(), 1)), then=total / votes),
+            default=None, output_field=FloatField()),
+        # без оценок книги нет в таблице, а не prior_mean
+        'bayesian_score': Case(
+            When(GreaterThan(rating_count, 0),
+                 then=(total + Value(prior_votes * prior_mean)) / (votes + Value(prior_votes))),
+            default=None, output_field=FloatField()),
+    }
+
+
+def rebuild_scores(queryset=None):
+    """Recompute the scores from the counters with one UPDATE."""
+    if queryset is None:
+        queryset = Book.objects.all()
+    return queryset.update(**score_updates(F('rating_sum'), F('rating_count')))
+
+
+def top_books(by='likes', limit=10, votes=None):
+    """
+    The first ``limit`` books of the board, ``score`` annotated.
+    ``votes`` raises the minimum number of rates for the ``rating`` board.
+    """
+    field, condition = BOARDS[by]
+    queryset = Book.objects.filter(**condition)
+    if by == 'rating' and votes is not None and votes > min_votes():
+        queryset = queryset.filter(rating_count__gte=votes)
+    return queryset.select_related('owner').annotate(score=F(field)) \
+        .order_by(f'-{field}', 'id')[:limit]
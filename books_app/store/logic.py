@@ -1,3 +1,12 @@
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from store.cache import invalidate, invalidate_user
+from store.leaderboard import score_updates
+from store.models import Author, Book, UserBookRelation
+
+
 def operations(a, b, c):
     if c == '+':
         return a + b
@@ -5,3 +14,228 @@ def operations(a, b, c):
         return a * b
     if c == '-':
         return a - b
+
+
+def relation_state(relation):
+    return {
+        'book_id': relation.book_id,
+        'like': relation.like,
+        'in_bookmarks': relation.in_bookmarks,
+        'rate': relation.rate,
+    }
+
+
+def relation_counters(state):
+    # вклад одной связи в кэш-поля книги
+    rate = state['rate']
+    return {
+        'likes_count': int(bool(state['like'])),
+        'bookmarks_count': int(bool(state['in_bookmarks'])),
+        'rating_sum': rate or 0,
+        'rating_count': int(rate is not None),
+    }
+
+
+def counters_delta(old, new, deltas=None):
+    """
+    Collect per-book counter deltas for a relation that moved from the
+    ``old`` state to the ``new`` one. ``None`` means "no relation".
+    """
+    if deltas is None:
+        deltas = {}
+    for state, sign in ((old, -1), (new, 1)):
+        if state is None:
+            continue
+        book_delta = deltas.setdefault(state['book_id'], {})
+        for field, value in relation_counters(state).items():
+            book_delta[field] = book_delta.get(field, 0) + sign * value
+    return deltas
+
+
+def _grouped(deltas):
+    # строки с одинаковой дельтой обновляются одним UPDATE ... WHERE id IN (...)
+    groups = {}
+    for pk, delta in deltas.items():
+        key = tuple(sorted((field, value) for field, value in delta.items() if value))
+        if key:
+            groups.setdefault(key, []).append(pk)
+    return groups
+
+
+def apply_counters_delta(deltas):
+    now = timezone.now()
+    for key, book_ids in _grouped(deltas).items():
+        updates = {field: F(field) + value for field, value in key}
+        if 'rating_sum' in updates or 'rating_count' in updates:
+            # оценки лидерборда в том же UPDATE, из новых значений счетчиков
+            updates.update(score_updates(updates.get('rating_sum', F('rating_sum')),
+                                         updates.get('rating_count', F('rating_count'))))
+        Book.objects.filter(pk__in=book_ids).update(updated_at=now, **updates)
+
+    # авторам - сумма дельт их книг
+    changed = [book_id for book_id, delta in deltas.items() if any(delta.values())]
+    if not changed:
+        return
+    author_deltas = {}
+    books = Book.objects.filter(pk__in=changed, author__isnull=False).values_list('id', 'author_id')
+    for book_id, author_id in books:
+        author_delta = author_deltas.setdefault(author_id, {})
+        for field, value in deltas[book_id].items():
+            author_delta[field] = author_delta.get(field, 0) + value
+    for key, author_ids in _grouped(author_deltas).items():
+        Author.objects.filter(pk__in=author_ids).update(**{field: F(field) + value for field, value in key})
+
+
+def update_book_counters(old, new):
+    apply_counters_delta(counters_delta(old, new))
+
+
+RELATION_FIELDS = ('like', 'in_bookmarks', 'rate')
+
+
+def _upsert_sql(data, update, rows=1):
+    meta = UserBookRelation._meta
+    qn = connection.ops.quote_name
+    columns = ['user_id', 'book_id'] + [meta.get_field(field).column for field in RELATION_FIELDS]
+    values = f'({", ".join(["%s"] * len(columns))})'
+    sql = (f'INSERT INTO {qn(meta.db_table)} ({", ".join(qn(column) for column in columns)}) '
+           f'VALUES {", ".join([values] * rows)} '
+           f'ON CONFLICT ({qn("user_id")}, {qn("book_id")}) ')
+    if update:
+        # только присланные поля, остальные остаются как есть
+        sql += 'DO UPDATE SET ' + ', '.join(
+            f'{qn(meta.get_field(field).column)} = EXCLUDED.{qn(meta.get_field(field).column)}'
+            for field in data)
+    else:
+        sql += 'DO NOTHING'
+    return sql + f' RETURNING {", ".join(qn(column) for column in ["id"] + columns)}'
+
+
+def _relation_values(user_id, book_id, data):
+    values = {field: UserBookRelation._meta.get_field(field).get_default()
+              for field in RELATION_FIELDS}
+    values.update(data)
+    return [user_id, book_id] + [values[field] for field in RELATION_FIELDS]
+
+
+def upsert_relation(user_id, book_id, data):
+    """
+    Save the submitted ``data`` fields of the (user, book) relation with one
+    ``INSERT ... ON CONFLICT`` and move the book counters.
+
+    The locked read before it gives the exact old state for the counters.
+    When there was no row, the insert is ``DO NOTHING``: if a concurrent
+    request inserted the row first, nothing comes back and the whole step
+    is retried as an update of that row.
+    """
+    while True:
+        with transaction.atomic():
+            old = (UserBookRelation.objects.select_for_update()
+                   .filter(user_id=user_id, book_id=book_id).first())
+            if old is not None and not data:
+                return old
+            with connection.cursor() as cursor:
+                cursor.execute(_upsert_sql(data, update=old is not None),
+                               _relation_values(user_id, book_id, data))
+                row = cursor.fetchone()
+            if row is None:
+                continue
+            relation = UserBookRelation(id=row[0], user_id=user_id, book_id=book_id,
+                                        like=bool(row[3]), in_bookmarks=bool(row[4]), rate=row[5])
+            update_book_counters(relation_state(old) if old else None, relation_state(relation))
+            # сырой SQL не шлет сигналы
+            invalidate()
+            invalidate_user(user_id)
+            return relation
+
+
+def lock_relations(keys, batch_size=500):
+    """
+    ``SELECT ... FOR UPDATE`` of exactly the ``(user_id, book_id)`` pairs in
+    ``keys`` (not every relation of users x books), keyed like them. Rows
+    are locked in (user, book) order, so two batches can't deadlock.
+    """
+    keys = sorted(keys)
+    relations = {}
+    for start in range(0, len(keys), batch_size):
+        condition = Q()
+        for user_id, book_id in keys[start:start + batch_size]:
+            condition |= Q(user_id=user_id, book_id=book_id)
+        queryset = UserBookRelation.objects.select_for_update().filter(condition) \
+            .order_by('user_id', 'book_id')
+        for relation in queryset:
+            relations[(relation.user_id, relation.book_id)] = relation
+    return relations
+
+
+def insert_new_relations(changes, batch_size=500):
+    """
+    ``INSERT ... ON CONFLICT DO NOTHING`` of the ``{(user_id, book_id): data}``
+    relations. Returns the rows actually written, keyed like ``changes``;
+    the pairs missing from it were inserted by someone else in the meantime.
+    """
+    inserted = {}
+    items = list(changes.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        params = []
+        for (user_id, book_id), data in batch:
+            params += _relation_values(user_id, book_id, data)
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql((), update=False, rows=len(batch)), params)
+            for row in cursor.fetchall():
+                inserted[(row[1], row[2])] = UserBookRelation(
+                    id=row[0], user_id=row[1], book_id=row[2],
+                    like=bool(row[3]), in_bookmarks=bool(row[4]), rate=row[5])
+    return inserted
+
+
+def apply_relation_changes(changes, batch_size=500):
+    """
+    Apply ``{(user_id, book_id): {field: value}}`` in one transaction:
+    one SELECT for the existing relations, ``INSERT ... ON CONFLICT DO
+    NOTHING`` for the new ones, bulk_update for the rest and one counters
+    UPDATE per touched book. Returns the saved relations keyed like
+    ``changes``.
+
+    A pair inserted by a concurrent request after the SELECT is not
+    overwritten by the INSERT: it is locked, read and updated on the next
+    round, so the counter deltas always start from the row that is there.
+    """
+    if not changes:
+        return {}
+    user_ids = {user_id for user_id, _ in changes}
+    relations = {}
+    to_update = {}
+    update_fields = set()
+    deltas = {}
+    with transaction.atomic():
+        pending = dict(changes)
+        while pending:
+            existing = lock_relations(pending, batch_size)
+            for key, relation in existing.items():
+                old_state = relation_state(relation)
+                for field, value in pending[key].items():
+                    setattr(relation, field, value)
+                update_fields.update(pending[key])
+                to_update[key] = relation
+                counters_delta(old_state, relation_state(relation), deltas)
+                relations[key] = relation
+
+            inserted = insert_new_relations(
+                {key: pending[key] for key in sorted(pending) if key not in existing}, batch_size)
+            # счетчики - от того, что записано на самом деле
+            for key, relation in inserted.items():
+                counters_delta(None, relation_state(relation), deltas)
+                relations[key] = relation
+            pending = {key: data for key, data in pending.items()
+                       if key not in existing and key not in inserted}
+
+        if to_update:
+            UserBookRelation.objects.bulk_update(list(to_update.values()), sorted(update_fields),
+                                                 batch_size=batch_size)
+        apply_counters_delta(deltas)
+        # сырой SQL и bulk_update не шлют сигналы
+        invalidate()
+        invalidate_user(*user_ids)
+    return {key: relations[key] for key in changes}
@@ -0,0 +1,34 @@
+import inspect
+from importlib import import_module
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Run one of the store benchmarks (store/benchmarks/<name>.py).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Benchmark module, e.g. "search".')
+        parser.add_argument('--size', type=int,
+                            help='Dataset size, the default depends on the benchmark.')
+        parser.add_argument('--repeat', type=int,
+                            help='Repetitions, the default depends on the benchmark.')
+        parser.add_argument('--concurrency', type=int,
+                            help='Concurrent clients, for the load benchmarks.')
+        parser.add_argument('--output', help='Write results as JSON to this file.')
+        parser.add_argument('--baseline', help='Compare with results saved by --output.')
+
+    def handle(self, *args, **options):
+        try:
+            module = import_module(f'store.benchmarks.{options["name"]}')
+        except ImportError as e:
+            raise CommandError(f'Unknown benchmark "{options["name"]}": {e}')
+        supported = inspect.signature(module.run).parameters
+        kwargs = {'stdout': self.stdout}
+        for option in ('size', 'repeat', 'concurrency', 'output', 'baseline'):
+            if options[option] is None:
+                continue
+            if option not in supported:
+                raise CommandError(f'Benchmark "{options["name"]}" does not support --{option}.')
+            kwargs[option] = options[option]
+        module.run(**kwargs)
@@ -0,0 +1,40 @@
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from store.models import Book
+from store.similarity import build_similar_books
+
+
+class Command(BaseCommand):
+    help = 'Recompute the "readers who liked this also liked" neighbours of the books.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int, action='append', dest='books',
+                            help='Only this book, can be repeated.')
+        parser.add_argument('--changed-since',
+                            help='Only books whose likes or rates changed since this ISO datetime.')
+        parser.add_argument('--top-k', type=int, help='Neighbours per book, BOOKS_SIMILAR_TOP_K by default.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        book_ids = options['books']
+        if options['changed_since']:
+            since = parse_datetime(options['changed_since'])
+            if since is None:
+                raise CommandError(f'Invalid datetime "{options["changed_since"]}".')
+            # updated_at двигается вместе с кэш-полями, т.е. и при лайках/оценках
+            changed = Book.objects.filter(updated_at__gte=since).values_list('id', flat=True)
+            book_ids = [*(book_ids or []), *changed]
+
+        start = time.perf_counter()
+        try:
+            saved = build_similar_books(book_ids, k=options['top_k'],
+                                        batch_size=options['batch_size'])
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        books = 'all books' if book_ids is None else f'{len(book_ids)} books'
+        self.stdout.write(self.style.SUCCESS(
+            f'Saved {saved} neighbours of {books} in {time.perf_counter() - start:.1f}s.'))
@@ -0,0 +1,160 @@
+import csv
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+from store.authors import link_books
+from store.cache import invalidate
+from store.models import Book
+from store.serializers import BookImportSerializer
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        yield row
+
+
+def read_jsonl(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+# пар (name, author_name) в одном запросе проверки дублей
+LOOKUP_BATCH = 500
+
+
+def existing_books(keys):
+    """The ``(name, author_name)`` pairs of ``keys`` already in the catalog."""
+    keys = list(keys)
+    existing = set()
+    for start in range(0, len(keys), LOOKUP_BATCH):
+        condition = Q()
+        for name, author_name in keys[start:start + LOOKUP_BATCH]:
+            condition |= Q(name=name, author_name=author_name)
+        existing.update(Book.objects.filter(condition).values_list('name', 'author_name'))
+    return existing
+
+
+class Command(BaseCommand):
+    help = 'Import books from a CSV or JSONL feed (name, price, author_name) in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Feed file, "-" for stdin.')
+        parser.add_argument('--format', choices=READERS,
+                            help='Feed format, by default taken from the file extension.')
+        parser.add_argument('--owner', help='Username to set as owner of the imported books.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--checkpoint',
+                            help='Checkpoint file, default "<path>.checkpoint".')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip rows already handled according to the checkpoint.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        feed_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if feed_format not in READERS:
+            raise CommandError('Cannot guess the feed format, pass --format csv|jsonl.')
+        batch_size = options['batch_size']
+        if batch_size <= 0:
+            raise CommandError('--batch-size must be positive.')
+
+        owner = None
+        if options['owner']:
+            try:
+                owner = User.objects.get(username=options['owner'])
+            except User.DoesNotExist:
+                raise CommandError(f'User "{options["owner"]}" does not exist.')
+
+        checkpoint = options['checkpoint'] or (None if path == '-' else f'{path}.checkpoint')
+        skip = self.read_checkpoint(checkpoint) if options['resume'] else 0
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            rows = READERS[feed_format](stream)
+            for _ in islice(rows, skip):
+                pass
+            self.import_rows(rows, owner, batch_size, checkpoint, skip)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    def import_rows(self, rows, owner, batch_size, checkpoint, done):
+        # один экземпляр на весь импорт: поля сериализатора строятся один раз
+        serializer = BookImportSerializer()
+        created = duplicates = invalid = 0
+        start = time.perf_counter()
+        skipped = row_number = done
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            # дубли внутри пачки; с прошлыми пачками сверяет запрос к базе,
+            # так что память не растет с размером фида
+            seen = set()
+            books = []
+            for row in batch:
+                row_number += 1
+                try:
+                    data = serializer.run_validation(row)
+                except ValidationError as e:
+                    invalid += 1
+                    self.stderr.write(f'row {row_number}: {e.detail}')
+                    continue
+                key = (data['name'], data['author_name'])
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                books.append(Book(owner=owner, **data))
+
+            existing = existing_books(seen)
+            new_books = [book for book in books if (book.name, book.author_name) not in existing]
+            duplicates += len(books) - len(new_books)
+
+            with transaction.atomic():
+                Book.objects.bulk_create(new_books, batch_size=batch_size)
+            created += len(new_books)
+            done += len(batch)
+            self.write_checkpoint(checkpoint, done)
+
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{done} rows, {created} created, '
+                              f'{(done - skipped) / elapsed if elapsed else 0:.0f} rows/s')
+
+        # bulk_create не вызывает save() и не шлет сигналы
+        link_books(batch_size)
+        invalidate()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {created} created, {duplicates} duplicates, {invalid} invalid, '
+            f'{elapsed:.1f}s, {(row_number - skipped) / elapsed if elapsed else 0:.0f} rows/s.'))
+
+    def read_checkpoint(self, checkpoint):
+        if not checkpoint or not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as f:
+            return json.load(f)['rows']
+
+    def write_checkpoint(self, checkpoint, rows):
+        if not checkpoint:
+            return
+        tmp = f'{checkpoint}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'rows': rows}, f)
+        os.replace(tmp, checkpoint)
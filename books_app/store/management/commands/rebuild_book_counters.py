@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from store.authors import rebuild_author_counters
+from store.cache import invalidate
+from store.leaderboard import rebuild_scores
+from store.models import COUNTER_FIELDS, Author, Book
+
+
+class Command(BaseCommand):
+    help = 'Recompute Book counter fields from UserBookRelation and report drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report drift, do not write anything.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        books = Book.objects.order_by('id').annotate(
+            actual_likes_count=Count('userbookrelation', filter=Q(userbookrelation__like=True)),
+            actual_bookmarks_count=Count('userbookrelation', filter=Q(userbookrelation__in_bookmarks=True)),
+            actual_rating_sum=Coalesce(Sum('userbookrelation__rate'), 0),
+            actual_rating_count=Count('userbookrelation__rate'),
+        ).only('id', *COUNTER_FIELDS)
+
+        checked = 0
+        drifted = []
+        for book in books.iterator(chunk_size=batch_size):
+            checked += 1
+            changes = {}
+            for field in COUNTER_FIELDS:
+                actual = getattr(book, f'actual_{field}')
+                if getattr(book, field) != actual:
+                    changes[field] = (getattr(book, field), actual)
+                    setattr(book, field, actual)
+            if changes:
+                drifted.append(book)
+                details = ', '.join(f'{field}: {old} -> {new}' for field, (old, new) in changes.items())
+                self.stdout.write(f'book {book.id}: {details}')
+
+        if drifted and not options['check']:
+            # bulk_update не трогает auto_now: без новой updated_at ETag книги не изменится
+            now = timezone.now()
+            for book in drifted:
+                book.updated_at = now
+            with transaction.atomic():
+                Book.objects.bulk_update(drifted, COUNTER_FIELDS + ('updated_at',),
+                                         batch_size=batch_size)
+                drifted_ids = [book.id for book in drifted]
+                rebuild_scores(Book.objects.filter(id__in=drifted_ids))
+                rebuild_author_counters(Author.objects.filter(
+                    id__in=Book.objects.filter(id__in=drifted_ids).values('author_id')))
+                # bulk_update не шлет сигналы: кэш ответов со старыми счетчиками
+                invalidate()
+
+        action = 'found' if options['check'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Checked {checked} books, {action} drift in {len(drifted)}.'))
@@ -0,0 +1,34 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Min
+
+from store.cache import invalidate
+from store.leaderboard import rebuild_scores
+from store.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Recompute the leaderboard scores of all books from their counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--with-counters', action='store_true',
+                            help='Run rebuild_book_counters first.')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['with_counters']:
+            call_command('rebuild_book_counters', batch_size=options['batch_size'],
+                         stdout=self.stdout, stderr=self.stderr)
+
+        # диапазонами id: не держать блокировку на весь каталог
+        batch_size = options['batch_size']
+        bounds = Book.objects.aggregate(first=Min('id'), last=Max('id'))
+        updated = 0
+        if bounds['first'] is not None:
+            for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+                with transaction.atomic():
+                    updated += rebuild_scores(Book.objects.filter(
+                        id__gte=start, id__lt=start + batch_size))
+        invalidate()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt leaderboard scores of {updated} books.'))
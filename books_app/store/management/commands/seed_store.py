@@ -0,0 +1,93 @@
+import random
+from io import StringIO
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store.benchmarks.utils import fake_books
+from store.authors import link_books
+from store.cache import invalidate
+from store.models import Book, UserBookRelation
+
+
+def zipf_weights(count, exponent):
+    # немногие книги/пользователи собирают большую часть активности
+    return list(accumulate(1 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with generated users, books and relations for load tests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--relations', type=int, default=50000)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent for book popularity and user activity.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='seed',
+                            help='Username prefix of generated users.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        if options['users'] <= 0 and options['relations'] > 0:
+            raise CommandError('--relations needs at least one user.')
+
+        with transaction.atomic():
+            User.objects.bulk_create(
+                (User(username=f'{options["prefix"]}_{i}', password='!')
+                 for i in range(options['users'])),
+                batch_size=batch_size, ignore_conflicts=True)
+            user_ids = list(User.objects.filter(username__startswith=f'{options["prefix"]}_')
+                            .order_by('id').values_list('id', flat=True)[:options['users']])
+            owners = [User(id=user_id) for user_id in user_ids[:100]]
+
+            books = Book.objects.bulk_create(
+                fake_books(options['books'], seed=options['seed'], owners=owners),
+                batch_size=batch_size)
+            book_ids = [book.id for book in books]
+            self.stdout.write(f'{len(user_ids)} users, {len(book_ids)} books')
+
+            relations = self.relations(rnd, user_ids, book_ids, options['relations'],
+                                       options['skew'])
+            UserBookRelation.objects.bulk_create(relations, batch_size=batch_size)
+            self.stdout.write(f'{len(relations)} relations')
+
+        # bulk_create не обновляет кэш-поля книг, не находит авторов и не шлет сигналы
+        link_books(batch_size)
+        call_command('rebuild_book_counters', stdout=StringIO())
+        invalidate()
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def relations(self, rnd, user_ids, book_ids, count, skew):
+        if not user_ids or not book_ids:
+            return []
+        count = min(count, len(user_ids) * len(book_ids))
+        book_weights = zipf_weights(len(book_ids), skew)
+        user_weights = zipf_weights(len(user_ids), skew)
+        shuffled_books = rnd.sample(book_ids, len(book_ids))
+        shuffled_users = rnd.sample(user_ids, len(user_ids))
+        # книги только что созданы, так что пары (user, book) новые
+        pairs = set()
+        attempts = 0
+        while len(pairs) < count and attempts < count * 20:
+            attempts += 1
+            user_id = rnd.choices(shuffled_users, cum_weights=user_weights)[0]
+            book_id = rnd.choices(shuffled_books, cum_weights=book_weights)[0]
+            pairs.add((user_id, book_id))
+
+        relations = []
+        for user_id, book_id in sorted(pairs):
+            rated = rnd.random() < 0.5
+            relations.append(UserBookRelation(
+                user_id=user_id, book_id=book_id,
+                like=rnd.random() < 0.6,
+                in_bookmarks=rnd.random() < 0.2,
+                rate=rnd.choices((1, 2, 3, 4, 5), weights=(5, 10, 20, 35, 30))[0] if rated else None,
+            ))
+        return relations
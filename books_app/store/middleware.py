@@ -0,0 +1,222 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from store.routers import (current_replica, random_replica, replica_lag, replicas, reset_replica,
+                           set_replica)
+
+logger = logging.getLogger('store.timing')
+
+
+class RequestTiming:
+    """SQL and phase timings of one request; also a DB execute wrapper."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = (0.0, None)
+        self.templates = Counter()
+        self.phases = {}
+        self.marks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            self.templates[sql] += 1
+            if duration > self.slowest[0]:
+                self.slowest = (duration, sql)
+
+    def add(self, phase, duration):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def repeated_query(self):
+        # один и тот же SQL много раз с разными параметрами - признак N+1
+        if not self.templates:
+            return None, 0
+        return self.templates.most_common(1)[0]
+
+
+@contextmanager
+def timing(request, phase):
+    """
+    Add the time spent in the block to ``phase`` of the request timing.
+    Does nothing when the middleware is off.
+    """
+    stats = getattr(getattr(request, '_request', request), 'timing', None)
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add(phase, time.perf_counter() - start)
+
+
+class SQLTimingMiddleware:
+    """
+    Query count, DB time, the slowest query and view/serialize/render time
+    of every request, sent as a ``Server-Timing`` header and a JSON log
+    line to the ``store.timing`` logger. Enabled by ``BOOKS_SQL_TIMING``;
+    when it is off Django drops the middleware at startup. Works in both
+    the WSGI and the ASGI handler.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'BOOKS_SQL_TIMING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.nplusone_threshold = getattr(settings, 'BOOKS_SQL_TIMING_NPLUSONE', 10)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = request.timing = RequestTiming()
+        with self.wrap_connections(stats):
+            response = self.get_response(request)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = request.timing = RequestTiming()
+        # соединения привязаны к потоку: обертку ставим в потоке, где ORM
+        # async-запроса выполняет SQL (thread_sensitive sync_to_async)
+        stack = await sync_to_async(self.wrap_connections)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.finish(request, response, stats)
+
+    def wrap_connections(self, stats):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(stats))
+        return stack
+
+    def finish(self, request, response, stats):
+        total = time.perf_counter() - stats.started
+        if 'view' in stats.marks and 'view' not in stats.phases:
+            # ответ без рендера (HttpResponse, кэш) - время view до конца запроса
+            stats.add('view', stats.started + total - stats.marks['view'])
+        self.report(request, response, stats, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timing.marks['view'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF Response рендерится после этого хука
+        stats = request.timing
+        now = time.perf_counter()
+        if 'view' in stats.marks:
+            stats.add('view', now - stats.marks['view'])
+
+        def rendered(response):
+            stats.add('render', time.perf_counter() - now)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def report(self, request, response, stats, total):
+        template, repeats = stats.repeated_query()
+        nplusone = repeats >= self.nplusone_threshold
+        metrics = [
+            f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries"',
+        ]
+        metrics += [f'{phase};dur={duration * 1000:.2f}' for phase, duration in stats.phases.items()]
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        response['Server-Timing'] = ', '.join(metrics)
+        response['X-Query-Count'] = str(stats.queries)
+
+        data = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'phases_ms': {phase: round(duration * 1000, 2) for phase, duration in stats.phases.items()},
+            'slowest_ms': round(stats.slowest[0] * 1000, 2),
+            'slowest_sql': stats.slowest[1],
+        }
+        if nplusone:
+            data['nplusone'] = {'sql': template, 'repeats': repeats}
+            logger.warning(json.dumps(data))
+        else:
+            logger.info(json.dumps(data))
+
+
+class ReplicaMiddleware:
+    """
+    Read-your-writes for ``store.routers``: safe requests to views with
+    ``replica_reads = True`` read from a replica, unless the user wrote
+    less than ``BOOKS_REPLICA_LAG`` seconds ago. A successful write sets a
+    cookie for that long, so the next reads of the same client go to the
+    primary. Off when ``BOOKS_DATABASE_REPLICAS`` is empty. Works in both
+    the WSGI and the ASGI handler.
+    """
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'books_primary'
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_replica(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            reset_replica(token)
+        return self.finish(request, response)
+
+    def start(self, request):
+        request.reads_primary = (request.method not in SAFE_METHODS
+                                 or self.cookie_name in request.COOKIES)
+        # process_view под ASGI идет через sync_to_async, и его токен из
+        # другого контекста; сбрасываем по своему, выставленному здесь
+        return set_replica(current_replica())
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            # cookie живет столько, сколько реплика может отставать
+            response.set_cookie(self.cookie_name, '1', max_age=replica_lag(),
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', view_func)
+        if not request.reads_primary and getattr(view, 'replica_reads', False):
+            set_replica(random_replica())
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:47
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_counters(apps, schema_editor):
+    Book = apps.get_model('store', 'Book')
+    books = Book.objects.annotate(
+        relation_likes=Count('userbookrelation', filter=Q(userbookrelation__like=True)),
+        relation_bookmarks=Count('userbookrelation', filter=Q(userbookrelation__in_bookmarks=True)),
+        relation_rating_sum=Sum('userbookrelation__rate'),
+        relation_rating_count=Count('userbookrelation__rate'),
+    )
+    for book in books.iterator():
+        Book.objects.filter(pk=book.pk).update(
+            likes_count=book.relation_likes,
+            bookmarks_count=book.relation_bookmarks,
+            rating_sum=book.relation_rating_sum or 0,
+            rating_count=book.relation_rating_count,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_book_readers_alter_book_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='bookmarks_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='likes_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='userbookrelation',
+            name='rate',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Ok'), (2, 'Fine'), (3, 'Good'), (4, 'Amazing'), (5, 'Incredible')], null=True),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
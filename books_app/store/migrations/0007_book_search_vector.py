@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# Колонка и индекс нужны только на PostgreSQL: на остальных БД поиск
+# идет через in-process индекс (store.search.InvertedIndexSearchBackend).
+CREATE_SQL = [
+    """
+    ALTER TABLE store_book ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(author_name, ''))
+        ) STORED
+    """,
+    'CREATE INDEX store_book_search_vector_gin ON store_book USING GIN (search_vector)',
+]
+DROP_SQL = [
+    'DROP INDEX IF EXISTS store_book_search_vector_gin',
+    'ALTER TABLE store_book DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_book_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(CREATE_SQL), run_sql(DROP_SQL)),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # дубли (user, book) от гонок get_or_create: одна строка на пару,
+    # like/in_bookmarks - если стоят хоть в одной, rate - из самой новой с оценкой
+    UserBookRelation = apps.get_model('store', 'UserBookRelation')
+    Book = apps.get_model('store', 'Book')
+    pairs = (UserBookRelation.objects.values('user_id', 'book_id')
+             .annotate(n=Count('id')).filter(n__gt=1).order_by())
+    book_ids = set()
+    for pair in pairs.iterator():
+        relations = list(UserBookRelation.objects.filter(
+            user_id=pair['user_id'], book_id=pair['book_id']).order_by('-id'))
+        keep, duplicates = relations[0], relations[1:]
+        keep.like = any(relation.like for relation in relations)
+        keep.in_bookmarks = any(relation.in_bookmarks for relation in relations)
+        keep.rate = next((relation.rate for relation in relations if relation.rate is not None), None)
+        keep.save(update_fields=['like', 'in_bookmarks', 'rate'])
+        UserBookRelation.objects.filter(id__in=[relation.id for relation in duplicates]).delete()
+        book_ids.add(pair['book_id'])
+
+    # кэш-поля затронутых книг заново, как в 0006
+    books = Book.objects.filter(id__in=book_ids).annotate(
+        relation_likes=Count('userbookrelation', filter=Q(userbookrelation__like=True)),
+        relation_bookmarks=Count('userbookrelation', filter=Q(userbookrelation__in_bookmarks=True)),
+        relation_rating_sum=Sum('userbookrelation__rate'),
+        relation_rating_count=Count('userbookrelation__rate'),
+    )
+    for book in books.iterator():
+        Book.objects.filter(pk=book.pk).update(
+            likes_count=book.relation_likes,
+            bookmarks_count=book.relation_bookmarks,
+            rating_sum=book.relation_rating_sum or 0,
+            rating_count=book.relation_rating_count,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_book_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userbookrelation',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='store_relation_user_book_uniq'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast
+
+# значения BOOKS_LEADERBOARD_* по умолчанию на момент миграции; при других
+# настройках оценки пересчитывает manage.py rebuild_leaderboard
+MIN_VOTES = 5
+PRIOR_MEAN = 3.0
+PRIOR_VOTES = 10.0
+
+
+def fill_scores(apps, schema_editor):
+    # оценки из уже посчитанных кэш-полей, до индексов - одним UPDATE
+    Book = apps.get_model('store', 'Book')
+    total = Cast(F('rating_sum'), FloatField())
+    votes = Cast(F('rating_count'), FloatField())
+    Book.objects.update(
+        rating_rank=Case(
+            When(rating_count__gte=MIN_VOTES, then=total / votes),
+            default=None, output_field=FloatField()),
+        bayesian_score=Case(
+            When(rating_count__gt=0,
+                 then=(total + Value(PRIOR_VOTES * PRIOR_MEAN)) / (votes + Value(PRIOR_VOTES))),
+            default=None, output_field=FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_userbookrelation_user_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='bayesian_score',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_rank',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-likes_count', 'id'], name='store_book_top_likes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('rating_rank__isnull', False)), fields=['-rating_rank', 'id'], name='store_book_top_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('bayesian_score__isnull', False)), fields=['-bayesian_score', 'id'], name='store_book_top_bayesian_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def fill_authors(apps, schema_editor):
+    # по пачке различных author_name: авторы, ссылки книг и суммы счетчиков,
+    # как store.authors.link_books
+    Author = apps.get_model('store', 'Author')
+    Book = apps.get_model('store', 'Book')
+    unlinked = Book.objects.filter(author__isnull=True).exclude(author_name='')
+    books = Book.objects.filter(author=OuterRef('pk')).order_by().values('author')
+
+    def total(aggregate):
+        return Coalesce(Subquery(books.annotate(total=aggregate).values('total')), Value(0),
+                        output_field=IntegerField())
+
+    counters = {'books_count': total(Count('id'))}
+    for field in ('likes_count', 'bookmarks_count', 'rating_sum', 'rating_count'):
+        counters[field] = total(Sum(field))
+    while True:
+        names = list(unlinked.order_by('author_name').values_list('author_name', flat=True)
+                     .distinct()[:BATCH_SIZE])
+        if not names:
+            break
+        Author.objects.bulk_create([Author(name=name) for name in names], ignore_conflicts=True)
+        authors = Author.objects.filter(name__in=names)
+        unlinked.filter(author_name__in=names).update(
+            author=Subquery(authors.filter(name=OuterRef('author_name')).values('id')[:1]))
+        authors.update(**counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Author',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('books_count', models.IntegerField(default=0, editable=False)),
+                ('likes_count', models.IntegerField(default=0, editable=False)),
+                ('bookmarks_count', models.IntegerField(default=0, editable=False)),
+                ('rating_sum', models.IntegerField(default=0, editable=False)),
+                ('rating_count', models.IntegerField(default=0, editable=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='author',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='books', to='store.author'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'id'], name='store_book_author_fk_idx'),
+        ),
+        migrations.RunPython(fill_authors, migrations.RunPython.noop),
+    ]
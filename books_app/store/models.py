@@ -1,19 +1,152 @@
+from decimal import Decimal
+from functools import cache
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F, Func, OuterRef, Q, Subquery
+
+# кэш-поля книги, которые суммируются у ее автора
+COUNTER_FIELDS = ('likes_count', 'bookmarks_count', 'rating_sum', 'rating_count')
+
+
+class BookQuerySet(models.QuerySet):
+    def annotated(self):
+        # все данные для BookSerializer одним запросом, без N+1 по owner/relations
+        return self.annotate(**relation_aggregates()).select_related('owner')
+
+
+@cache
+def relation_aggregates():
+    """
+    Likes and average rate of a book as correlated subqueries rather than
+    JOIN + GROUP BY: a page is read along the ordering index and the
+    aggregates are computed only for its rows, from the (book, like) and
+    (book, rate) indexes. Built once: the ORM copies expressions on use.
+    """
+    relations = UserBookRelation.objects.filter(book=OuterRef('pk')).order_by()
+    return {
+        'annotated_likes': Subquery(relations.filter(like=True).values(
+            count=Func('id', function='COUNT', output_field=models.IntegerField()))),
+        'rating': Subquery(relations.filter(rate__isnull=False).values(
+            avg=Func('rate', function='AVG', output_field=models.FloatField()))),
+    }
+
+
+class AuthorQuerySet(models.QuerySet):
+    def add_book(self, book_id, sign=1):
+        """
+        Add the book and its counters to the authors of the queryset with
+        one UPDATE, or take them away with ``sign=-1``.
+        """
+        book = Book.objects.using(self.db).filter(pk=book_id)
+        return self.update(books_count=F('books_count') + sign, **{
+            field: F(field) + sign * Subquery(book.values(field)) for field in COUNTER_FIELDS})
+
+
+class Author(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+
+    # кэш-поля: суммы по книгам автора, двигаются вместе с кэш-полями книг (store.logic)
+    books_count = models.IntegerField(default=0, editable=False)
+    likes_count = models.IntegerField(default=0, editable=False)
+    bookmarks_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+
+    objects = AuthorQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def rating_avg(self):
+        if not self.rating_count:
+            return None
+        return (Decimal(self.rating_sum) / self.rating_count).quantize(Decimal('0.01'))
 
 
 class Book(models.Model):
     name = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=7, decimal_places=2)
+    # имя автора остается полем API, поиска и сортировки; author находится по нему в save()
     author_name = models.CharField(max_length=255)
+    # без отдельного индекса FK: его заменяет (author, id) ниже
+    author = models.ForeignKey(Author, on_delete=models.PROTECT, null=True, editable=False,
+                               related_name='books', db_index=False)
     owner = models.ForeignKey(User, on_delete=models.SET_NULL,
                               null=True, related_name='my_books')
     readers = models.ManyToManyField(User,through='UserBookRelation', related_name='books')
+    # версия книги для ETag/Last-Modified, меняется и при изменении кэш-полей
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # кэш-поля: обновляются дельтами при изменении UserBookRelation (store.logic)
+    likes_count = models.IntegerField(default=0, editable=False)
+    bookmarks_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    # оценки лидерборда (store.leaderboard), двигаются вместе с кэш-полями;
+    # NULL - книги нет в таблице (мало оценок / нет оценок)
+    rating_rank = models.FloatField(null=True, editable=False)
+    bayesian_score = models.FloatField(null=True, editable=False)
+
+    objects = BookQuerySet.as_manager()
+
+    # author_name, с которым книга прочитана из базы
+    _saved_author_name = None
 
     def __str__(self):
         # "отображение айди и имен на сайте /admin у книг"
         return f'id: {self.id}; name: {self.name}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        book._saved_author_name = book.__dict__.get('author_name')
+        return book
+
+    def save(self, *args, using=None, **kwargs):
+        using = using or router.db_for_write(Book, instance=self)
+        authors = Author.objects.db_manager(using)
+        previous = self.author_id
+        if self.author_id is None or self.author_name != self._saved_author_name:
+            self.author = authors.get_or_create(name=self.author_name)[0] \
+                if self.author_name else None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'author'}
+        if self.author_id == previous:
+            super().save(*args, using=using, **kwargs)
+        else:
+            with transaction.atomic(using=using):
+                super().save(*args, using=using, **kwargs)
+                # книга со своими счетчиками переходит к новому автору
+                if previous is not None:
+                    authors.filter(pk=previous).add_book(self.pk, -1)
+                if self.author_id is not None:
+                    authors.filter(pk=self.author_id).add_book(self.pk)
+        self._saved_author_name = self.author_name
+
+    class Meta:
+        indexes = [
+            # ?price= и ?ordering=price / author_name: фильтр, сортировка и keyset по id
+            models.Index(fields=['price', 'id'], name='store_book_price_id_idx'),
+            models.Index(fields=['author_name', 'id'], name='store_book_author_id_idx'),
+            # ?author=<id>: книги автора по порядку id
+            models.Index(fields=['author', 'id'], name='store_book_author_fk_idx'),
+            # /book/top/: ORDER BY <оценка> DESC, id LIMIT n - проход по индексу
+            models.Index(fields=['-likes_count', 'id'], name='store_book_top_likes_idx'),
+            models.Index(fields=['-rating_rank', 'id'], name='store_book_top_rating_idx',
+                         condition=Q(rating_rank__isnull=False)),
+            models.Index(fields=['-bayesian_score', 'id'], name='store_book_top_bayesian_idx',
+                         condition=Q(bayesian_score__isnull=False)),
+        ]
+
+    @property
+    def rating_avg(self):
+        if not self.rating_count:
+            return None
+        return (Decimal(self.rating_sum) / self.rating_count).quantize(Decimal('0.01'))
+
+
 class UserBookRelation(models.Model):
     RATE_CHOICES = (
         (1, 'Ok'),
@@ -23,12 +156,46 @@ class UserBookRelation(models.Model):
         (5, 'Incredible')
     )
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    # отдельные индексы FK не нужны: их заменяют составные ниже
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, db_index=False)
     like = models.BooleanField(default=False)
     in_bookmarks = models.BooleanField(default=False)
     rate = models.PositiveSmallIntegerField(choices=RATE_CHOICES, null=True)
 
+    class Meta:
+        constraints = [
+            # одна связь на пару (user, book); на нее опирается upsert в store.logic
+            models.UniqueConstraint(fields=['user', 'book'], name='store_relation_user_book_uniq'),
+        ]
+        indexes = [
+            # библиотека пользователя: WHERE user_id = ... ORDER BY id DESC LIMIT n
+            models.Index(fields=['user', 'id'], name='store_relation_user_id_idx'),
+            # связь пользователя с книгой (GET/PATCH /book_relation/) только из индекса;
+            # не INCLUDE: на SQLite такой индекс не создается
+            models.Index(fields=['user', 'book', 'like', 'in_bookmarks', 'rate'],
+                         name='store_relation_user_book_cover'),
+            # агрегаты по книге (лайки, средняя оценка) без чтения строк связей
+            models.Index(fields=['book', 'like'], name='store_relation_book_like_idx'),
+            models.Index(fields=['book', 'rate'], name='store_relation_book_rate_idx'),
+        ]
+
     def __str__(self):
         # "отображение айди и имен на сайте /admin у книг"
-        return f'{self.user.username}; {self.book.name}; {self.rate}'
\ No newline at end of file
+        return f'{self.user.username}; {self.book.name}; {self.rate}'
+
+
+class SimilarBook(models.Model):
+    # "читавшие эту книгу также лайкали": top-K соседей книги, строит store.similarity
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='similar_books')
+    similar = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            # /book/<id>/similar/: WHERE book_id = ... ORDER BY score DESC LIMIT n
+            models.Index(fields=['book', '-score'], name='store_similar_book_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id} -> {self.similar_id}: {self.score:.3f}'
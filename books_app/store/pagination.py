@@ -0,0 +1,186 @@
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over the ordering chosen by OrderingFilter with a
+    unique tie-breaker. The cursor holds the ordering values of the last
+    row, so every page is a ``WHERE (...) > (...) LIMIT n`` query and deep
+    pages cost the same as the first one.
+
+    Clients that send neither ``cursor`` nor ``page_size`` still get the
+    plain list, optionally capped by ``BOOKS_LEGACY_PAGE_SIZE``.
+    """
+    page_size = 50
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    tie_breaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+    # False - всегда страницами, даже без cursor/page_size
+    legacy_list = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.make_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.make_page([row async for row in queryset.aiterator()])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The sliced queryset of the requested page, None for the plain list."""
+        self.request = request
+        self.legacy = (self.legacy_list and
+                       self.cursor_query_param not in request.query_params and
+                       self.page_size_query_param not in request.query_params)
+        if self.legacy:
+            legacy_page_size = getattr(settings, 'BOOKS_LEGACY_PAGE_SIZE', None)
+            if legacy_page_size is None:
+                return None
+            return queryset[:legacy_page_size]
+
+        self.ordering = self.get_ordering(request, queryset, view)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(cursor))
+
+        self.limit = self.get_page_size(request)
+        # лишняя строка - признак следующей страницы
+        return queryset[:self.limit + 1]
+
+    def make_page(self, rows):
+        if self.legacy:
+            return rows
+        self.has_next = len(rows) > self.limit
+        page = rows[:self.limit]
+        self.next_values = self.row_values(page[-1]) if page else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        if self.legacy:
+            return data
+        return {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = list(ordering or [])
+        if self.tie_breaker not in [field.lstrip('-') for field in ordering]:
+            ordering.append(self.tie_breaker)
+        return ordering
+
+    def keyset_filter(self, values):
+        # (a, b, id) > (va, vb, vid) с учетом направления каждого поля
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        # лишнее по смыслу a >= va: граница для индекса, иначе OR читается с начала
+        first = self.ordering[0]
+        bound = Q(**{f'{first.lstrip("-")}__{"lte" if first.startswith("-") else "gte"}': values[0]})
+        return bound & condition
+
+    def row_values(self, row):
+        return [str(getattr(row, field.lstrip('-'))) for field in self.ordering]
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            ordering, values = payload['o'], payload['v']
+        except (TypeError, ValueError, KeyError, BinasciiError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.ordering or not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [self.clean_value(model, field.lstrip('-'), value)
+                    for field, value in zip(ordering, values)]
+        except (TypeError, ValueError, ValidationError):
+            # подделанный курсор - та же 404, а не 500 из filter()
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def clean_value(model, name, value):
+        if value is None:
+            raise ValueError('NULL in cursor')
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return value
+        return field.get_prep_value(field.to_python(value))
+
+    def encode_cursor(self, values):
+        payload = json.dumps({'o': self.ordering, 'v': values}, separators=(',', ':'))
+        encoded = b64encode(payload.encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.next_values)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class LibraryPagination(KeysetPagination):
+    legacy_list = False
+
+
+class AuthorPagination(KeysetPagination):
+    # новый эндпоинт - клиентов без страниц у него нет
+    legacy_list = False
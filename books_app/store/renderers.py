@@ -0,0 +1,77 @@
+"""
+Faster renderers for the store API, picked by the ``Accept`` header (or
+``?format=``) like any DRF renderer.
+
+``ORJSONRenderer`` writes the same bytes as DRF's ``JSONRenderer`` with
+orjson doing the encoding: Decimal, datetime and the other values orjson
+would format differently go through DRF's own encoder. The one difference
+is the spelling of floats below 1e-4 or from 1e16 up (``0.00001`` rather
+than ``1e-05``), which parse to the same number. ``MessagePack*`` speak
+``application/msgpack``: the same data as the JSON, in binary.
+
+orjson and msgpack are optional (``pip install orjson msgpack``): without
+orjson the JSON renderer falls back to DRF's encoding, and the settings
+list the MessagePack classes only when msgpack is installed.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError as e:
+        raise ImproperlyConfigured(f'MessagePack needs msgpack: {e}')
+    return msgpack
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # отступы и нестрогий JSON - только у стандартного кодировщика
+        if (orjson is None or not self.compact or self.ensure_ascii or not self.strict
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            # даты и dataclass - через default: их формат у orjson другой
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                               | orjson.OPT_PASSTHROUGH_DATACLASS)
+        except orjson.JSONEncodeError:
+            # int больше 64 бит и прочее, что orjson не умеет
+            return super().render(data, accepted_media_type, renderer_context)
+        # как JSONRenderer: U+2028/U+2029 экранируются
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # значения вне MessagePack - как в JSON (Decimal - float, даты - ISO-строки)
+        return _msgpack().packb(data, default=encoders.JSONEncoder().default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        msgpack = _msgpack()
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as e:
+            raise ParseError(f'MessagePack parse error - {e}')
@@ -0,0 +1,78 @@
+"""
+Read replicas for the store tables.
+
+``BOOKS_DATABASE_REPLICAS`` lists the ``DATABASES`` aliases of the
+replicas. ``ReplicaMiddleware`` picks one of them for the safe requests to
+views with ``replica_reads = True`` (``BookViewSet``) and ``ReplicaRouter``
+sends the store reads of that request there. Writes, and all reads of a
+user for ``BOOKS_REPLICA_LAG`` seconds after their last write, go to the
+primary so that users always see their own changes.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# алиас реплики текущего запроса; None - читать с primary
+_replica = ContextVar('books_replica', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'BOOKS_DATABASE_REPLICAS', []))
+
+
+def replica_lag():
+    return getattr(settings, 'BOOKS_REPLICA_LAG', 5)
+
+
+def current_replica():
+    return _replica.get()
+
+
+def random_replica():
+    aliases = replicas()
+    return random.choice(aliases) if aliases else None
+
+
+def set_replica(alias):
+    """
+    Route the store reads of the current context to ``alias``, ``None`` -
+    to the primary. Returns the token for ``reset_replica``.
+    """
+    return _replica.set(alias)
+
+
+def reset_replica(token):
+    _replica.reset(token)
+
+
+@contextmanager
+def use_replica(alias=None):
+    """Route the store reads in the block to ``alias`` (a random replica by default)."""
+    if alias is None:
+        alias = random_replica()
+    token = set_replica(alias)
+    try:
+        yield alias
+    finally:
+        reset_replica(token)
+
+
+class ReplicaRouter:
+    app_labels = {'store'}
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in self.app_labels:
+            return _replica.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # иначе объект, прочитанный с реплики, сохранялся бы туда же
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика - копия primary, объекты с обеих баз одни и те же
+        return True
+
@@ -0,0 +1,230 @@
+import re
+import threading
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db import connection
+from django.db.models import Count, FloatField, Max
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from django.utils.module_loading import import_string
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+from store.models import Book
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def terms_tokens(terms):
+    tokens = []
+    for term in terms:
+        tokens += tokenize(term)
+    return tokens
+
+
+class BaseSearchBackend:
+    """
+    Search over Book.name and Book.author_name. Every token of the query
+    must prefix-match a word of the name or the author: ``?search=boo``
+    finds "Book 1", ``?search=ook`` finds nothing (DRF's icontains did).
+
+    ``rank_field`` names the relevance annotation added by ``search``, if
+    the backend has one; results are ordered by it unless ``?ordering=``.
+    """
+    rank_field = None
+
+    def search(self, queryset, terms):
+        raise NotImplementedError
+
+    def index(self, book, created=False):
+        pass
+
+    def remove(self, book_id):
+        pass
+
+    def reset(self):
+        pass
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Uses the generated ``store_book.search_vector`` tsvector column with a
+    GIN index (migration 0007), so Postgres keeps it up to date itself.
+    """
+
+    rank_field = 'search_rank'
+
+    def search(self, queryset, terms):
+        tokens = terms_tokens(terms)
+        if not tokens:
+            return queryset.none()
+        query = SearchQuery(' & '.join(f'{token}:*' for token in tokens),
+                            config='simple', search_type='raw')
+        # колонки нет в модели: только в миграции
+        vector = RawSQL(f'{Book._meta.db_table}.search_vector', [],
+                        output_field=SearchVectorField())
+        # ts_rank - real; double precision, чтобы значение в курсоре
+        # KeysetPagination сравнивалось без потери точности
+        return queryset.alias(search_vector=vector).filter(search_vector=query).annotate(
+            search_rank=Cast(SearchRank(vector, query), FloatField()))
+
+
+class InvertedIndexSearchBackend(BaseSearchBackend):
+    """
+    In-process inverted index for databases without full-text search
+    (SQLite in tests and development). Built lazily from the table and kept
+    up to date by the Book signals of this process.
+
+    Changes made elsewhere (other workers, the admin of another process,
+    bulk_create) are picked up before every lookup from one aggregate:
+    rows with a newer ``updated_at`` than the index has seen are re-read,
+    and a row count that still differs (deletes) rebuilds the index.
+    ``updated_at`` is auto_now, so every save() counts; a
+    ``queryset.update()`` of name or author_name has to set updated_at
+    too, or it goes unnoticed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._postings = {}
+        self._tokens = []
+        self._documents = {}
+        self._built = False
+        # самая новая updated_at, уже прочитанная из таблицы
+        self._last = None
+
+    def _table_stats(self):
+        stats = Book.objects.order_by().aggregate(count=Count('id'), last=Max('updated_at'))
+        return stats['count'], stats['last']
+
+    def _add(self, book_id, name, author_name):
+        tokens = set(tokenize(name)) | set(tokenize(author_name))
+        self._documents[book_id] = tokens
+        for token in tokens:
+            ids = self._postings.get(token)
+            if ids is None:
+                ids = self._postings[token] = set()
+                insort(self._tokens, token)
+            ids.add(book_id)
+
+    def _discard(self, book_id):
+        for token in self._documents.pop(book_id, ()):
+            ids = self._postings[token]
+            ids.discard(book_id)
+            if not ids:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def _read(self, rows):
+        for book_id, name, author_name in rows.values_list('id', 'name', 'author_name') \
+                .iterator(chunk_size=2000):
+            self._discard(book_id)
+            self._add(book_id, name, author_name)
+
+    def build(self):
+        with self._lock:
+            self.reset()
+            # статистика до чтения строк: изменения во время чтения подхватит refresh
+            _, self._last = self._table_stats()
+            self._read(Book.objects.all())
+            self._built = True
+
+    def refresh(self):
+        """Re-read the rows changed since the last look; False when a rebuild is needed."""
+        with self._lock:
+            count, last = self._table_stats()
+            if last != self._last:
+                rows = Book.objects.all()
+                if self._last is not None:
+                    # >=: строки с той же меткой могли прийти после прошлого чтения
+                    rows = rows.filter(updated_at__gte=self._last)
+                self._read(rows)
+                self._last = last
+            return count == len(self._documents)
+
+    def index(self, book, created=False):
+        with self._lock:
+            if not self._built:
+                return
+            self._discard(book.id)
+            self._add(book.id, book.name, book.author_name)
+
+    def remove(self, book_id):
+        with self._lock:
+            if not self._built:
+                return
+            self._discard(book_id)
+
+    def _prefix_ids(self, token):
+        ids = set()
+        position = bisect_left(self._tokens, token)
+        while position < len(self._tokens) and self._tokens[position].startswith(token):
+            ids |= self._postings[self._tokens[position]]
+            position += 1
+        return ids
+
+    def lookup(self, tokens):
+        if not self._built or not self.refresh():
+            self.build()
+        with self._lock:
+            result = None
+            for token in sorted(set(tokens), key=len, reverse=True):
+                ids = self._prefix_ids(token)
+                result = ids if result is None else result & ids
+                if not result:
+                    return set()
+            return result or set()
+
+    def search(self, queryset, terms):
+        tokens = terms_tokens(terms)
+        if not tokens:
+            return queryset.none()
+        return queryset.filter(id__in=self.lookup(tokens))
+
+
+_backend = None
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'BOOKS_SEARCH_BACKEND', 'auto')
+        if path == 'auto':
+            if connection.vendor == 'postgresql':
+                _backend = PostgresSearchBackend()
+            else:
+                _backend = InvertedIndexSearchBackend()
+        else:
+            _backend = import_string(path)()
+    return _backend
+
+
+class BookSearchFilter(SearchFilter):
+    """SearchFilter that goes through the configured search backend."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return get_search_backend().search(queryset, terms)
+
+
+class BookOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that puts the best search matches first when there is
+    no ``?ordering=`` and the search backend ranks its results.
+    """
+
+    def get_default_ordering(self, view):
+        rank_field = get_search_backend().rank_field
+        if rank_field and terms_tokens(BookSearchFilter().get_search_terms(view.request)):
+            return ['-' + rank_field, 'id']
+        return super().get_default_ordering(view)
@@ -1,14 +1,213 @@
+from django.conf import settings
+from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 
-from store.models import Book, UserBookRelation
+from store.facets import FACETS
+from store.leaderboard import BOARDS, min_votes
+from store.similarity import top_k
+from store.models import Author, Book, SimilarBook, UserBookRelation
 
 
 class BookSerializer(ModelSerializer):
+    # поля берутся из Book.objects.annotated()
+    annotated_likes = serializers.IntegerField(read_only=True)
+    rating = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
+    owner_name = serializers.CharField(source='owner.username', default='',
+                                       read_only=True)
+    # id для /author/<id>/; задается через author_name
+    author = serializers.PrimaryKeyRelatedField(read_only=True)
+
     class Meta:
         model = Book
-        fields = '__all__'
+        # кэш-поля (likes_count, rating_sum ...) служебные и в API не отдаются
+        fields = ('id', 'name', 'price', 'author_name', 'author', 'owner',
+                  'annotated_likes', 'rating', 'owner_name')
+
+
+class AuthorSerializer(ModelSerializer):
+    # готовые суммы из Author, без агрегатов по книгам
+    rating = serializers.DecimalField(max_digits=3, decimal_places=2, source='rating_avg',
+                                      read_only=True)
+
+    class Meta:
+        model = Author
+        fields = ('id', 'name', 'books_count', 'likes_count', 'bookmarks_count',
+                  'rating_count', 'rating')
+
+
+class BookImportSerializer(BookSerializer):
+    # правила полей BookSerializer для manage.py import_books, owner задается командой
+    class Meta(BookSerializer.Meta):
+        fields = ('name', 'price', 'author_name')
+
 
 class UserBookRelationSerializer(ModelSerializer):
     class Meta:
         model = UserBookRelation
         fields = ('book', 'like', 'in_bookmarks', 'rate')
+
+
+class BulkUserBookRelationSerializer(UserBookRelationSerializer):
+    # существование книг проверяется одним запросом во view, а не по одной
+    book = serializers.IntegerField(min_value=1)
+
+
+class LibraryBookSerializer(BookSerializer):
+    # то же, что BookSerializer, но из кэш-полей книги: без агрегатов по связям
+    annotated_likes = serializers.IntegerField(source='likes_count', read_only=True)
+    rating = serializers.DecimalField(max_digits=3, decimal_places=2, source='rating_avg',
+                                      read_only=True)
+
+
+class FacetQuerySerializer(serializers.Serializer):
+    # ?facets=price,author в списке /book/
+    facets = serializers.CharField(required=False, allow_blank=True)
+
+    def validate_facets(self, value):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = sorted(set(names) - set(FACETS))
+        if unknown:
+            raise serializers.ValidationError(
+                f'Unknown facets: {", ".join(unknown)}. Choose from: {", ".join(FACETS)}.')
+        return names
+
+
+class FieldsQuerySerializer(serializers.Serializer):
+    """
+    ``?fields=id,name`` / ``?exclude=owner_name``: the response fields out
+    of ``context['fields']``, in that order; no parameters - all of them.
+    """
+    fields = serializers.CharField(required=False, allow_blank=True)
+    exclude = serializers.CharField(required=False, allow_blank=True)
+
+    def split(self, value):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        available = self.context['fields']
+        unknown = sorted(set(names) - set(available))
+        if unknown:
+            raise serializers.ValidationError(
+                f'Unknown fields: {", ".join(unknown)}. Choose from: {", ".join(available)}.')
+        return names
+
+    def validate_fields(self, value):
+        return self.split(value)
+
+    def validate_exclude(self, value):
+        return self.split(value)
+
+    def validate(self, attrs):
+        if not attrs.get('fields') and not attrs.get('exclude'):
+            return {'fields': None}
+        selected = attrs.get('fields') or self.context['fields']
+        fields = [name for name in self.context['fields']
+                  if name in selected and name not in attrs.get('exclude', [])]
+        if not fields:
+            raise serializers.ValidationError({'fields': ['At least one field is required.']})
+        return {'fields': fields}
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    # параметры /book/top/
+    by = serializers.ChoiceField(choices=list(BOARDS), default='likes')
+    limit = serializers.IntegerField(min_value=1, default=10)
+    min_votes = serializers.IntegerField(min_value=0, required=False)
+
+    def validate_limit(self, value):
+        max_limit = getattr(settings, 'BOOKS_LEADERBOARD_MAX_LIMIT', 100)
+        if value > max_limit:
+            raise serializers.ValidationError(f'Ensure this value is less than or equal to {max_limit}.')
+        return value
+
+    def validate_min_votes(self, value):
+        # ниже настройки книг в индексе нет
+        if value < min_votes():
+            raise serializers.ValidationError(
+                f'Ensure this value is greater than or equal to {min_votes()}.')
+        return value
+
+
+class LeaderboardSerializer(LibraryBookSerializer):
+    votes = serializers.IntegerField(source='rating_count', read_only=True)
+    # значение, по которому отсортирована таблица (score из top_books)
+    score = serializers.ReadOnlyField()
+
+    class Meta(LibraryBookSerializer.Meta):
+        fields = LibraryBookSerializer.Meta.fields + ('votes', 'score')
+
+
+class SimilarQuerySerializer(serializers.Serializer):
+    # параметры /book/<id>/similar/
+    limit = serializers.IntegerField(min_value=1, default=10)
+
+    def validate_limit(self, value):
+        # больше соседей не хранится
+        return min(value, top_k())
+
+
+class SimilarBookSerializer(ModelSerializer):
+    book = LibraryBookSerializer(source='similar', read_only=True)
+
+    class Meta:
+        model = SimilarBook
+        fields = ('score', 'book')
+
+
+class LibrarySerializer(ModelSerializer):
+    book = LibraryBookSerializer(read_only=True)
+
+    class Meta:
+        model = UserBookRelation
+        fields = ('id', 'book', 'like', 'in_bookmarks', 'rate')
+
+
+class BookFastReader:
+    """
+    Read-only shortcut for BookSerializer on list/retrieve: pulls
+    ``values_list`` rows from ``Book.objects.annotated()`` and maps them
+    straight to dicts, skipping model instances and per-field serializer
+    machinery. Decimals go through BookSerializer's own fields, so the
+    output is the same as ``BookSerializer(...).data``.
+
+    With ``fields`` only those keys are read and returned: the subqueries
+    and the owner join of the fields left out are not in the SQL at all.
+    """
+    sources = {
+        'id': 'id',
+        'name': 'name',
+        'price': 'price',
+        'author_name': 'author_name',
+        'author': 'author_id',
+        'owner': 'owner_id',
+        'annotated_likes': 'annotated_likes',
+        'rating': 'rating',
+        'owner_name': 'owner__username',
+    }
+
+    def __init__(self, fields=None):
+        serializer_fields = BookSerializer().fields
+        self.field_names = [name for name in serializer_fields if fields is None or name in fields]
+        converters = {
+            'price': self.nullable(serializer_fields['price'].to_representation),
+            'rating': self.nullable(serializer_fields['rating'].to_representation),
+            'owner_name': lambda value: '' if value is None else value,
+        }
+        self.columns = [(name, converters.get(name)) for name in self.field_names]
+
+    @staticmethod
+    def nullable(to_representation):
+        return lambda value: None if value is None else to_representation(value)
+
+    def queryset(self, queryset, ordering=()):
+        # named tuples: KeysetPagination читает поля сортировки через getattr,
+        # так что они читаются и тогда, когда в ответе их нет (после полей ответа)
+        columns = [self.sources[name] for name in self.field_names]
+        columns += [name for name in dict.fromkeys(field.lstrip('-') for field in ordering)
+                    if name not in columns]
+        return queryset.values_list(*columns, named=True)
+
+    def to_representation(self, row):
+        return {name: convert(value) if convert else value
+                for (name, convert), value in zip(self.columns, row)}
+
+    def many(self, rows):
+        return [self.to_representation(row) for row in rows]
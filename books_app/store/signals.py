@@ -0,0 +1,66 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from store.cache import invalidate, invalidate_user
+from store.logic import relation_state, update_book_counters
+from store.models import Author, Book, UserBookRelation
+from store.search import get_search_backend
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, created, **kwargs):
+    get_search_backend().index(instance, created=created)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    get_search_backend().remove(instance.id)
+
+
+@receiver(pre_delete, sender=Book)
+def remove_book_from_author(sender, instance, using, **kwargs):
+    # пока строка книги есть в базе: ее счетчики вычитаются у автора
+    Author.objects.using(using).filter(books=instance.pk).add_book(instance.pk, -1)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=UserBookRelation)
+@receiver(post_delete, sender=UserBookRelation)
+def invalidate_books_cache(sender, **kwargs):
+    invalidate()
+
+
+@receiver(post_save, sender=UserBookRelation)
+@receiver(post_delete, sender=UserBookRelation)
+def invalidate_library_cache(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+# Счетчики книг, авторов и оценки лидерборда для записей связей через ORM
+# (админка, каскадное удаление пользователя). API пишет через store.logic
+# сырым SQL и bulk-операциями - без сигналов, там счетчики двигает сам.
+@receiver(pre_save, sender=UserBookRelation)
+def remember_relation_state(sender, instance, raw, using, **kwargs):
+    if raw:
+        return
+    old = None
+    if instance.pk is not None:
+        old = UserBookRelation.objects.using(using).filter(pk=instance.pk).first()
+    instance._old_state = relation_state(old) if old is not None else None
+
+
+@receiver(post_save, sender=UserBookRelation)
+def move_counters_on_save(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    update_book_counters(instance.__dict__.pop('_old_state', None), relation_state(instance))
+
+
+@receiver(post_delete, sender=UserBookRelation)
+def move_counters_on_delete(sender, instance, origin=None, **kwargs):
+    # книга удаляется целиком: ее счетчики у автора уже вычел pre_delete книги
+    book_origin = isinstance(origin, Book) or (isinstance(origin, QuerySet) and origin.model is Book)
+    if not book_origin:
+        update_book_counters(relation_state(instance), None)
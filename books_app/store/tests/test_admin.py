@@ -0,0 +1,148 @@
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store.admin import EstimatedCountPaginator
+from store.models import Book, UserBookRelation
+
+
+# на PostgreSQL перед COUNT(*) - чтение оценки из статистики
+COUNT_QUERIES = 2 if connection.vendor == 'postgresql' else 1
+
+
+class AdminTestCase(TestCase):
+    def setUp(self):
+        # кэш типов содержимого в работе уже заполнен
+        ContentType.objects.get_for_models(Book, UserBookRelation)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        self.books = [Book.objects.create(name=f'Test book {i}', price=25, author_name='Author',
+                                          owner=self.admin)
+                      for i in range(2)]
+        self.relation = UserBookRelation.objects.create(user=self.admin, book=self.books[0], rate=5)
+
+    def add_rows(self, count):
+        users = [User.objects.create(username=f'user_{i}') for i in range(count)]
+        books = [Book.objects.create(name=f'More book {i}', price=25, author_name='Author',
+                                     owner=user)
+                 for i, user in enumerate(users)]
+        for user, book in zip(users, books):
+            UserBookRelation.objects.create(user=user, book=book, like=True)
+
+    def test_book_changelist(self):
+        url = reverse('admin:store_book_changelist')
+        # сессия, пользователь, COUNT(*) и страница
+        with self.assertNumQueries(3 + COUNT_QUERIES):
+            self.assertEqual(200, self.client.get(url).status_code)
+        self.add_rows(10)
+        with self.assertNumQueries(3 + COUNT_QUERIES):
+            response = self.client.get(url)
+        self.assertContains(response, 'More book 9')
+
+    def test_relation_changelist(self):
+        url = reverse('admin:store_userbookrelation_changelist')
+        with self.assertNumQueries(3 + COUNT_QUERIES):
+            self.assertEqual(200, self.client.get(url).status_code)
+        self.add_rows(10)
+        with self.assertNumQueries(3 + COUNT_QUERIES):
+            response = self.client.get(url)
+        self.assertContains(response, 'user_9; More book 9')
+        # фильтров без индекса нет
+        self.assertFalse(response.context['cl'].has_filters)
+        # поиск по username - точный, по уникальному индексу
+        with self.assertNumQueries(4):
+            response = self.client.get(url, {'q': 'user_9'})
+        self.assertEqual(1, response.context['cl'].result_count)
+
+    def test_book_search(self):
+        self.add_rows(10)
+        url = reverse('admin:store_book_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'q': 'more boo'})
+        self.assertEqual(10, response.context['cl'].result_count)
+        # через store.search, без LIKE '%...%' по всей таблице
+        self.assertFalse([query for query in queries.captured_queries if 'LIKE' in query['sql']])
+        response = self.client.get(url, {'q': 'more 9'})
+        self.assertEqual(1, response.context['cl'].result_count)
+        # начало слова, не подстрока
+        response = self.client.get(url, {'q': 'ore'})
+        self.assertEqual(0, response.context['cl'].result_count)
+
+    def test_book_change_form(self):
+        self.add_rows(10)
+        url = reverse('admin:store_book_change', args=(self.books[0].id,))
+        # сессия, пользователь, книга, выбранный владелец
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        # autocomplete вместо <select> со всеми пользователями
+        self.assertNotContains(response, 'user_9')
+
+    def test_relation_change_form(self):
+        self.add_rows(10)
+        url = reverse('admin:store_userbookrelation_change', args=(self.relation.id,))
+        # сессия, пользователь, связь с user и book, выбранные user и book
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertContains(response, 'admin; Test book 0; 5')
+        self.assertNotContains(response, 'More book 9')
+
+    def test_relation_edit_moves_counters(self):
+        url = reverse('admin:store_userbookrelation_change', args=(self.relation.id,))
+        response = self.client.post(url, {'user': self.admin.id, 'book': self.books[0].id,
+                                          'like': 'on', 'rate': 3})
+        self.assertEqual(302, response.status_code)
+        book = Book.objects.get(pk=self.books[0].id)
+        self.assertEqual((1, 3, 1), (book.likes_count, book.rating_sum, book.rating_count))
+
+        # перенос на другую книгу
+        self.client.post(url, {'user': self.admin.id, 'book': self.books[1].id, 'rate': 4})
+        books = Book.objects.in_bulk([book.id for book in self.books])
+        self.assertEqual((0, 0, 0), (books[self.books[0].id].likes_count,
+                                     books[self.books[0].id].rating_sum,
+                                     books[self.books[0].id].rating_count))
+        self.assertEqual((4, 1), (books[self.books[1].id].rating_sum,
+                                  books[self.books[1].id].rating_count))
+        self.assertEqual(4, books[self.books[1].id].author.rating_sum)
+
+        url = reverse('admin:store_userbookrelation_delete', args=(self.relation.id,))
+        self.client.post(url, {'post': 'yes'})
+        book = Book.objects.get(pk=self.books[1].id)
+        self.assertEqual((0, 0), (book.rating_sum, book.rating_count))
+        self.assertEqual(0, book.author.rating_sum)
+
+    def test_autocomplete(self):
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'store', 'model_name': 'userbookrelation', 'field_name': 'book',
+            'term': 'book 1'})
+        self.assertEqual([str(self.books[1])], [result['text'] for result in response.json()['results']])
+
+
+class EstimatedCountPaginatorTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='test_username')
+        Book.objects.bulk_create(Book(name=f'Test book {i}', price=25, author_name='Author',
+                                      owner=user)
+                                 for i in range(30))
+
+    @skipUnless(connection.vendor == 'postgresql', 'statistics of PostgreSQL')
+    @override_settings(BOOKS_ADMIN_ESTIMATED_COUNT=10)
+    def test_estimate(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE store_book')
+        Book.objects.filter(id__in=Book.objects.values('id')[:5]).delete()
+        # статистика снята до удаления
+        self.assertEqual(30, EstimatedCountPaginator(Book.objects.order_by('id'), 10).count)
+        # фильтр - точный COUNT(*)
+        self.assertEqual(25, EstimatedCountPaginator(Book.objects.filter(price=25).order_by('id'), 10).count)
+
+    def test_small_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE store_book')
+        Book.objects.filter(id__in=Book.objects.values('id')[:5]).delete()
+        # меньше BOOKS_ADMIN_ESTIMATED_COUNT строк - точно
+        self.assertEqual(25, EstimatedCountPaginator(Book.objects.order_by('id'), 10).count)
@@ -1,12 +1,24 @@
+import base64
+import gc
 import json
+import re
+import tracemalloc
+from decimal import Decimal
+from urllib.parse import parse_qs, urlparse
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.exceptions import ErrorDetail
 
 from rest_framework.test import APITestCase
 
+from store.cache import invalidate
+from store.leaderboard import BOARDS, top_books
+from store.logic import apply_relation_changes
 from store.models import Book, UserBookRelation
 from store.serializers import BookSerializer
 
@@ -27,8 +39,11 @@ class BooksApiTestCase(APITestCase):
     def test_get(self):
         url = reverse('book-list')
         # print(url)
-        response = self.client.get(url)
-        serializer_data = BookSerializer([self.book_1, self.book_2, self.book_3], many=True).data
+        # только сам список: ETag - из поколения кэша
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        books = Book.objects.annotated().order_by('id')
+        serializer_data = BookSerializer(books, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         # self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
         self.assertEqual(serializer_data, response.data)
@@ -37,7 +52,8 @@ class BooksApiTestCase(APITestCase):
         url = reverse('book-list')
         # print(url)
         response = self.client.get(url, {'filter': 'price'})
-        serializer_data = BookSerializer([self.book_1, self.book_2, self.book_3], many=True).data
+        books = Book.objects.annotated().order_by('id')
+        serializer_data = BookSerializer(books, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         # self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
         self.assertEqual(serializer_data, response.data)
@@ -46,7 +62,8 @@ class BooksApiTestCase(APITestCase):
         url = reverse('book-list')
         # print(url)
         response = self.client.get(url, data={'search': 'Author 1'})
-        serializer_data = BookSerializer([self.book_1, self.book_3], many=True).data
+        books = Book.objects.annotated().filter(id__in=[self.book_1.id, self.book_3.id]).order_by('id')
+        serializer_data = BookSerializer(books, many=True).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         # self.assertEqual(status.HTTP_202_ACCEPTED, response.status_code)
         self.assertEqual(serializer_data, response.data)
@@ -54,7 +71,7 @@ class BooksApiTestCase(APITestCase):
     # print(response.data)
 
     def test_get_sort(self):
-        expected_order = [self.book_1, self.book_3, self.book_2]
+        expected_order = Book.objects.annotated().order_by('price')
         # Serialize the expected order
         serializer_data = BookSerializer(expected_order, many=True).data
         url = reverse('book-list')
@@ -64,7 +81,7 @@ class BooksApiTestCase(APITestCase):
         self.assertCountEqual(serializer_data, response.data)
 
     def test_get_sort_author(self):
-        expected_order = [self.book_1, self.book_3, self.book_2]
+        expected_order = Book.objects.annotated().order_by('author_name')
         # Serialize the expected order
         serializer_data = BookSerializer(expected_order, many=True).data
         url = reverse('book-list')
@@ -163,11 +180,62 @@ class BooksApiTestCase(APITestCase):
 
     def test_get_single_book(self):
         url = reverse('book-detail', args=(self.book_1.id,))
-        response = self.client.get(url)
-        serializer_data = BookSerializer(self.book_1).data
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        serializer_data = BookSerializer(Book.objects.annotated().get(id=self.book_1.id)).data
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(serializer_data, response.data)
 
+    def test_get_annotations(self):
+        self.user2 = User.objects.create(username="test_username2")
+        UserBookRelation.objects.create(user=self.user, book=self.book_1,
+                                        like=True, rate=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.book_1,
+                                        like=True, rate=4)
+        UserBookRelation.objects.create(user=self.user2, book=self.book_2,
+                                        rate=3)
+        url = reverse('book-list')
+        response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        data = {book['id']: book for book in response.data}
+        self.assertEqual(2, data[self.book_1.id]['annotated_likes'])
+        self.assertEqual('4.50', data[self.book_1.id]['rating'])
+        self.assertEqual(0, data[self.book_2.id]['annotated_likes'])
+        self.assertEqual('3.00', data[self.book_2.id]['rating'])
+        self.assertIsNone(data[self.book_3.id]['rating'])
+        self.assertEqual('test_username', data[self.book_1.id]['owner_name'])
+
+
+class BooksQueriesTestCase(APITestCase):
+    def create_books(self, count):
+        users = [User.objects.create(username=f'user_{i}') for i in range(3)]
+        books = Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=i % 100, author_name=f'Author {i % 7}',
+                 owner=users[i % 3])
+            for i in range(count))
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=user, book=book, like=True, rate=(i % 5) + 1)
+            for i, book in enumerate(books[:100]) for user in users)
+        # bulk_create не шлет сигналы - сбрасываем кэш ответов сами
+        invalidate()
+
+    def assert_list_queries(self, count):
+        self.create_books(count)
+        url = reverse('book-list')
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(count, len(response.data))
+
+    def test_list_10(self):
+        self.assert_list_queries(10)
+
+    def test_list_1000(self):
+        self.assert_list_queries(1000)
+
+    def test_list_10000(self):
+        self.assert_list_queries(10000)
+
 
 class BooksRelationTestCase(APITestCase):
     def setUp(self):
@@ -212,6 +280,26 @@ class BooksRelationTestCase(APITestCase):
                                                 book=self.book_1)
         self.assertTrue(relation.in_bookmarks)
 
+    def test_like_counters(self):
+        url = reverse('userbookrelation-detail', args=(self.book_1.id,))
+        self.client.force_login(self.user)
+        self.client.patch(url, data=json.dumps({"like": True, "in_bookmarks": True}),
+                          content_type='application/json')
+        self.client.force_login(self.user2)
+        self.client.patch(url, data=json.dumps({"like": True}),
+                          content_type='application/json')
+        self.book_1.refresh_from_db()
+        self.assertEqual(2, self.book_1.likes_count)
+        self.assertEqual(1, self.book_1.bookmarks_count)
+
+        # повторный лайк не должен увеличивать счетчик, снятие - уменьшает
+        self.client.patch(url, data=json.dumps({"like": True}),
+                          content_type='application/json')
+        self.client.patch(url, data=json.dumps({"like": False}),
+                          content_type='application/json')
+        self.book_1.refresh_from_db()
+        self.assertEqual(1, self.book_1.likes_count)
+
     def test_rate(self):
         url = reverse('userbookrelation-detail', args=(self.book_1.id,))
         # print(url)
@@ -231,6 +319,31 @@ class BooksRelationTestCase(APITestCase):
                                                 book=self.book_1)
         self.assertEqual(3, relation.rate)
 
+    def test_not_an_object(self):
+        self.client.force_login(self.user)
+        for name in ('userbookrelation-detail', 'async-book-relation'):
+            for body in ([1, 2], 5, 'like'):
+                response = self.client.patch(reverse(name, args=(self.book_1.id,)),
+                                             data=json.dumps(body), content_type='application/json')
+                self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, (name, body))
+                self.assertEqual({'detail': 'Expected an object.'}, response.json())
+        self.assertFalse(UserBookRelation.objects.exists())
+
+    def test_rate_counters(self):
+        url = reverse('userbookrelation-detail', args=(self.book_1.id,))
+        self.client.force_login(self.user)
+        self.client.patch(url, data=json.dumps({"rate": 3}),
+                          content_type='application/json')
+        self.client.force_login(self.user2)
+        self.client.patch(url, data=json.dumps({"rate": 4}),
+                          content_type='application/json')
+        self.client.patch(url, data=json.dumps({"rate": 5}),
+                          content_type='application/json')
+        self.book_1.refresh_from_db()
+        self.assertEqual(8, self.book_1.rating_sum)
+        self.assertEqual(2, self.book_1.rating_count)
+        self.assertEqual(Decimal('4.00'), self.book_1.rating_avg)
+
     def test_rate_wrong(self):
         url = reverse('userbookrelation-detail', args=(self.book_1.id,))
         # print(url)
@@ -248,4 +361,799 @@ class BooksRelationTestCase(APITestCase):
         # self.book_1.refresh_from_db()
         relation = UserBookRelation.objects.get(user=self.user,
                                                 book=self.book_1)
-        self.assertEqual(3, relation.rate)
\ No newline at end of file
+        self.assertEqual(3, relation.rate)
+
+
+class BooksPaginationTestCase(APITestCase):
+    def setUp(self):
+        # одинаковые цены и авторы, чтобы проверить tie-breaker по id
+        self.books = Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=(i * 7) % 5, author_name=f'Author {i % 3}')
+            for i in range(23))
+        invalidate()
+
+    def walk(self, params):
+        url = reverse('book-list')
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            ids += [book['id'] for book in response.data['results']]
+            if response.data['next'] is None:
+                return ids
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.data['next'])
+            self.assertEqual(1, len(queries))
+            for query in queries:
+                self.assertNotIn('OFFSET', query['sql'].upper())
+
+    def test_walk_default(self):
+        ids = self.walk({'page_size': 5})
+        self.assertEqual([book.id for book in self.books], ids)
+
+    def test_walk_price(self):
+        ids = self.walk({'page_size': 4, 'ordering': 'price'})
+        expected = Book.objects.order_by('price', 'id').values_list('id', flat=True)
+        self.assertEqual(list(expected), ids)
+
+    def test_walk_author_desc(self):
+        ids = self.walk({'page_size': 6, 'ordering': '-author_name,price'})
+        expected = Book.objects.order_by('-author_name', 'price', 'id').values_list('id', flat=True)
+        self.assertEqual(list(expected), ids)
+
+    def test_invalid_cursor(self):
+        url = reverse('book-list')
+        response = self.client.get(url, {'cursor': 'garbage'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_forged_cursor(self):
+        def cursor(payload):
+            return base64.b64encode(json.dumps(payload).encode()).decode()
+
+        for name in ('book-list', 'async-book-list'):
+            for params in ({'cursor': cursor({'o': ['id'], 'v': ['abc']})},
+                           {'cursor': cursor({'o': ['id'], 'v': [None]})},
+                           {'cursor': cursor({'o': ['id'], 'v': [[1]]})},
+                           {'cursor': cursor({'o': ['id'], 'v': 5})},
+                           {'cursor': cursor({'o': ['price', 'id'], 'v': ['cheap', '1']}),
+                            'ordering': 'price'}):
+                response = self.client.get(reverse(name), params)
+                self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code, params)
+
+    def test_cursor_other_ordering(self):
+        url = reverse('book-list')
+        response = self.client.get(url, {'page_size': 5, 'ordering': 'price'})
+        cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+        response = self.client.get(url, {'cursor': cursor, 'ordering': 'author_name'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_legacy_list(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        self.assertEqual(23, len(response.data))
+
+    @override_settings(BOOKS_LEGACY_PAGE_SIZE=10)
+    def test_legacy_list_cap(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        self.assertEqual([book.id for book in self.books[:10]],
+                         [book['id'] for book in response.data])
+
+
+class BooksRelationBulkTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.books = Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=10, author_name='Author') for i in range(30))
+        self.url = reverse('userbookrelation-bulk')
+
+    def post(self, items):
+        return self.client.post(self.url, data=json.dumps(items),
+                                content_type='application/json')
+
+    def test_bulk(self):
+        UserBookRelation.objects.create(user=self.user, book=self.books[0], rate=2)
+        Book.objects.filter(id=self.books[0].id).update(rating_sum=2, rating_count=1)
+        self.client.force_login(self.user)
+        items = [{'book': book.id, 'like': True, 'rate': 5} for book in self.books]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(items)
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.data)
+        # количество запросов не зависит от числа элементов
+        self.assertLess(len(queries), 15)
+        self.assertEqual(30, UserBookRelation.objects.filter(user=self.user, like=True,
+                                                             rate=5).count())
+        self.assertEqual({'book': self.books[0].id, 'status': 'ok', 'like': True,
+                          'in_bookmarks': False, 'rate': 5}, response.data[0])
+        self.books[0].refresh_from_db()
+        self.assertEqual(1, self.books[0].likes_count)
+        self.assertEqual(5, self.books[0].rating_sum)
+        self.assertEqual(1, self.books[0].rating_count)
+
+    def test_bulk_per_item_errors(self):
+        self.client.force_login(self.user)
+        response = self.post([
+            {'book': self.books[0].id, 'like': True},
+            {'book': self.books[1].id, 'rate': 6},
+            {'book': 100500, 'like': True},
+            {'like': True},
+            'garbage',
+            {'book': self.books[0].id, 'in_bookmarks': True},
+        ])
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(['ok', 'error', 'error', 'error', 'error', 'ok'],
+                         [item['status'] for item in response.data])
+        self.assertIn('rate', response.data[1]['errors'])
+        self.assertIn('book', response.data[2]['errors'])
+        self.assertIn('book', response.data[3]['errors'])
+        relation = UserBookRelation.objects.get(user=self.user, book=self.books[0])
+        self.assertTrue(relation.like)
+        self.assertTrue(relation.in_bookmarks)
+        self.assertEqual(1, UserBookRelation.objects.count())
+
+    def test_bulk_not_list(self):
+        self.client.force_login(self.user)
+        response = self.post({'book': self.books[0].id})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    @override_settings(BOOKS_BULK_MAX_ITEMS=10)
+    def test_bulk_too_many(self):
+        self.client.force_login(self.user)
+        response = self.post([{'book': book.id, 'like': True} for book in self.books])
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_bulk_anonymous(self):
+        response = self.post([{'book': self.books[0].id, 'like': True}])
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+
+class BooksCacheTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1', owner=self.user)
+
+    def test_list_cached(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+        # ни одного запроса: ETag - из поколения кэша
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual('HIT', cached['X-Cache'])
+        self.assertEqual(response.content, cached.content)
+        self.assertEqual('application/json', cached['Content-Type'])
+
+    def test_key_covers_query(self):
+        url = reverse('book-list')
+        self.client.get(url, {'search': 'Test'})
+        self.assertEqual('HIT', self.client.get(url, {'search': 'Test'})['X-Cache'])
+        self.assertEqual('MISS', self.client.get(url, {'search': 'Author'})['X-Cache'])
+        self.assertEqual('MISS', self.client.get(url, {'search': 'Test', 'ordering': 'price'})['X-Cache'])
+        self.assertEqual('MISS', self.client.get(url, {'search': 'Test', 'page_size': 1})['X-Cache'])
+
+    def test_invalidate_on_create(self):
+        url = reverse('book-list')
+        self.client.get(url)
+        self.client.force_login(self.user)
+        self.client.post(url, data=json.dumps({"name": "New", "price": 10, "author_name": "A"}),
+                         content_type='application/json')
+        response = self.client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(2, len(response.data))
+
+    def test_invalidate_on_update_and_delete(self):
+        url = reverse('book-detail', args=(self.book_1.id,))
+        self.client.get(url)
+        self.client.force_login(self.user)
+        self.client.patch(url, data=json.dumps({"price": 30}), content_type='application/json')
+        response = self.client.get(url)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual('30.00', response.data['price'])
+
+        self.client.delete(url)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, self.client.get(url).status_code)
+
+    def test_invalidate_on_relation(self):
+        url = reverse('book-detail', args=(self.book_1.id,))
+        self.client.get(url)
+        self.client.force_login(self.user)
+        self.client.patch(reverse('userbookrelation-detail', args=(self.book_1.id,)),
+                          data=json.dumps({"like": True}), content_type='application/json')
+        response = self.client.get(url)
+        self.assertEqual(1, response.data['annotated_likes'])
+
+        self.client.get(url)
+        self.client.post(reverse('userbookrelation-bulk'),
+                         data=json.dumps([{"book": self.book_1.id, "like": False}]),
+                         content_type='application/json')
+        response = self.client.get(url)
+        self.assertEqual(0, response.data['annotated_likes'])
+
+    @override_settings(BOOKS_RESPONSE_CACHE=False)
+    def test_disabled(self):
+        url = reverse('book-list')
+        self.client.get(url)
+        self.assertNotIn('X-Cache', self.client.get(url))
+
+    def test_stats(self):
+        url = reverse('book-list')
+        self.client.get(url)
+        self.client.get(url)
+        staff = User.objects.create(username="staff", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('book-cache-stats'))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertGreaterEqual(response.data['hits'], 1)
+        self.assertGreaterEqual(response.data['misses'], 1)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('book-cache-stats'))
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+
+class BooksConditionalTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1', owner=self.user)
+        self.book_2 = Book.objects.create(name="Test book 2", price=55,
+                                          author_name='Author 2', owner=self.user)
+
+    def test_list_not_modified(self):
+        url = reverse('book-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        # max(updated_at) не видит удаленных книг - только ETag
+        self.assertNotIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+
+        # другой запрос - другая версия
+        other = self.client.get(url, {'ordering': 'price'})
+        self.assertNotEqual(etag, other['ETag'])
+
+    def test_list_etag_changes(self):
+        url = reverse('book-list')
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.user)
+        self.client.patch(reverse('userbookrelation-detail', args=(self.book_1.id,)),
+                          data=json.dumps({"like": True}), content_type='application/json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+        etag = response['ETag']
+        self.book_2.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        # удалена более старая книга: max(updated_at) тот же, список - нет
+        etag = response['ETag']
+        self.book_1.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag,
+                                   HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([], response.data)
+
+    def test_detail_not_modified(self):
+        url = reverse('book-detail', args=(self.book_1.id,))
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        self.assertEqual(status.HTTP_404_NOT_FOUND,
+                         self.client.get(reverse('book-detail', args=(100500,))).status_code)
+
+    def test_detail_representations(self):
+        for name in ('book-detail', 'async-book-detail'):
+            url = reverse(name, args=(self.book_1.id,))
+            response = self.client.get(url)
+            etag = response['ETag']
+            self.assertIn('Accept', response['Vary'])
+            # та же версия книги, но другое представление - не 304
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag,
+                                       HTTP_ACCEPT='application/json; indent=4')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertNotEqual(etag, response['ETag'])
+            response = self.client.get(url, {'format': 'json'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+            self.assertIn('Accept', response['Vary'])
+
+    def test_non_numeric_id(self):
+        url = '/book/abc/'
+        self.client.force_login(self.user)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, self.client.get(url).status_code)
+        for method in ('put', 'patch', 'delete'):
+            response = getattr(self.client, method)(url, data=json.dumps({'price': 30}),
+                                                    content_type='application/json')
+            self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code, method)
+
+    def test_if_match(self):
+        url = reverse('book-detail', args=(self.book_1.id,))
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.user)
+        response = self.client.patch(url, data=json.dumps({"price": 30}),
+                                     content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+
+        # второй клиент со старым ETag не должен затереть изменения
+        response = self.client.patch(url, data=json.dumps({"price": 40}),
+                                     content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(status.HTTP_412_PRECONDITION_FAILED, response.status_code)
+        response = self.client.delete(url, HTTP_IF_MATCH=etag)
+        self.assertEqual(status.HTTP_412_PRECONDITION_FAILED, response.status_code)
+        self.book_1.refresh_from_db()
+        self.assertEqual(30, self.book_1.price)
+
+    def test_if_match_any_representation(self):
+        # ETag из GET с ?fields= / другим Accept годится для If-Match записи без них
+        url = reverse('book-detail', args=(self.book_1.id,))
+        self.client.force_login(self.user)
+        for params, headers in (({'fields': 'name'}, {}),
+                                ({}, {'HTTP_ACCEPT': 'application/json; indent=4'}),
+                                ({'format': 'json'}, {})):
+            etag = self.client.get(url, params, **headers)['ETag']
+            response = self.client.patch(url, data=json.dumps({'price': 30}),
+                                         content_type='application/json', HTTP_IF_MATCH=etag)
+            self.assertEqual(status.HTTP_200_OK, response.status_code, params or headers)
+            # версия та же - тот же ETag и у GET без параметров
+            self.assertEqual(response['ETag'], self.client.get(url)['ETag'])
+            response = self.client.patch(url, data=json.dumps({'price': 35}),
+                                         content_type='application/json', HTTP_IF_MATCH=etag)
+            self.assertEqual(status.HTTP_412_PRECONDITION_FAILED, response.status_code)
+        etag = self.client.get(url, {'fields': 'id'})['ETag']
+        response = self.client.delete(url, HTTP_IF_MATCH=f'"stale", {etag}')
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+
+
+class BooksExportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1', owner=self.user)
+        self.book_2 = Book.objects.create(name="Test book 2", price=55,
+                                          author_name='Author 2')
+        self.book_3 = Book.objects.create(name="Test book 3 Author 1", price=65,
+                                          author_name='Author 3', owner=self.user)
+        self.url = reverse('book-export')
+
+    def test_ndjson(self):
+        response = self.client.get(self.url, {'search': 'Author 1', 'ordering': '-price'})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.streaming)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        books = Book.objects.annotated().filter(id__in=[self.book_3.id, self.book_1.id]).order_by('-price')
+        self.assertEqual(list(BookSerializer(books, many=True).data),
+                         [json.loads(line) for line in lines])
+
+    def test_csv(self):
+        response = self.client.get(self.url, {'export_format': 'csv', 'price': 55})
+        self.assertEqual('text/csv; charset=utf-8', response['Content-Type'])
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual('id,name,price,author_name,author,owner,annotated_likes,rating,owner_name\r\n'
+                         f'{self.book_2.id},Test book 2,55.00,Author 2,{self.book_2.author_id},,0,,\r\n',
+                         content)
+
+    def test_wrong_format(self):
+        response = self.client.get(self.url, {'export_format': 'xml'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class BooksExportMemoryTestCase(APITestCase):
+    def export_peak(self, count):
+        Book.objects.all().delete()
+        Book.objects.bulk_create(
+            (Book(name=f'Book {i} ' + 'x' * 100, price=i % 1000, author_name=f'Author {i % 50}')
+             for i in range(count)), batch_size=2000)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            response = self.client.get(reverse('book-export'))
+            size = 0
+            for chunk in response.streaming_content:
+                size += len(chunk)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(size, count * 100)
+        return peak
+
+    def test_memory_flat(self):
+        small = self.export_peak(2000)
+        large = self.export_peak(20000)
+        # 10x больше строк, а пик памяти почти тот же
+        self.assertLess(large, small * 2, (small, large))
+
+
+class BooksLibraryTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.user2 = User.objects.create(username="test_username2")
+        self.books = [Book.objects.create(name=f"Test book {i}", price=25 + i,
+                                          author_name='Author', owner=self.user2)
+                      for i in range(4)]
+        self.liked = UserBookRelation.objects.create(user=self.user, book=self.books[0], like=True)
+        self.bookmarked = UserBookRelation.objects.create(user=self.user, book=self.books[1],
+                                                          in_bookmarks=True)
+        self.rated = UserBookRelation.objects.create(user=self.user, book=self.books[2],
+                                                     like=True, rate=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.books[3], like=True)
+        # кэш-поля, как после PATCH
+        Book.objects.filter(pk__in=[self.books[0].pk, self.books[2].pk]).update(likes_count=1)
+        Book.objects.filter(pk=self.books[2].pk).update(rating_sum=5, rating_count=1)
+        self.url = reverse('library-list')
+        self.client.force_login(self.user)
+
+    def ids(self, response):
+        return [item['id'] for item in response.data['results']]
+
+    def test_get(self):
+        # сессия, пользователь и одна страница связей с книгами
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.rated.id, self.bookmarked.id, self.liked.id], self.ids(response))
+        self.assertIsNone(response.data['next'])
+        self.assertEqual({
+            'id': self.rated.id,
+            'book': {
+                'id': self.books[2].id,
+                'name': 'Test book 2',
+                'price': '27.00',
+                'author_name': 'Author',
+                'author': self.books[2].author_id,
+                'owner': self.user2.id,
+                'annotated_likes': 1,
+                'rating': '5.00',
+                'owner_name': 'test_username2',
+            },
+            'like': True,
+            'in_bookmarks': False,
+            'rate': 5,
+        }, response.data['results'][0])
+
+    def test_filter(self):
+        response = self.client.get(self.url, {'like': 'true'})
+        self.assertEqual([self.rated.id, self.liked.id], self.ids(response))
+        response = self.client.get(self.url, {'in_bookmarks': 'true'})
+        self.assertEqual([self.bookmarked.id], self.ids(response))
+        response = self.client.get(self.url, {'rate__gte': 4})
+        self.assertEqual([self.rated.id], self.ids(response))
+        response = self.client.get(self.url, {'rate__isnull': 'true', 'ordering': 'id'})
+        self.assertEqual([self.liked.id, self.bookmarked.id], self.ids(response))
+
+    def test_pagination(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual([self.rated.id, self.bookmarked.id], self.ids(response))
+        with self.assertNumQueries(3):
+            response = self.client.get(response.data['next'])
+        self.assertEqual([self.liked.id], self.ids(response))
+        self.assertIsNone(response.data['next'])
+
+    def test_cache(self):
+        self.assertEqual('MISS', self.client.get(self.url)['X-Cache'])
+        with self.assertNumQueries(2):
+            self.assertEqual('HIT', self.client.get(self.url)['X-Cache'])
+
+        # чужие записи не сбрасывают библиотеку
+        UserBookRelation.objects.create(user=self.user2, book=self.books[0], like=True)
+        self.assertEqual('HIT', self.client.get(self.url)['X-Cache'])
+
+        self.client.patch(reverse('userbookrelation-detail', args=(self.books[3].id,)),
+                          data=json.dumps({'in_bookmarks': True}),
+                          content_type='application/json')
+        response = self.client.get(self.url)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(4, len(response.data['results']))
+
+        self.client.force_login(self.user2)
+        response = self.client.get(self.url)
+        self.assertEqual([self.books[0].id, self.books[3].id],
+                         sorted(item['book']['id'] for item in response.data['results']))
+
+    def test_not_authenticated(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+
+
+@override_settings(BOOKS_LEADERBOARD_MIN_VOTES=2, BOOKS_LEADERBOARD_PRIOR_MEAN=3.0,
+                   BOOKS_LEADERBOARD_PRIOR_VOTES=2)
+class BooksLeaderboardTestCase(APITestCase):
+    def setUp(self):
+        invalidate()
+        users = [User.objects.create(username=f"test_username{i}") for i in range(3)]
+        self.user = users[0]
+        self.book_1, self.book_2, self.book_3, self.book_4 = [
+            Book.objects.create(name=f"Test book {i}", price=25, author_name='Author',
+                                owner=self.user)
+            for i in range(1, 5)]
+        # через store.logic, как PATCH: кэш-поля и оценки двигаются вместе
+        changes = {
+            (users[0].id, self.book_1.id): {'like': True, 'rate': 5},
+            (users[1].id, self.book_1.id): {'like': True, 'rate': 5},
+            (users[0].id, self.book_2.id): {'like': True, 'rate': 5},
+        }
+        for user in users:
+            changes[(user.id, self.book_3.id)] = {'rate': 4}
+        apply_relation_changes(changes)
+        self.url = reverse('book-top')
+
+    def top(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        # из кэша приходит готовый HttpResponse, без .data
+        return [(item['rank'], item['id'], item['score']) for item in response.json()['results']]
+
+    def test_likes(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual('likes', response.json()['by'])
+        self.assertEqual({
+            'rank': 1,
+            'id': self.book_1.id,
+            'name': 'Test book 1',
+            'price': '25.00',
+            'author_name': 'Author',
+            'author': self.book_1.author_id,
+            'owner': self.user.id,
+            'annotated_likes': 2,
+            'rating': '5.00',
+            'owner_name': 'test_username0',
+            'votes': 2,
+            'score': 2,
+        }, response.json()['results'][0])
+        self.assertEqual([(1, self.book_1.id, 2), (2, self.book_2.id, 1)], self.top())
+        self.assertEqual([(1, self.book_1.id, 2)], self.top(limit=1))
+
+    def test_rating(self):
+        # book_2: одна оценка, меньше BOOKS_LEADERBOARD_MIN_VOTES
+        self.assertEqual([(1, self.book_1.id, 5.0), (2, self.book_3.id, 4.0)],
+                         self.top(by='rating'))
+        self.assertEqual([(1, self.book_3.id, 4.0)], self.top(by='rating', min_votes=3))
+
+    def test_bayesian(self):
+        # (сумма + 2 * 3.0) / (число + 2)
+        self.assertEqual([self.book_1.id, self.book_2.id, self.book_3.id],
+                         [book_id for _, book_id, _ in self.top(by='bayesian')])
+        scores = [score for _, _, score in self.top(by='bayesian')]
+        for expected, score in zip((16 / 4, 11 / 3, 18 / 5), scores):
+            self.assertAlmostEqual(expected, score)
+
+    def test_incremental(self):
+        self.top(by='rating')
+        self.client.force_login(self.user)
+        url = reverse('userbookrelation-detail', args=(self.book_1.id,))
+        response = self.client.patch(url, data=json.dumps({'rate': 1}),
+                                     content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([(1, self.book_3.id, 4.0), (2, self.book_1.id, 3.0)],
+                         self.top(by='rating'))
+
+        response = self.client.patch(url, data=json.dumps({'rate': None}),
+                                     content_type='application/json')
+        self.assertEqual([(1, self.book_3.id, 4.0)], self.top(by='rating'))
+        self.book_1.refresh_from_db()
+        self.assertAlmostEqual(11 / 3, self.book_1.bayesian_score)
+
+    def test_invalid(self):
+        response = self.client.get(self.url, {'by': 'price'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.get(self.url, {'limit': 101})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        response = self.client.get(self.url, {'by': 'rating', 'min_votes': 1})
+        self.assertEqual({'min_votes': ['Ensure this value is greater than or equal to 2.']},
+                         response.json())
+
+    def test_index_order(self):
+        # порядок из индекса: без сортировки всего каталога
+        for by in BOARDS:
+            queryset = top_books(by, 10)
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+                self.assertIn(f'store_book_top_{by}_idx', plan)
+                self.assertNotIn('Sort', plan)
+            elif connection.vendor == 'sqlite':
+                plan = queryset.explain()
+                self.assertIn(f'store_book_top_{by}_idx', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+@override_settings(BOOKS_FACET_PRICE_BUCKETS=[20, 50], BOOKS_FACET_AUTHORS=2)
+class BooksFacetsTestCase(APITestCase):
+    def setUp(self):
+        invalidate()
+        Book.objects.bulk_create(
+            Book(name=f'Book {i}', price=price, author_name=author)
+            for i, (price, author) in enumerate([(10, 'Author 1'), (20, 'Author 1'), (30, 'Author 2'),
+                                                 (49.99, 'Author 2'), (50, 'Author 2'),
+                                                 (70, 'Author 3'), (90, 'Author 1')]))
+        self.url = reverse('book-list')
+
+    def test_price_range(self):
+        response = self.client.get(self.url, {'price_min': 20, 'price_max': 50})
+        self.assertEqual([Decimal('20.00'), Decimal('30.00'), Decimal('49.99'), Decimal('50.00')],
+                         [Decimal(book['price']) for book in response.json()])
+        response = self.client.get(self.url, {'price_min': 60})
+        self.assertEqual(2, len(response.json()))
+        response = self.client.get(self.url, {'price_max': 'cheap'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_facets(self):
+        # список и одним запросом обе грани
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'facets': 'price,author'})
+        data = response.json()
+        self.assertEqual(7, len(data['results']))
+        self.assertEqual([{'min': None, 'max': 20, 'count': 1},
+                          {'min': 20, 'max': 50, 'count': 3},
+                          {'min': 50, 'max': None, 'count': 3}], data['facets']['price'])
+        # лучшие BOOKS_FACET_AUTHORS, при равенстве - по имени
+        self.assertEqual([{'author_name': 'Author 1', 'count': 3},
+                          {'author_name': 'Author 2', 'count': 3}], data['facets']['author'])
+
+    def test_facets_filtered(self):
+        response = self.client.get(self.url, {'facets': 'author', 'price_min': 50, 'page_size': 1})
+        data = response.json()
+        # по всему отфильтрованному списку, а не по странице
+        self.assertEqual(1, len(data['results']))
+        self.assertIsNotNone(data['next'])
+        self.assertEqual({'author': [{'author_name': 'Author 1', 'count': 1},
+                                     {'author_name': 'Author 2', 'count': 1}]}, data['facets'])
+
+        response = self.client.get(self.url, {'facets': 'price', 'search': 'nothing'})
+        self.assertEqual([], response.json()['results'])
+        self.assertEqual([0, 0, 0], [bucket['count'] for bucket in response.json()['facets']['price']])
+
+    def test_facets_cached(self):
+        params = {'facets': 'price', 'price_max': 50}
+        self.client.get(self.url, params)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, params)
+        self.assertEqual('HIT', response['X-Cache'])
+        self.assertEqual('MISS', self.client.get(self.url, {**params, 'facets': 'author'})['X-Cache'])
+
+    def test_unknown_facet(self):
+        response = self.client.get(self.url, {'facets': 'price,color'})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertEqual({'facets': ['Unknown facets: color. Choose from: price, author.']},
+                         response.json())
+        # без facets - прежний ответ
+        self.assertIsInstance(self.client.get(self.url, {'facets': ''}).json(), list)
+
+
+@override_settings(BOOKS_RESPONSE_CACHE=False)
+class BooksFieldsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test_username')
+        self.book_1 = Book.objects.create(name='Test book 1', price=25, author_name='Author 1',
+                                          owner=self.user)
+        self.book_2 = Book.objects.create(name='Test book 2', price=15, author_name='Author 2',
+                                          owner=self.user)
+        UserBookRelation.objects.create(user=self.user, book=self.book_1, like=True, rate=5)
+
+    def get(self, url, params, table='store_book'):
+        # ответ и столбцы SELECT ... FROM table (последний такой запрос - сама страница)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.content)
+        sql = [query['sql'] for query in queries.captured_queries
+               if f'FROM "{table}"' in query['sql'] and 'COUNT(' not in query['sql']][-1]
+        columns = sql[:sql.index(f' FROM "{table}"')]
+        return response.json(), re.findall(rf'"{table}"\."(\w+)"', columns), sql
+
+    def test_list(self):
+        data, columns, sql = self.get(reverse('book-list'), {'fields': 'id,name', 'page_size': 1})
+        self.assertEqual([{'id': self.book_1.id, 'name': 'Test book 1'}], data['results'])
+        self.assertEqual(['id', 'name'], columns)
+        # без подзапросов по связям и JOIN владельца
+        self.assertNotIn('store_userbookrelation', sql)
+        self.assertNotIn('auth_user', sql)
+        response = self.client.get(data['next'])
+        self.assertEqual([{'id': self.book_2.id, 'name': 'Test book 2'}], response.json()['results'])
+
+    def test_ordering(self):
+        # поле сортировки читается для курсора, но в ответ не попадает
+        data, columns, _ = self.get(reverse('book-list'),
+                                    {'fields': 'name', 'ordering': 'price', 'page_size': 1})
+        self.assertEqual([{'name': 'Test book 2'}], data['results'])
+        self.assertEqual(['name', 'price', 'id'], columns)
+        response = self.client.get(data['next'])
+        self.assertEqual([{'name': 'Test book 1'}], response.json()['results'])
+
+    def test_exclude(self):
+        data, columns, sql = self.get(reverse('book-list'),
+                                      {'exclude': 'annotated_likes,rating,owner_name'})
+        self.assertEqual(['id', 'name', 'price', 'author_name', 'author', 'owner'], list(data[0]))
+        self.assertEqual(['id', 'name', 'price', 'author_name', 'author_id', 'owner_id'], columns)
+        self.assertNotIn('store_userbookrelation', sql)
+        self.assertNotIn('auth_user', sql)
+        data, _, _ = self.get(reverse('book-list'), {'fields': 'id,rating', 'exclude': 'id'})
+        self.assertEqual([{'rating': '5.00'}, {'rating': None}], data)
+
+    def test_retrieve(self):
+        url = reverse('book-detail', args=(self.book_1.id,))
+        data, columns, sql = self.get(url, {'fields': 'rating,owner_name'})
+        self.assertEqual({'rating': '5.00', 'owner_name': 'test_username'}, data)
+        # столбцы книги - только id внутри подзапроса рейтинга
+        self.assertEqual(['id'], columns)
+        self.assertIn('AVG(', sql)
+        self.assertNotIn('"like"', sql)
+        self.assertIn('auth_user', sql)
+        self.assertEqual(['id', 'name'], list(self.client.get(url, {'fields': 'name,id'}).json()))
+
+    def test_not_modified(self):
+        for name in ('book-detail', 'async-book-detail'):
+            url = reverse(name, args=(self.book_1.id,))
+            etag = self.client.get(url, {'fields': 'id,name'})['ETag']
+            response = self.client.get(url, {'fields': 'id,name'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+            # другой набор полей - другое представление
+            for params in ({'fields': 'id,price'}, {'exclude': 'name'}, {}):
+                response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(status.HTTP_200_OK, response.status_code, params)
+                self.assertNotEqual(etag, response['ETag'])
+
+    @override_settings(BOOKS_RESPONSE_CACHE=True)
+    def test_cached(self):
+        invalidate()
+        for name in ('book-detail', 'async-book-detail'):
+            url = reverse(name, args=(self.book_1.id,))
+            self.assertEqual('MISS', self.client.get(url, {'fields': 'id,name'})['X-Cache'])
+            self.assertEqual('HIT', self.client.get(url, {'fields': 'id,name'})['X-Cache'])
+            response = self.client.get(url, {'fields': 'price'})
+            self.assertEqual('MISS', response['X-Cache'])
+            self.assertEqual({'price': '25.00'}, response.json())
+
+    def test_export(self):
+        response = self.client.get(reverse('book-export'), {'export_format': 'csv', 'fields': 'id,price'})
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(f'id,price\r\n{self.book_1.id},25.00\r\n{self.book_2.id},15.00\r\n', content)
+
+    def test_unknown(self):
+        for name, params in (('book-list', {'fields': 'id,secret'}),
+                             ('book-list', {'exclude': 'likes_count'}),
+                             ('async-book-list', {'fields': 'secret'})):
+            response = self.client.get(reverse(name), params)
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+            self.assertIn('Unknown fields', json.dumps(response.json()))
+        response = self.client.get(reverse('book-detail', args=(self.book_1.id,)),
+                                   {'exclude': ','.join(BookSerializer.Meta.fields)})
+        self.assertEqual({'fields': ['At least one field is required.']}, response.json())
+
+    def test_relation(self):
+        self.client.force_login(self.user)
+        url = reverse('userbookrelation-detail', args=(self.book_1.id,))
+        data, columns, _ = self.get(url, {'fields': 'like,rate'}, table='store_userbookrelation')
+        self.assertEqual({'like': True, 'rate': 5}, data)
+        self.assertEqual(['like', 'rate'], columns)
+        # только книга - связь не читается
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'book'})
+        self.assertEqual({'book': self.book_1.id}, response.json())
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'store_userbookrelation' in query['sql']])
+
+        response = self.client.patch(f'{url}?fields=rate', {'rate': 4}, format='json')
+        self.assertEqual({'rate': 4}, response.json())
+        response = self.client.patch(f'{url}?fields=stars', {'rate': 1}, format='json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        # ошибка до записи
+        self.assertEqual(4, UserBookRelation.objects.get(user=self.user, book=self.book_1).rate)
+
+        response = self.client.post(f'{reverse("userbookrelation-bulk")}?exclude=like,in_bookmarks',
+                                    [{'book': self.book_2.id, 'like': True}], format='json')
+        self.assertEqual([{'book': self.book_2.id, 'status': 'ok', 'rate': None}], response.json())
+        response = self.client.patch(
+            f'{reverse("async-book-relation", args=(self.book_2.id,))}?fields=like',
+            {'rate': 3}, format='json')
+        self.assertEqual({'like': True}, response.json())
@@ -0,0 +1,132 @@
+import json
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+
+from store.cache import invalidate
+from store.models import Book, UserBookRelation
+
+
+class AsyncBooksTestCase(TestCase):
+    def setUp(self):
+        invalidate()
+        self.user = User.objects.create(username="test_username")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1', owner=self.user)
+        self.book_2 = Book.objects.create(name="Test book 2", price=55,
+                                          author_name='Author 2', owner=self.user)
+        self.book_3 = Book.objects.create(name="Test book 3 Author 1", price=65,
+                                          author_name='Author 3', owner=self.user)
+        UserBookRelation.objects.create(user=self.user, book=self.book_1, like=True, rate=5)
+
+    async def assertSameAsSync(self, params):
+        response = await self.async_client.get(reverse('async-book-list'), params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        expected = await self.async_client.get(reverse('book-list'), params)
+        # ссылки next ведут на свой эндпоинт
+        self.assertEqual(expected.content, response.content.replace(b'/async/book/', b'/book/'))
+        return response
+
+    async def test_list(self):
+        response = await self.assertSameAsSync({})
+        self.assertEqual(3, len(response.json()))
+
+    async def test_list_search_ordering(self):
+        response = await self.assertSameAsSync({'search': 'Author 1', 'ordering': '-price'})
+        self.assertEqual([self.book_3.id, self.book_1.id], [book['id'] for book in response.json()])
+        await self.assertSameAsSync({'price': 55})
+
+    async def test_list_pagination(self):
+        response = await self.assertSameAsSync({'page_size': 2})
+        next_url = response.json()['next']
+        self.assertIn('/async/book/', next_url)
+        response = await self.async_client.get(next_url)
+        self.assertEqual([self.book_3.id], [book['id'] for book in response.json()['results']])
+        response = await self.async_client.get(reverse('async-book-list'), {'cursor': 'bad'})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    async def test_list_facets(self):
+        response = await self.assertSameAsSync({'facets': 'price,author', 'price_min': 50})
+        self.assertEqual(2, len(response.json()['results']))
+        self.assertEqual(2, sum(author['count'] for author in response.json()['facets']['author']))
+
+    async def test_list_fields(self):
+        response = await self.assertSameAsSync({'fields': 'name,rating', 'ordering': '-price',
+                                                'page_size': 2})
+        self.assertEqual([{'name': 'Test book 3 Author 1', 'rating': None},
+                          {'name': 'Test book 2', 'rating': None}], response.json()['results'])
+        # вторая страница: курсор по price, которого в ответе нет
+        query = parse_qs(urlparse(response.json()['next']).query)
+        response = await self.assertSameAsSync({name: values[0] for name, values in query.items()})
+        self.assertEqual([{'name': 'Test book 1', 'rating': '5.00'}], response.json()['results'])
+        response = await self.async_client.get(reverse('async-book-detail', args=(self.book_1.id,)),
+                                               {'exclude': 'owner_name,owner'})
+        self.assertNotIn('owner', response.json())
+
+    async def test_list_not_modified(self):
+        response = await self.async_client.get(reverse('async-book-list'))
+        response = await self.async_client.get(reverse('async-book-list'),
+                                               headers={'If-None-Match': response['ETag']})
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+    async def test_detail(self):
+        url = reverse('async-book-detail', args=(self.book_1.id,))
+        response = await self.async_client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        expected = await self.async_client.get(reverse('book-detail', args=(self.book_1.id,)))
+        self.assertEqual(expected.json(), response.json())
+        self.assertEqual('5.00', response.json()['rating'])
+
+        response = await self.async_client.get(reverse('async-book-detail', args=(0,)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    async def test_methods(self):
+        response = await self.async_client.post(reverse('async-book-list'))
+        self.assertEqual(status.HTTP_405_METHOD_NOT_ALLOWED, response.status_code)
+
+
+class AsyncRelationTestCase(TestCase):
+    def setUp(self):
+        invalidate()
+        self.user = User.objects.create(username="test_username")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1', owner=self.user)
+        self.url = reverse('async-book-relation', args=(self.book_1.id,))
+
+    async def patch(self, data):
+        return await self.async_client.patch(self.url, data=json.dumps(data),
+                                             content_type='application/json')
+
+    async def test_not_authenticated(self):
+        response = await self.patch({'like': True})
+        self.assertEqual(status.HTTP_403_FORBIDDEN, response.status_code)
+        self.assertFalse(await UserBookRelation.objects.aexists())
+
+    async def test_like_rate(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.patch({'like': True, 'rate': 4})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'book': self.book_1.id, 'like': True, 'in_bookmarks': False, 'rate': 4},
+                         response.json())
+        response = await self.patch({'like': False})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+
+        relation = await UserBookRelation.objects.aget(user=self.user, book=self.book_1)
+        self.assertFalse(relation.like)
+        self.assertEqual(4, relation.rate)
+        await self.book_1.arefresh_from_db()
+        self.assertEqual(0, self.book_1.likes_count)
+        self.assertEqual((4, 1), (self.book_1.rating_sum, self.book_1.rating_count))
+
+    async def test_invalid(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.patch({'rate': 6})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn('rate', response.json())
+
+        self.url = reverse('async-book-relation', args=(self.book_1.id + 100,))
+        response = await self.patch({'like': True})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
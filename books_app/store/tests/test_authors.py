@@ -0,0 +1,130 @@
+from django.contrib.auth.models import User
+from django.db.models import ProtectedError
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from store.authors import link_books, rebuild_author_counters
+from store.cache import invalidate
+from store.models import Author, Book
+
+
+def counters(author):
+    author.refresh_from_db()
+    return (author.books_count, author.likes_count, author.bookmarks_count,
+            author.rating_sum, author.rating_count)
+
+
+class AuthorCountersTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='test_username')
+        self.book_1 = Book.objects.create(name='Test book 1', price=25, author_name='Author 1')
+        self.book_2 = Book.objects.create(name='Test book 2', price=55, author_name='Author 1')
+        self.author = self.book_1.author
+
+    def test_save_links_author(self):
+        self.assertEqual('Author 1', self.author.name)
+        self.assertEqual(self.author.id, self.book_2.author_id)
+        self.assertEqual((2, 0, 0, 0, 0), counters(self.author))
+        # книга без смены имени автора не трогает авторов
+        book = Book.objects.get(id=self.book_1.id)
+        with self.assertNumQueries(1):
+            book.save(update_fields=['name'])
+
+    def test_relations(self):
+        self.client.force_login(self.user)
+        for book, data in ((self.book_1, {'like': True, 'rate': 4}),
+                           (self.book_2, {'in_bookmarks': True, 'rate': 2}),
+                           (self.book_1, {'rate': 5})):
+            self.client.patch(reverse('userbookrelation-detail', args=(book.id,)), data,
+                              content_type='application/json')
+        self.assertEqual((2, 1, 1, 7, 2), counters(self.author))
+        self.client.post(reverse('userbookrelation-bulk'), [{'book': self.book_2.id, 'like': True}],
+                         content_type='application/json')
+        self.assertEqual((2, 2, 1, 7, 2), counters(self.author))
+        # пересчет с нуля дает то же
+        Author.objects.update(likes_count=0)
+        rebuild_author_counters()
+        self.assertEqual((2, 2, 1, 7, 2), counters(self.author))
+
+    def test_author_change(self):
+        self.client.force_login(self.user)
+        self.client.patch(reverse('userbookrelation-detail', args=(self.book_1.id,)),
+                          {'like': True, 'rate': 5}, content_type='application/json')
+        self.book_1.refresh_from_db()
+        self.book_1.author_name = 'Author 2'
+        self.book_1.save()
+        author_2 = Author.objects.get(name='Author 2')
+        self.assertEqual(author_2.id, self.book_1.author_id)
+        self.assertEqual((1, 0, 0, 0, 0), counters(self.author))
+        self.assertEqual((1, 1, 0, 5, 1), counters(author_2))
+
+        self.book_1.delete()
+        self.assertEqual((0, 0, 0, 0, 0), counters(author_2))
+        with self.assertRaises(ProtectedError):
+            self.author.delete()
+
+    def test_link_books(self):
+        Book.objects.bulk_create(Book(name=f'Book {i}', price=i, author_name=f'Author {i % 3}',
+                                      likes_count=i)
+                                 for i in range(10))
+        self.assertEqual(10, link_books(batch_size=2))
+        self.assertFalse(Book.objects.filter(author__isnull=True).exists())
+        self.assertEqual(3, Author.objects.count())
+        author_0 = Author.objects.get(name='Author 0')
+        self.assertEqual(4, author_0.books_count)
+        self.assertEqual(0 + 3 + 6 + 9, author_0.likes_count)
+        self.assertEqual((5, 1 + 4 + 7, 0, 0, 0), counters(self.author))
+        self.assertEqual(0, link_books())
+
+
+class AuthorApiTestCase(APITestCase):
+    def setUp(self):
+        invalidate()
+        self.user = User.objects.create(username='test_username')
+        self.book_1 = Book.objects.create(name='Test book 1', price=25, author_name='Author 1')
+        self.book_2 = Book.objects.create(name='Test book 2', price=55, author_name='Author 1')
+        self.book_3 = Book.objects.create(name='Test book 3', price=55, author_name='Author 2')
+        self.author = self.book_1.author
+        self.client.force_login(self.user)
+        for book, data in ((self.book_1, {'like': True, 'rate': 5}),
+                           (self.book_2, {'rate': 4})):
+            self.client.patch(reverse('userbookrelation-detail', args=(book.id,)), data,
+                              format='json')
+        self.client.logout()
+
+    def test_get(self):
+        url = reverse('author-detail', args=(self.author.id,))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({
+            'id': self.author.id,
+            'name': 'Author 1',
+            'books_count': 2,
+            'likes_count': 1,
+            'bookmarks_count': 0,
+            'rating_count': 2,
+            'rating': '4.50',
+        }, response.json())
+
+    def test_list(self):
+        response = self.client.get(reverse('author-list'), {'search': 'Author 2'})
+        self.assertEqual(['Author 2'], [author['name'] for author in response.json()['results']])
+        response = self.client.get(reverse('author-list'), {'ordering': '-name', 'page_size': 1})
+        data = response.json()
+        self.assertEqual([None], [author['rating'] for author in data['results']])
+        response = self.client.get(data['next'])
+        self.assertEqual(['4.50'], [author['rating'] for author in response.json()['results']])
+
+    def test_books(self):
+        response = self.client.get(reverse('book-list'), {'author': self.author.id})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([self.book_1.id, self.book_2.id], [book['id'] for book in response.json()])
+        self.assertEqual({self.author.id}, {book['author'] for book in response.json()})
+
+    def test_read_only(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('author-list'), {'name': 'Author 3'})
+        self.assertEqual(status.HTTP_405_METHOD_NOT_ALLOWED, response.status_code)
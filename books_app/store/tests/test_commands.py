@@ -0,0 +1,218 @@
+import json
+import os
+from decimal import Decimal
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from store.cache import generation
+from store.models import Book, UserBookRelation
+
+
+class RebuildBookCountersTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.user2 = User.objects.create(username="test_username2")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1')
+        self.book_2 = Book.objects.create(name="Test book 2", price=55,
+                                          author_name='Author 2')
+        UserBookRelation.objects.create(user=self.user, book=self.book_1,
+                                        like=True, rate=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.book_1,
+                                        like=True, in_bookmarks=True, rate=2)
+        # update() мимо сигналов: счетчики разошлись со связями
+        Book.objects.filter(pk=self.book_1.pk).update(likes_count=0, bookmarks_count=0,
+                                                      rating_sum=0, rating_count=0)
+        self.book_1.refresh_from_db()
+
+    def test_check_reports_drift(self):
+        out = StringIO()
+        call_command('rebuild_book_counters', '--check', stdout=out)
+        self.assertIn(f'book {self.book_1.id}: likes_count: 0 -> 2', out.getvalue())
+        self.assertIn('found drift in 1', out.getvalue())
+        self.book_1.refresh_from_db()
+        self.assertEqual(0, self.book_1.likes_count)
+
+    def test_rebuild(self):
+        old_generation = generation()
+        old_updated_at = self.book_1.updated_at
+        call_command('rebuild_book_counters', stdout=StringIO())
+        # старые ответы из кэша и старые ETag больше не отдаются
+        self.assertGreater(generation(), old_generation)
+        self.book_1.refresh_from_db()
+        self.assertGreater(self.book_1.updated_at, old_updated_at)
+        self.assertEqual(2, self.book_1.likes_count)
+        self.assertEqual(1, self.book_1.bookmarks_count)
+        self.assertEqual(7, self.book_1.rating_sum)
+        self.assertEqual(2, self.book_1.rating_count)
+        # оценки лидерборда из исправленных счетчиков
+        self.assertAlmostEqual((7 + 10 * 3.0) / (2 + 10), self.book_1.bayesian_score)
+
+        out = StringIO()
+        call_command('rebuild_book_counters', '--check', stdout=out)
+        self.assertIn('found drift in 0', out.getvalue())
+
+
+class RebuildLeaderboardTestCase(TestCase):
+    def setUp(self):
+        self.book_1 = Book.objects.create(name="Test book 1", price=25, author_name='Author 1')
+        self.book_2 = Book.objects.create(name="Test book 2", price=55, author_name='Author 2')
+        Book.objects.filter(pk=self.book_1.pk).update(rating_sum=9, rating_count=2)
+
+    def test_rebuild(self):
+        out = StringIO()
+        with override_settings(BOOKS_LEADERBOARD_MIN_VOTES=2, BOOKS_LEADERBOARD_PRIOR_VOTES=1):
+            call_command('rebuild_leaderboard', '--batch-size', '1', stdout=out)
+        self.assertIn('scores of 2 books', out.getvalue())
+        self.book_1.refresh_from_db()
+        self.assertEqual(4.5, self.book_1.rating_rank)
+        self.assertAlmostEqual((9 + 3.0) / 3, self.book_1.bayesian_score)
+        self.book_2.refresh_from_db()
+        self.assertIsNone(self.book_2.rating_rank)
+        self.assertIsNone(self.book_2.bayesian_score)
+
+        # больше не проходит порог
+        call_command('rebuild_leaderboard', stdout=StringIO())
+        self.book_1.refresh_from_db()
+        self.assertIsNone(self.book_1.rating_rank)
+
+
+class ImportBooksTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="publisher")
+        Book.objects.create(name="Existing", price=10, author_name='Author 1')
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_csv(self):
+        path = self.write('feed.csv', 'name,price,author_name\n'
+                                      'Book 1,25,Author 1\n'
+                                      'Book 2,55.5,Author 2\n'
+                                      'Book 1,30,Author 1\n'
+                                      'Existing,10,Author 1\n'
+                                      'Bad price,abc,Author 3\n'
+                                      ',10,Author 4\n'
+                                      'Книга,10,Автор\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_books', path, '--owner', 'publisher', '--batch-size', '2',
+                     stdout=out, stderr=err)
+        self.assertIn('Done: 3 created, 2 duplicates, 2 invalid', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertIn('row 5:', err.getvalue())
+        self.assertEqual(4, Book.objects.count())
+        book = Book.objects.get(name='Book 2')
+        self.assertEqual(self.user, book.owner)
+        self.assertEqual(Decimal('55.50'), book.price)
+        self.assertTrue(Book.objects.filter(name='Книга', author_name='Автор').exists())
+
+    def test_exact_pairs(self):
+        # другое сочетание уже известных названия и автора - новая книга
+        path = self.write('feed.csv', 'name,price,author_name\n'
+                                      'Existing,10,Author 2\n'
+                                      'Other,10,Author 1\n')
+        out = StringIO()
+        call_command('import_books', path, stdout=out)
+        self.assertIn('Done: 2 created, 0 duplicates', out.getvalue())
+        self.assertEqual(2, Book.objects.filter(name='Existing').count())
+
+    def test_jsonl(self):
+        path = self.write('feed.jsonl', '{"name": "Book 1", "price": 25, "author_name": "Author 1"}\n'
+                                        '\n'
+                                        'not json\n'
+                                        '{"name": "Book 2", "price": "5", "author_name": "Author 2"}\n')
+        out = StringIO()
+        call_command('import_books', path, stdout=out, stderr=StringIO())
+        self.assertIn('Done: 2 created, 0 duplicates, 1 invalid', out.getvalue())
+        self.assertIsNone(Book.objects.get(name='Book 1').owner)
+
+    def test_resume(self):
+        path = self.write('feed.csv', 'name,price,author_name\n' +
+                          ''.join(f'Book {i},10,Author\n' for i in range(10)))
+        with open(f'{path}.checkpoint', 'w') as f:
+            json.dump({'rows': 6}, f)
+        out = StringIO()
+        call_command('import_books', path, '--resume', stdout=out)
+        self.assertIn('Done: 4 created', out.getvalue())
+        self.assertEqual(['Book 6', 'Book 7', 'Book 8', 'Book 9'],
+                         list(Book.objects.filter(author_name='Author')
+                              .order_by('id').values_list('name', flat=True)))
+        with open(f'{path}.checkpoint') as f:
+            self.assertEqual({'rows': 10}, json.load(f))
+
+    def test_unknown_owner(self):
+        path = self.write('feed.csv', 'name,price,author_name\n')
+        with self.assertRaises(CommandError):
+            call_command('import_books', path, '--owner', 'nobody')
+
+
+class SeedStoreTestCase(TestCase):
+    def test_seed(self):
+        call_command('seed_store', '--users', '20', '--books', '50', '--relations', '300',
+                     stdout=StringIO())
+        self.assertEqual(20, User.objects.filter(username__startswith='seed_').count())
+        self.assertEqual(50, Book.objects.count())
+        self.assertEqual(300, UserBookRelation.objects.count())
+        pairs = UserBookRelation.objects.values_list('user_id', 'book_id')
+        self.assertEqual(300, len(set(pairs)))
+
+        # популярность книг перекошена
+        likes = sorted(Book.objects.values_list('likes_count', flat=True), reverse=True)
+        self.assertGreater(sum(likes[:5]), sum(likes[-5:]) * 3)
+
+        out = StringIO()
+        call_command('rebuild_book_counters', '--check', stdout=out)
+        self.assertIn('found drift in 0', out.getvalue())
+
+    def test_benchmark_api(self):
+        call_command('seed_store', '--users', '5', '--books', '20', '--relations', '40',
+                     stdout=StringIO())
+        with TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('benchmark', 'api', '--repeat', '3', '--output', output,
+                         stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)
+            self.assertEqual({'list', 'search', 'ordering', 'detail', 'create', 'relation_patch'},
+                             set(results['endpoints']))
+            for stats in results['endpoints'].values():
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+                self.assertGreater(stats['queries_max'], 0)
+
+            out = StringIO()
+            call_command('benchmark', 'api', '--repeat', '3', '--baseline', output, stdout=out)
+            self.assertIn('regressions against', out.getvalue())
+        # записи бенчмарка откатываются
+        self.assertEqual(20, Book.objects.count())
+
+    def test_benchmark_unsupported_option(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', 'concurrency', '--size', '10', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('benchmark', 'search', '--output', 'x.json', stdout=StringIO())
+
+
+class ConcurrencyBenchmarkTestCase(TransactionTestCase):
+    # потоки WSGI и ASGI должны видеть данные - без общей транзакции теста
+    def test_benchmark_concurrency(self):
+        call_command('seed_store', '--users', '5', '--books', '20', '--relations', '40',
+                     stdout=StringIO())
+        with TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('benchmark', 'concurrency', '--concurrency', '4', '--repeat', '3',
+                         '--output', output, stdout=StringIO())
+            with open(output) as f:
+                results = json.load(f)
+        self.assertEqual({'wsgi', 'asgi'}, set(results['servers']))
+        for stats in results['servers'].values():
+            self.assertEqual(12, stats['requests'])
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
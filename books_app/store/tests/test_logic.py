@@ -1,6 +1,14 @@
-from unittest import TestCase
+import threading
+from unittest import TestCase, mock
 
-from store.logic import operations
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase as DjangoTestCase, TransactionTestCase, skipUnlessDBFeature
+
+from store import logic
+from store.logic import apply_relation_changes, counters_delta, lock_relations, operations, \
+    upsert_relation
+from store.models import Book, UserBookRelation
 
 
 class LogicTestCase(TestCase):
@@ -15,3 +23,198 @@ class LogicTestCase(TestCase):
     def test_multiply(self):
         res = operations(6, 13, '*')
         self.assertEqual(78, res)
+
+
+class CountersDeltaTestCase(TestCase):
+    def test_new_relation(self):
+        new = {'book_id': 1, 'like': True, 'in_bookmarks': False, 'rate': 4}
+        deltas = counters_delta(None, new)
+        self.assertEqual({1: {'likes_count': 1, 'bookmarks_count': 0,
+                              'rating_sum': 4, 'rating_count': 1}}, deltas)
+
+    def test_change_rate(self):
+        old = {'book_id': 1, 'like': True, 'in_bookmarks': False, 'rate': 4}
+        new = {'book_id': 1, 'like': True, 'in_bookmarks': True, 'rate': 2}
+        deltas = counters_delta(old, new)
+        self.assertEqual({1: {'likes_count': 0, 'bookmarks_count': 1,
+                              'rating_sum': -2, 'rating_count': 0}}, deltas)
+
+    def test_move_to_other_book(self):
+        old = {'book_id': 1, 'like': True, 'in_bookmarks': False, 'rate': None}
+        new = {'book_id': 2, 'like': True, 'in_bookmarks': False, 'rate': None}
+        deltas = counters_delta(old, new)
+        self.assertEqual(-1, deltas[1]['likes_count'])
+        self.assertEqual(1, deltas[2]['likes_count'])
+
+
+class UpsertRelationTestCase(DjangoTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.book = Book.objects.create(name="Test book 1", price=25, author_name='Author 1')
+
+    def test_only_submitted_fields(self):
+        # SAVEPOINT, SELECT ... FOR UPDATE, INSERT ... ON CONFLICT, UPDATE книги,
+        # SELECT авторов книг, UPDATE автора, RELEASE
+        with self.assertNumQueries(7):
+            relation = upsert_relation(self.user.id, self.book.id, {'like': True, 'rate': 3})
+        self.assertEqual((True, False, 3), (relation.like, relation.in_bookmarks, relation.rate))
+
+        relation = upsert_relation(self.user.id, self.book.id, {'in_bookmarks': True})
+        self.assertEqual((True, True, 3), (relation.like, relation.in_bookmarks, relation.rate))
+        relation = upsert_relation(self.user.id, self.book.id, {'rate': None})
+        self.assertEqual((True, True, None), (relation.like, relation.in_bookmarks, relation.rate))
+
+        self.assertEqual(1, UserBookRelation.objects.count())
+        self.book.refresh_from_db()
+        self.assertEqual((1, 1, 0, 0), (self.book.likes_count, self.book.bookmarks_count,
+                                        self.book.rating_sum, self.book.rating_count))
+
+    def test_unique(self):
+        upsert_relation(self.user.id, self.book.id, {})
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserBookRelation.objects.create(user=self.user, book=self.book)
+
+
+class ApplyRelationChangesTestCase(DjangoTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25, author_name='Author 1')
+        self.book_2 = Book.objects.create(name="Test book 2", price=55, author_name='Author 2')
+
+    def test_locks_only_pairs(self):
+        user2 = User.objects.create(username="test_username2")
+        for user in (self.user, user2):
+            for book in (self.book_1, self.book_2):
+                UserBookRelation.objects.create(user=user, book=book)
+        keys = {(self.user.id, self.book_1.id), (user2.id, self.book_2.id)}
+        # не все связи пользователей x книги, а только сами пары
+        self.assertEqual(keys, set(lock_relations(keys, batch_size=1)))
+        self.assertEqual(keys, set(lock_relations(keys)))
+
+    def test_inserted_meanwhile(self):
+        # связь появилась между SELECT и INSERT: не перезаписана, а обновлена
+        insert = logic.insert_new_relations
+
+        def racing_insert(changes, batch_size=500):
+            if (self.user.id, self.book_1.id) in changes:
+                upsert_relation(self.user.id, self.book_1.id, {'in_bookmarks': True, 'rate': 2})
+            return insert(changes, batch_size)
+
+        with mock.patch('store.logic.insert_new_relations', side_effect=racing_insert):
+            relations = apply_relation_changes({
+                (self.user.id, self.book_1.id): {'like': True},
+                (self.user.id, self.book_2.id): {'rate': 4},
+            })
+        relation = UserBookRelation.objects.get(book=self.book_1)
+        self.assertEqual((True, True, 2), (relation.like, relation.in_bookmarks, relation.rate))
+        self.assertEqual(relation.id, relations[(self.user.id, self.book_1.id)].id)
+        self.assertEqual(4, relations[(self.user.id, self.book_2.id)].rate)
+        self.book_1.refresh_from_db()
+        self.assertEqual((1, 1, 2, 1), (self.book_1.likes_count, self.book_1.bookmarks_count,
+                                        self.book_1.rating_sum, self.book_1.rating_count))
+        self.book_2.refresh_from_db()
+        self.assertEqual((0, 0, 4, 1), (self.book_2.likes_count, self.book_2.bookmarks_count,
+                                        self.book_2.rating_sum, self.book_2.rating_count))
+
+
+class RelationSignalsTestCase(DjangoTestCase):
+    """Counters follow relations written through the ORM, not only store.logic."""
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        self.user2 = User.objects.create(username="test_username2")
+        self.book = Book.objects.create(name="Test book 1", price=25, author_name='Author 1')
+        UserBookRelation.objects.create(user=self.user, book=self.book, like=True, rate=5)
+        UserBookRelation.objects.create(user=self.user2, book=self.book, like=True, rate=3)
+
+    def counters(self):
+        self.book.refresh_from_db()
+        author = self.book.author
+        return ((self.book.likes_count, self.book.rating_sum, self.book.rating_count),
+                (author.likes_count, author.rating_sum, author.rating_count))
+
+    def test_save(self):
+        self.assertEqual(((2, 8, 2), (2, 8, 2)), self.counters())
+        relation = UserBookRelation.objects.get(user=self.user)
+        relation.like = False
+        relation.rate = None
+        relation.save()
+        self.assertEqual(((1, 3, 1), (1, 3, 1)), self.counters())
+
+    def test_user_cascade(self):
+        self.user.delete()
+        self.assertEqual(((1, 3, 1), (1, 3, 1)), self.counters())
+
+    def test_book_delete(self):
+        # связи уходят вместе с книгой: у автора ее счетчики вычитаются один раз
+        other = Book.objects.create(name="Test book 2", price=25, author_name='Author 1')
+        UserBookRelation.objects.create(user=self.user, book=other, like=True, rate=4)
+        self.book.delete()
+        author = other.author
+        author.refresh_from_db()
+        self.assertEqual((1, 1, 4, 1), (author.books_count, author.likes_count,
+                                        author.rating_sum, author.rating_count))
+
+
+# в SQLite нет блокировок строк: общая in-memory база тестов блокирует таблицу целиком
+@skipUnlessDBFeature('has_select_for_update')
+class UpsertRelationConcurrencyTestCase(TransactionTestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'user_{i}') for i in range(8)]
+        self.book = Book.objects.create(name="Hot book", price=25, author_name='Author')
+
+    def run_threads(self, calls, func=upsert_relation):
+        barrier = threading.Barrier(len(calls))
+        errors = []
+
+        def worker(args):
+            try:
+                barrier.wait()
+                func(*args)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(args,)) for args in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+
+    def test_same_relation(self):
+        # разные поля одной новой связи одновременно: одна строка, ни одно поле не потеряно
+        user = self.users[0]
+        for _ in range(5):
+            UserBookRelation.objects.all().delete()
+            Book.objects.filter(pk=self.book.pk).update(likes_count=0, bookmarks_count=0,
+                                                        rating_sum=0, rating_count=0)
+            self.run_threads([(user.id, self.book.id, {'like': True}),
+                              (user.id, self.book.id, {'in_bookmarks': True}),
+                              (user.id, self.book.id, {'rate': 5}),
+                              (user.id, self.book.id, {'like': True})])
+            relation = UserBookRelation.objects.get()
+            self.assertEqual((True, True, 5), (relation.like, relation.in_bookmarks, relation.rate))
+            self.book.refresh_from_db()
+            self.assertEqual((1, 1, 5, 1), (self.book.likes_count, self.book.bookmarks_count,
+                                            self.book.rating_sum, self.book.rating_count))
+
+    def test_hot_book(self):
+        self.run_threads([(user.id, self.book.id, {'like': True, 'rate': 4})
+                          for user in self.users])
+        self.assertEqual(len(self.users), UserBookRelation.objects.count())
+        self.book.refresh_from_db()
+        self.assertEqual((8, 32, 8), (self.book.likes_count, self.book.rating_sum,
+                                      self.book.rating_count))
+
+    def test_bulk_same_relations(self):
+        # пачки с одними и теми же новыми связями: без IntegrityError и двойных счетчиков
+        self.run_threads([({(user.id, self.book.id): data for user in self.users},)
+                          for data in ({'like': True}, {'in_bookmarks': True}, {'rate': 5},
+                                       {'like': True})],
+                         func=apply_relation_changes)
+        self.assertEqual(len(self.users), UserBookRelation.objects.filter(
+            like=True, in_bookmarks=True, rate=5).count())
+        self.book.refresh_from_db()
+        self.assertEqual((8, 8, 40, 8), (self.book.likes_count, self.book.bookmarks_count,
+                                         self.book.rating_sum, self.book.rating_count))
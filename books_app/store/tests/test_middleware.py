@@ -0,0 +1,67 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from store.middleware import SQLTimingMiddleware
+from store.models import Book
+
+
+@override_settings(BOOKS_SQL_TIMING=True, BOOKS_RESPONSE_CACHE=False)
+class SQLTimingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test_username")
+        for i in range(3):
+            Book.objects.create(name=f"Test book {i}", price=25, author_name='Author',
+                                owner=self.user)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('book-list'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="1 queries"')
+        for phase in ('view', 'serialize', 'render', 'total'):
+            self.assertIn(f'{phase};dur=', timing)
+        self.assertEqual('1', response['X-Query-Count'])
+
+    def test_log(self):
+        with self.assertLogs('store.timing', level='INFO') as logs:
+            self.client.get(reverse('book-list'))
+        self.assertIn('"queries": 1', logs.output[0])
+        self.assertIn('"slowest_sql"', logs.output[0])
+
+    @override_settings(BOOKS_SQL_TIMING_NPLUSONE=3)
+    def test_nplusone(self):
+        def view(request):
+            # владелец каждой книги отдельным запросом
+            names = [book.owner.username for book in Book.objects.all()]
+            return HttpResponse(', '.join(names))
+
+        middleware = SQLTimingMiddleware(view)
+        with self.assertLogs('store.timing', level='WARNING') as logs:
+            response = middleware(RequestFactory().get('/book/'))
+        self.assertEqual('4', response['X-Query-Count'])
+        self.assertIn('"nplusone"', logs.output[0])
+        self.assertIn('"repeats": 3', logs.output[0])
+
+    async def test_async(self):
+        response = await self.async_client.get(reverse('async-book-list'))
+        self.assertEqual(200, response.status_code)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="1 queries"')
+        self.assertEqual('1', response['X-Query-Count'])
+
+        async def view(request):
+            return HttpResponse(str(await Book.objects.acount()))
+
+        middleware = SQLTimingMiddleware(view)
+        response = await middleware(AsyncRequestFactory().get('/book/'))
+        self.assertEqual(b'3', response.content)
+        self.assertEqual('1', response['X-Query-Count'])
+
+
+class SQLTimingDisabledTestCase(TestCase):
+    def test_disabled(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            SQLTimingMiddleware(lambda request: HttpResponse())
+        response = self.client.get(reverse('book-list'))
+        self.assertNotIn('Server-Timing', response)
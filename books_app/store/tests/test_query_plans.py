@@ -0,0 +1,140 @@
+import random
+import re
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from store.authors import link_books
+from store.benchmarks.utils import fake_books
+from store.models import Author, Book, UserBookRelation
+
+TABLES = (Book._meta.db_table, UserBookRelation._meta.db_table, Author._meta.db_table)
+# частичные индексы: условие индекса и есть фильтр, Index Cond не нужен
+PARTIAL_INDEXES = {index.name for model in (Book, UserBookRelation)
+                   for index in model._meta.indexes if index.condition is not None}
+
+
+@override_settings(BOOKS_RESPONSE_CACHE=False)
+class QueryPlanTestCase(APITestCase):
+    """
+    EXPLAIN every store query of the main book and relation endpoints on
+    a seeded catalog and fail on a full scan of a store table: a missing
+    index shows up here before it shows up in production.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(0)
+        cls.users = User.objects.bulk_create(User(username=f'reader{i}') for i in range(50))
+        cls.books = Book.objects.bulk_create(fake_books(2000, owners=cls.users[:5]))
+        UserBookRelation.objects.bulk_create(
+            UserBookRelation(user=user, book=book, like=rnd.random() < 0.5,
+                             in_bookmarks=rnd.random() < 0.1,
+                             rate=rnd.choice((None, 1, 2, 3, 4, 5)))
+            for user in cls.users for book in rnd.sample(cls.books, 40))
+        link_books()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = cls.users[0]
+        cls.book = UserBookRelation.objects.filter(user=cls.user).first().book
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # на маленькой таблице seq scan дешевле; без индекса он останется и так
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                cursor.execute('RESET enable_seqscan')
+                return plan
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def full_scans(self, sql, plan):
+        tables = '|'.join(TABLES)
+        # без WHERE во внешнем запросе (подзапросы в SELECT - до последнего FROM)
+        # и без сортировки на стороне полный проход - это первая страница по id,
+        # ее обрезает LIMIT
+        ordered_walk = ' WHERE ' not in sql[sql.rindex(' FROM '):] and not re.search(
+            r'TEMP B-TREE|^\s*(->\s*)?Sort\b', plan, re.M)
+        if connection.vendor == 'postgresql':
+            scans = re.findall(rf'Seq Scan on ({tables})\b', plan)
+            # Index Scan без Index Cond - тоже чтение всей таблицы, только по индексу
+            nodes = re.split(r'\n(?=\s*->)', plan)
+            scans += [match.group(2) for node in nodes
+                      for match in [re.search(rf'Index (?:Only )?Scan (?:Backward )?using (\S+) '
+                                              rf'on ({tables})\b', node)]
+                      if match and 'Index Cond' not in node and not ordered_walk
+                      and match.group(1) not in PARTIAL_INDEXES]
+            return scans
+        if ordered_walk:
+            return []
+        return re.findall(rf'^SCAN ({tables})(?: AS \w+)?$', plan, re.M)
+
+    def assertIndexed(self, method, url, data=None, uses=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.content)
+        plans = []
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any(f'"{table}"' in sql for table in TABLES):
+                continue
+            # COUNT/MAX по всему каталогу (ETag списка) читают его целиком по определению
+            if ' WHERE ' not in sql and ' LIMIT ' not in sql:
+                continue
+            plan = self.explain(sql)
+            self.assertEqual([], self.full_scans(sql, plan), f'{sql}\n{plan}')
+            plans.append(plan)
+        self.assertTrue(plans, 'no store queries')
+        if uses is not None:
+            self.assertTrue(any(uses in plan for plan in plans), '\n\n'.join(plans))
+
+    def test_book_list(self):
+        self.assertIndexed('get', reverse('book-list'), {'page_size': 50})
+        self.assertIndexed('get', reverse('book-list'), {'price': str(self.book.price), 'page_size': 50},
+                           uses='store_book_price_id_idx')
+        # диапазон цены и грани по нему - тоже по индексу цены
+        price = str(self.book.price)
+        self.assertIndexed('get', reverse('book-list'),
+                           {'price_min': price, 'price_max': price, 'page_size': 50,
+                            'facets': 'price,author'},
+                           uses='store_book_price_id_idx')
+
+    def test_book_list_ordering(self):
+        # страница по курсору: проход по индексу сортировки, а не агрегаты по всему каталогу
+        for ordering, index in (('price', 'store_book_price_id_idx'),
+                                ('-author_name', 'store_book_author_id_idx')):
+            response = self.client.get(reverse('book-list'), {'ordering': ordering, 'page_size': 50})
+            self.assertIndexed('get', response.data['next'], uses=index)
+
+    def test_author(self):
+        author = Author.objects.order_by('id').first()
+        self.assertIndexed('get', reverse('book-list'), {'author': author.id, 'page_size': 50},
+                           uses='store_book_author_fk_idx')
+        self.assertIndexed('get', reverse('author-detail', args=(author.id,)))
+        self.assertIndexed('get', reverse('author-list'))
+        response = self.client.get(reverse('author-list'), {'ordering': 'name', 'page_size': 5})
+        self.assertIndexed('get', response.data['next'])
+
+    def test_book_detail(self):
+        self.assertIndexed('get', reverse('book-detail', args=(self.book.id,)))
+
+    def test_book_top(self):
+        self.assertIndexed('get', reverse('book-top'), {'by': 'bayesian'},
+                           uses='store_book_top_bayesian_idx')
+
+    def test_relation(self):
+        self.client.force_login(self.user)
+        url = reverse('userbookrelation-detail', args=(self.book.id,))
+        self.assertIndexed('get', url)
+        self.assertIndexed('patch', url, {'like': True})
+        self.assertIndexed('post', reverse('userbookrelation-bulk'),
+                           [{'book': self.book.id, 'rate': 4}, {'book': self.books[0].id, 'like': True}])
+
+    def test_library(self):
+        self.client.force_login(self.user)
+        self.assertIndexed('get', reverse('library-list'), {'like': 'true'})
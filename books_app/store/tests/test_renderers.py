@@ -0,0 +1,138 @@
+import datetime
+import json
+import uuid
+from decimal import Decimal
+from importlib.util import find_spec
+from unittest import mock, skipUnless
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from store.cache import invalidate
+from store.models import Book, UserBookRelation
+from store.renderers import ORJSONRenderer
+from store.serializers import BookSerializer, UserBookRelationSerializer
+
+HAS_MSGPACK = find_spec('msgpack') is not None
+
+
+class ORJSONRendererTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='test_username')
+        self.book = Book.objects.create(name='Тест \u2028 книга ✓', price=Decimal('25.50'),
+                                        author_name='Author 1', owner=user)
+        UserBookRelation.objects.create(user=user, book=self.book, like=True, rate=4)
+
+    def assertSameJSON(self, data, accepted_media_type=None):
+        expected = JSONRenderer().render(data, accepted_media_type)
+        self.assertEqual(expected, ORJSONRenderer().render(data, accepted_media_type))
+
+    def test_same_as_json_renderer(self):
+        serializer = UserBookRelationSerializer(data={'rate': 6})
+        serializer.is_valid()
+        for data in (
+                BookSerializer(Book.objects.annotated(), many=True).data,
+                # ошибки - ErrorDetail, подкласс str
+                serializer.errors,
+                {'price': Decimal('25.50'), 'rating': 4.25, 'none': None, 'flag': True,
+                 1: 'int key', 'nested': ({'a': [1, 2]}, [])},
+                {'at': timezone.now(), 'naive': datetime.datetime(2024, 1, 2, 3, 4, 5, 123456),
+                 'date': datetime.date(2024, 1, 2), 'time': datetime.time(3, 4, 5, 6),
+                 'duration': datetime.timedelta(seconds=90), 'uuid': uuid.uuid4(),
+                 'lazy': gettext_lazy('Invalid cursor')},
+                'line\u2028separator\u2029',
+                # больше 64 бит - стандартный кодировщик
+                2 ** 70,
+                [],
+        ):
+            with self.subTest(data=data):
+                self.assertSameJSON(data)
+        self.assertEqual(b'', ORJSONRenderer().render(None))
+
+    def test_indent(self):
+        self.assertSameJSON({'a': [1, {'b': Decimal('1.5')}]}, 'application/json; indent=4')
+
+    def test_float_exponents(self):
+        # только запись другая: 1e-05 против 0.00001, число то же
+        data = {'scores': [1e-05, 1.2e-05, 1e16, 0.1, 1 / 3]}
+        rendered = ORJSONRenderer().render(data)
+        self.assertEqual(json.loads(JSONRenderer().render(data)), json.loads(rendered))
+
+    def test_without_orjson(self):
+        with mock.patch('store.renderers.orjson', None):
+            self.assertSameJSON(BookSerializer(Book.objects.annotated(), many=True).data)
+
+
+@override_settings(BOOKS_RESPONSE_CACHE=False)
+class RenderersApiTestCase(APITestCase):
+    def setUp(self):
+        invalidate()
+        self.user = User.objects.create(username='test_username')
+        self.book = Book.objects.create(name='Test book 1', price=25, author_name='Author 1',
+                                        owner=self.user)
+
+    def test_json(self):
+        for url in (reverse('book-list'), reverse('book-detail', args=(self.book.id,)),
+                    reverse('author-detail', args=(self.book.author_id,))):
+            response = self.client.get(url)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual('application/json', response['Content-Type'])
+            self.assertEqual(JSONRenderer().render(response.data), response.content)
+
+    def test_not_acceptable(self):
+        for name in ('book-list', 'async-book-list'):
+            response = self.client.get(reverse(name), HTTP_ACCEPT='application/xml')
+            self.assertEqual(status.HTTP_406_NOT_ACCEPTABLE, response.status_code)
+            self.assertEqual('application/json', response['Content-Type'])
+
+    def test_async_parser(self):
+        self.client.force_login(self.user)
+        url = reverse('async-book-relation', args=(self.book.id,))
+        response = self.client.patch(url, '{"like": tru', content_type='application/json')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn('JSON parse error', response.json()['detail'])
+        response = self.client.patch(url, 'like=1', content_type='application/x-www-form-urlencoded')
+        self.assertEqual(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, response.status_code)
+
+
+@skipUnless(HAS_MSGPACK, 'msgpack is not installed')
+@override_settings(BOOKS_RESPONSE_CACHE=False)
+class MessagePackTestCase(APITestCase):
+    def setUp(self):
+        invalidate()
+        self.user = User.objects.create(username='test_username')
+        self.book = Book.objects.create(name='Test book 1', price=25, author_name='Author 1',
+                                        owner=self.user)
+
+    def unpack(self, response):
+        import msgpack
+        self.assertEqual('application/msgpack', response['Content-Type'])
+        return msgpack.unpackb(response.content, raw=False)
+
+    def test_get(self):
+        for name in ('book-list', 'async-book-list'):
+            expected = self.client.get(reverse(name)).json()
+            response = self.client.get(reverse(name), HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(expected, self.unpack(response))
+            self.assertEqual(expected, self.unpack(self.client.get(reverse(name), {'format': 'msgpack'})))
+
+    def test_patch(self):
+        import msgpack
+        self.client.force_login(self.user)
+        for name in ('userbookrelation-detail', 'async-book-relation'):
+            response = self.client.patch(reverse(name, args=(self.book.id,)),
+                                         msgpack.packb({'rate': 4}),
+                                         content_type='application/msgpack',
+                                         HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(4, self.unpack(response)['rate'])
+        response = self.client.patch(reverse('userbookrelation-detail', args=(self.book.id,)),
+                                     b'\xc1', content_type='application/msgpack')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
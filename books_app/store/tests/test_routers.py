@@ -0,0 +1,101 @@
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from store.cache import get_cache
+from store.models import Book
+from store.routers import ReplicaRouter, current_replica, use_replica
+
+# вторая SQLite-база в роли реплики; test runner создает ее и
+# накатывает миграции, как и для default
+if 'replica' not in connections.settings:
+    connections.settings['replica'] = connections.configure_settings({
+        'default': {}, 'replica': {'ENGINE': 'django.db.backends.sqlite3'}})['replica']
+
+
+@override_settings(BOOKS_DATABASE_REPLICAS=['replica'], BOOKS_REPLICA_LAG=5,
+                   BOOKS_RESPONSE_CACHE=False)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """
+    Primary and replica are two separate databases and nothing copies rows
+    between them, so a replica read does not see what was written to the
+    primary - like a replica that is behind.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create(username='test_username')
+        self.book = Book.objects.create(name='Test book 1', price=25, author_name='Author 1',
+                                        owner=self.user)
+        # на реплику "доехала" старая версия книги
+        User.objects.using('replica').create(id=self.user.id, username='test_username')
+        Book.objects.using('replica').create(id=self.book.id, name='Old name', price=25,
+                                             author_name='Author 1', owner_id=self.user.id)
+        self.url = reverse('book-detail', args=(self.book.id,))
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Book))
+        with use_replica() as alias:
+            self.assertEqual('replica', alias)
+            self.assertEqual('replica', router.db_for_read(Book))
+            # остальные приложения и записи - всегда primary
+            self.assertIsNone(router.db_for_read(User))
+            self.assertEqual('default', router.db_for_write(Book))
+            self.assertEqual('Old name', Book.objects.get(id=self.book.id).name)
+        self.assertIsNone(router.db_for_read(Book))
+
+    def test_reads_from_replica(self):
+        response = self.client.get(self.url)
+        self.assertEqual('Old name', response.data['name'])
+        self.assertNotIn('books_primary', response.cookies)
+        response = self.client.get(reverse('book-list'))
+        self.assertEqual(['Old name'], [book['name'] for book in response.data])
+
+    def test_read_your_writes(self):
+        self.client.force_login(self.user)
+        response = self.client.patch(self.url, {'name': 'New name'}, content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        cookie = response.cookies['books_primary']
+        self.assertEqual(5, cookie['max-age'])
+        # запись - на primary, реплика еще не догнала
+        self.assertEqual('New name', Book.objects.get(id=self.book.id).name)
+        self.assertEqual('Old name', Book.objects.using('replica').get(id=self.book.id).name)
+
+        response = self.client.get(self.url)
+        self.assertEqual('New name', response.data['name'])
+
+        # окно прошло - cookie истекла, снова реплика
+        del self.client.cookies['books_primary']
+        response = self.client.get(self.url)
+        self.assertEqual('Old name', response.data['name'])
+
+    async def test_reads_from_replica_async(self):
+        # ASGI: process_view идет через sync_to_async, реплика доезжает до view
+        response = await self.async_client.get(self.url)
+        self.assertEqual('Old name', response.json()['name'])
+        self.assertIsNone(current_replica())
+
+    def test_failed_write_not_sticky(self):
+        self.client.force_login(User.objects.create(username='other'))
+        response = self.client.patch(self.url, {'name': 'New name'}, content_type='application/json')
+        self.assertEqual(403, response.status_code)
+        self.assertNotIn('books_primary', response.cookies)
+
+    @override_settings(BOOKS_RESPONSE_CACHE=True)
+    def test_cache(self):
+        self.assertEqual('Old name', self.client.get(self.url).data['name'])
+        self.client.force_login(self.user)
+        self.client.patch(self.url, {'name': 'New name'}, content_type='application/json')
+        # другой клиент кладет в кэш ответ реплики под новым поколением
+        self.client_class().get(self.url)
+        response = self.client.get(self.url)
+        self.assertEqual('New name', response.json()['name'])
+        self.assertEqual('MISS', response['X-Cache'])
+
+    @override_settings(BOOKS_DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        response = self.client.get(self.url)
+        self.assertEqual('Test book 1', response.data['name'])
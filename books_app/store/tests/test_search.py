@@ -0,0 +1,111 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from store.models import Book
+from store.search import InvertedIndexSearchBackend, PostgresSearchBackend, tokenize
+
+
+class TokenizeTestCase(TestCase):
+    def test_tokenize(self):
+        self.assertEqual(['programming', 'in', 'python', '3'],
+                         tokenize('Programming in Python-3'))
+
+
+class InvertedIndexTestCase(TestCase):
+    def setUp(self):
+        self.backend = InvertedIndexSearchBackend()
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1')
+        self.book_2 = Book.objects.create(name="Test book 2", price=55,
+                                          author_name='Author 2')
+        self.book_3 = Book.objects.create(name="Test book 3 Author 1", price=65,
+                                          author_name='Author 3')
+
+    def search(self, *terms):
+        queryset = self.backend.search(Book.objects.order_by('id'), terms)
+        return list(queryset)
+
+    def test_search(self):
+        self.assertEqual([self.book_1, self.book_3], self.search('Author', '1'))
+        self.assertEqual([self.book_2], self.search('author', '2'))
+        self.assertEqual([], self.search('missing'))
+        self.assertEqual([], self.search('!!!'))
+
+    def test_prefix(self):
+        self.assertEqual([self.book_1, self.book_2, self.book_3], self.search('auth'))
+        # только начало слова, не подстрока (как было с icontains)
+        self.assertEqual([], self.search('uthor'))
+
+    def test_incremental_update(self):
+        self.search('book')
+        self.book_2.name = 'Python'
+        self.book_2.save()
+        self.backend.index(self.book_2)
+        book_4 = Book.objects.create(name="Python 4", price=10, author_name='Author 4')
+        self.backend.index(book_4, created=True)
+        self.assertEqual([self.book_2, book_4], self.search('python'))
+
+        self.backend.remove(self.book_2.id)
+        self.book_2.delete()
+        self.assertEqual([book_4], self.search('python'))
+
+    def test_changes_elsewhere(self):
+        # self.backend сигналов не получает - как индекс другого процесса
+        self.search('book')
+        self.book_1.name = 'Omega'
+        self.book_1.save()
+        self.assertEqual([self.book_1], self.search('omega'))
+        self.assertEqual([self.book_2, self.book_3], self.search('book'))
+
+        Book.objects.filter(pk=self.book_2.pk).update(name='Alpha', updated_at=timezone.now())
+        self.assertEqual([self.book_2], self.search('alpha'))
+        self.assertEqual([self.book_3], self.search('book'))
+
+        Book.objects.filter(pk=self.book_3.pk).delete()
+        self.assertEqual([], self.search('book'))
+        self.assertEqual([self.book_1, self.book_2], self.search('author'))
+
+    def test_rebuild_after_bulk_create(self):
+        self.search('book')
+        book_4, = Book.objects.bulk_create([Book(name="Bulk", price=10, author_name='A')])
+        self.assertEqual([book_4], self.search('bulk'))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'tsvector search needs PostgreSQL')
+@override_settings(BOOKS_RESPONSE_CACHE=False)
+class PostgresSearchTestCase(APITestCase):
+    def setUp(self):
+        self.book_1 = Book.objects.create(name="Python", price=25, author_name='Author 1')
+        self.book_2 = Book.objects.create(name="Python Python Python", price=55,
+                                          author_name='Python')
+        self.book_3 = Book.objects.create(name="Python 3", price=65, author_name='Python')
+        self.book_4 = Book.objects.create(name="Java", price=10, author_name='Author 4')
+
+    def test_search(self):
+        queryset = PostgresSearchBackend().search(Book.objects.order_by('id'), ['pyth'])
+        self.assertEqual([self.book_1, self.book_2, self.book_3], list(queryset))
+        self.assertEqual([], list(PostgresSearchBackend().search(Book.objects.all(), ['ython'])))
+
+    def test_rank_ordering(self):
+        url = reverse('book-list')
+        ids = [book['id'] for book in self.client.get(url, {'search': 'python'}).data]
+        self.assertEqual([self.book_2.id, self.book_3.id, self.book_1.id], ids)
+        # ?ordering= важнее ранга
+        ids = [book['id'] for book in self.client.get(url, {'search': 'python', 'ordering': 'price'}).data]
+        self.assertEqual([self.book_1.id, self.book_2.id, self.book_3.id], ids)
+
+    def test_rank_cursor(self):
+        url = reverse('book-list')
+        ids = []
+        response = self.client.get(url, {'search': 'python', 'page_size': 1})
+        while True:
+            ids += [book['id'] for book in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual([self.book_2.id, self.book_3.id, self.book_1.id], ids)
@@ -1,9 +1,9 @@
-from unittest import TestCase
-
 from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
 
-from store.models import Book
-from store.serializers import BookSerializer
+from store.models import Book, UserBookRelation
+from store.serializers import BookFastReader, BookSerializer
 
 
 class BookSerializerTestCase(TestCase):
@@ -18,21 +18,36 @@ class BookSerializerTestCase(TestCase):
         book_2 = Book.objects.create(name="Test book 2", price=55,
                                      author_name="Author 2",
                                      owner=self.user_2)
-        data = BookSerializer([book_1, book_2], many=True).data
+        UserBookRelation.objects.create(user=self.user_1, book=book_1, like=True,
+                                        rate=5)
+        UserBookRelation.objects.create(user=self.user_2, book=book_1, like=True,
+                                        rate=4)
+        UserBookRelation.objects.create(user=self.user_1, book=book_2, rate=3)
+
+        books = Book.objects.annotated().filter(id__in=[book_1.id, book_2.id]).order_by('id')
+        data = BookSerializer(books, many=True).data
         expected_data = [
             {
                 'id': book_1.id,
                 'name': 'Test book 1',
                 'price': '25.00',
                 'author_name': 'Author 1',
-                'owner': book_1.owner.id
+                'author': book_1.author_id,
+                'owner': book_1.owner.id,
+                'annotated_likes': 2,
+                'rating': '4.50',
+                'owner_name': 'user1'
             },
             {
                 'id': book_2.id,
                 'name': 'Test book 2',
                 'price': '55.00',
                 'author_name': 'Author 2',
-                'owner': book_2.owner.id
+                'author': book_2.author_id,
+                'owner': book_2.owner.id,
+                'annotated_likes': 0,
+                'rating': '3.00',
+                'owner_name': 'user2'
             },
         ]
         # print("Expected data:", expected_data)
@@ -40,4 +55,28 @@ class BookSerializerTestCase(TestCase):
         # print("User 1 ID:", self.user_1.id)
         # print("User 2 ID:", self.user_2.id)
 
-        self.assertEqual(expected_data, data)
\ No newline at end of file
+        self.assertEqual(expected_data, data)
+
+
+class BookFastReaderTestCase(TestCase):
+    def setUp(self):
+        self.user_1 = User.objects.create(username="user1", password="password")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name="Author 1",
+                                          owner=self.user_1)
+        self.book_2 = Book.objects.create(name="Тестовая книга 2", price='55.5',
+                                          author_name="Author 2")
+        UserBookRelation.objects.create(user=self.user_1, book=self.book_1,
+                                        like=True, rate=4)
+
+    def test_same_as_serializer(self):
+        books = Book.objects.annotated().order_by('id')
+        reader = BookFastReader()
+        self.assertEqual(list(BookSerializer().fields), reader.field_names)
+        expected = BookSerializer(books, many=True).data
+        data = reader.many(reader.queryset(books))
+        self.assertEqual(expected, data)
+        self.assertEqual(JSONRenderer().render(expected), JSONRenderer().render(data))
+        self.assertEqual('55.50', data[1]['price'])
+        self.assertIsNone(data[1]['rating'])
+        self.assertEqual('', data[1]['owner_name'])
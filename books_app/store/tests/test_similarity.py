@@ -0,0 +1,100 @@
+import math
+from importlib.util import find_spec
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from store.cache import invalidate
+from store.models import Book, SimilarBook, UserBookRelation
+from store.similarity import build_similar_books
+
+HAS_SCIPY = find_spec('numpy') is not None and find_spec('scipy') is not None
+
+
+@skipUnless(HAS_SCIPY, 'numpy and scipy are not installed')
+class SimilarBooksTestCase(APITestCase):
+    def setUp(self):
+        invalidate()
+        self.user, self.user2, self.user3 = [User.objects.create(username=f"test_username{i}")
+                                             for i in range(1, 4)]
+        self.book_1, self.book_2, self.book_3, self.book_4, self.book_5 = [
+            Book.objects.create(name=f"Test book {i}", price=25, author_name='Author',
+                                owner=self.user)
+            for i in range(1, 6)]
+        for user, book, data in (
+                (self.user, self.book_1, {'like': True}),
+                (self.user, self.book_2, {'like': True}),
+                (self.user2, self.book_1, {'like': True}),
+                (self.user2, self.book_2, {'like': True}),
+                (self.user2, self.book_3, {'like': True}),
+                # 5 -> вес 1 + 1
+                (self.user3, self.book_3, {'like': True, 'rate': 5}),
+                (self.user3, self.book_4, {'like': True}),
+                # только закладка - не сигнал
+                (self.user, self.book_5, {'in_bookmarks': True})):
+            UserBookRelation.objects.create(user=user, book=book, **data)
+
+    def neighbours(self, book):
+        return [(row.similar_id, row.score)
+                for row in SimilarBook.objects.filter(book=book).order_by('-score', 'similar_id')]
+
+    def test_build(self):
+        self.assertEqual(7, build_similar_books(k=2))
+        # book_1 = book_2 = (1, 1, 0), book_3 = (0, 1, 2), book_4 = (0, 0, 1)
+        self.assertEqual([(self.book_2.id, 1.0), (self.book_3.id, round(math.sqrt(0.1), 6))],
+                         self.neighbours(self.book_1))
+        self.assertEqual([(self.book_4.id, round(math.sqrt(0.8), 6)),
+                          (self.book_1.id, round(math.sqrt(0.1), 6))],
+                         self.neighbours(self.book_3))
+        self.assertEqual([(self.book_3.id, round(math.sqrt(0.8), 6))],
+                         self.neighbours(self.book_4))
+        self.assertEqual([], self.neighbours(self.book_5))
+
+    def test_partial_rebuild(self):
+        build_similar_books(k=1)
+        UserBookRelation.objects.filter(user=self.user3, book=self.book_4).delete()
+        build_similar_books([self.book_3.id, self.book_4.id], k=1)
+        self.assertEqual([(self.book_1.id, round(math.sqrt(0.1), 6))],
+                         self.neighbours(self.book_3))
+        self.assertEqual([], self.neighbours(self.book_4))
+        # остальные книги не пересчитывались
+        self.assertEqual([(self.book_2.id, 1.0)], self.neighbours(self.book_1))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('build_similar_books', '--top-k', '1', stdout=out)
+        self.assertIn('Saved 4 neighbours of all books', out.getvalue())
+        out = StringIO()
+        call_command('build_similar_books', '--book', str(self.book_1.id), stdout=out)
+        self.assertIn('Saved 2 neighbours of 1 books', out.getvalue())
+
+    def test_api(self):
+        build_similar_books()
+        url = reverse('book-similar', args=(self.book_1.id,))
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'limit': 1})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([{
+            'score': 1.0,
+            'book': {
+                'id': self.book_2.id,
+                'name': 'Test book 2',
+                'price': '25.00',
+                'author_name': 'Author',
+                'author': self.book_2.author_id,
+                'owner': self.user.id,
+                'annotated_likes': 2,
+                'rating': None,
+                'owner_name': 'test_username1',
+            },
+        }], response.json())
+
+        response = self.client.get(reverse('book-similar', args=(self.book_5.id,)))
+        self.assertEqual([], response.json())
+        response = self.client.get(reverse('book-similar', args=(self.book_5.id + 100,)))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
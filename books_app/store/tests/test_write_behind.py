@@ -0,0 +1,238 @@
+import fcntl
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from store.cache import invalidate
+from store.logic import apply_relation_changes
+from store.models import Book, UserBookRelation
+from store.write_behind import WriteBehindBuffer, get_buffer, read_journal
+
+
+class WriteBehindTestCase(TestCase):
+    def setUp(self):
+        invalidate()
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.user = User.objects.create(username="test_username")
+        self.user2 = User.objects.create(username="test_username2")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1', owner=self.user)
+        self.book_2 = Book.objects.create(name="Test book 2", price=55,
+                                          author_name='Author 2', owner=self.user)
+
+    def buffer(self):
+        # без фонового потока: он не видит транзакцию теста
+        buffer = WriteBehindBuffer(self.directory, interval=3600)
+        buffer.start()
+        self.addCleanup(lambda: buffer.journal.closed or buffer.journal.close())
+        self.addCleanup(buffer.release_directory)
+        return buffer
+
+    def crash(self, buffer):
+        # процесс умер: буфер в памяти потерян, flock отпущены, журнал остался
+        buffer.stopped.set()
+        buffer.thread.join()
+        buffer.journal.close()
+        buffer.release_directory()
+
+    def journals(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_last_write_wins(self):
+        buffer = self.buffer()
+        buffer.add(self.user.id, self.book_1.id, {'like': True})
+        buffer.add(self.user.id, self.book_1.id, {'in_bookmarks': True})
+        buffer.add(self.user.id, self.book_1.id, {'like': False, 'rate': 4})
+        buffer.add(self.user2.id, self.book_1.id, {'like': True})
+        self.assertFalse(UserBookRelation.objects.exists())
+        self.assertEqual({'like': False, 'in_bookmarks': True, 'rate': 4},
+                         buffer.pending_for(self.user.id, self.book_1.id))
+
+        # + SELECT авторов книг и UPDATE автора
+        with self.assertNumQueries(9):
+            self.assertEqual(2, buffer.flush())
+        relation = UserBookRelation.objects.get(user=self.user, book=self.book_1)
+        self.assertEqual((False, True, 4), (relation.like, relation.in_bookmarks, relation.rate))
+        self.book_1.refresh_from_db()
+        self.assertEqual((1, 1, 4, 1), (self.book_1.likes_count, self.book_1.bookmarks_count,
+                                        self.book_1.rating_sum, self.book_1.rating_count))
+        self.assertEqual(0, os.path.getsize(buffer.journal_path))
+        self.assertEqual({}, buffer.pending_for(self.user.id, self.book_1.id))
+
+    def test_stop_flushes(self):
+        buffer = self.buffer()
+        buffer.add(self.user.id, self.book_1.id, {'like': True})
+        buffer.stop()
+        self.assertTrue(UserBookRelation.objects.get(user=self.user, book=self.book_1).like)
+        self.assertEqual([], self.journals())
+
+    def test_crash_recovery(self):
+        buffer = self.buffer()
+        buffer.add(self.user.id, self.book_1.id, {'like': True})
+        buffer.add(self.user.id, self.book_1.id, {'rate': 5})
+        buffer.add(self.user2.id, self.book_2.id, {'in_bookmarks': True})
+        self.crash(buffer)
+        # оборванная последняя строка
+        with open(buffer.journal_path, 'ab') as f:
+            f.write(b'[1,2,{"like":tr')
+        os.rename(buffer.journal_path, os.path.join(self.directory, 'journal-1.log'))
+
+        self.buffer()
+        relation = UserBookRelation.objects.get(user=self.user, book=self.book_1)
+        self.assertEqual((True, 5), (relation.like, relation.rate))
+        self.assertTrue(UserBookRelation.objects.get(user=self.user2, book=self.book_2).in_bookmarks)
+        self.book_1.refresh_from_db()
+        self.assertEqual((1, 5, 1), (self.book_1.likes_count, self.book_1.rating_sum,
+                                     self.book_1.rating_count))
+        self.assertNotIn('journal-1.log', self.journals())
+
+    def test_crash_after_flush_is_idempotent(self):
+        buffer = self.buffer()
+        buffer.add(self.user.id, self.book_1.id, {'like': True, 'rate': 3})
+        # изменения сохранены, но журнал не успел обрезаться
+        apply_relation_changes(read_journal(buffer.journal_path))
+        self.crash(buffer)
+        os.rename(buffer.journal_path, os.path.join(self.directory, 'journal-1.log'))
+
+        self.buffer()
+        self.book_1.refresh_from_db()
+        self.assertEqual((1, 3, 1), (self.book_1.likes_count, self.book_1.rating_sum,
+                                     self.book_1.rating_count))
+        self.assertEqual(1, UserBookRelation.objects.count())
+
+    def test_single_process(self):
+        buffer = self.buffer()
+        # второй процесс с тем же каталогом не видел бы pending первого
+        with self.assertRaises(ImproperlyConfigured):
+            WriteBehindBuffer(self.directory).start()
+        buffer.stop()
+        self.buffer().stop()
+
+    def test_live_journal_not_recovered(self):
+        buffer = self.buffer()
+        buffer.add(self.user.id, self.book_1.id, {'like': True})
+        live = os.path.join(self.directory, 'journal-1.log')
+        other = open(live, 'ab')
+        self.addCleanup(other.close)
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        other.write(b'[%d,%d,{"like":true}]\n' % (self.user2.id, self.book_1.id))
+        other.flush()
+
+        buffer.recover()
+        self.assertFalse(UserBookRelation.objects.filter(user=self.user2).exists())
+        self.assertIn('journal-1.log', self.journals())
+
+    def test_flush_failure_keeps_changes(self):
+        buffer = self.buffer()
+        buffer.add(self.user.id, self.book_1.id, {'like': True, 'rate': 2})
+        with mock.patch('store.write_behind.apply_relation_changes', side_effect=RuntimeError):
+            buffer.add(self.user.id, self.book_1.id, {'rate': 1})
+            with self.assertRaises(RuntimeError):
+                buffer.flush()
+        buffer.add(self.user.id, self.book_1.id, {'rate': 5})
+        self.assertEqual({'like': True, 'rate': 5}, buffer.pending_for(self.user.id, self.book_1.id))
+        with open(buffer.journal_path) as f:
+            self.assertEqual(3, len(f.readlines()))
+
+        buffer.flush()
+        relation = UserBookRelation.objects.get(user=self.user, book=self.book_1)
+        self.assertEqual((True, 5), (relation.like, relation.rate))
+
+    def test_deleted_book_skipped(self):
+        buffer = self.buffer()
+        buffer.add(self.user.id, self.book_1.id, {'like': True})
+        buffer.add(self.user.id, self.book_2.id, {'like': True})
+        self.book_2.delete()
+        buffer.flush()
+        self.assertEqual([self.book_1.id],
+                         list(UserBookRelation.objects.values_list('book_id', flat=True)))
+
+
+class WriteBehindApiTestCase(TestCase):
+    def setUp(self):
+        invalidate()
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings = override_settings(BOOKS_WRITE_BEHIND=True, BOOKS_WRITE_BEHIND_DIR=tmp.name,
+                                     BOOKS_WRITE_BEHIND_INTERVAL=3600)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create(username="test_username")
+        self.book_1 = Book.objects.create(name="Test book 1", price=25,
+                                          author_name='Author 1', owner=self.user)
+        self.url = reverse('userbookrelation-detail', args=(self.book_1.id,))
+        self.client.force_login(self.user)
+
+    def patch(self, data):
+        return self.client.patch(self.url, data=json.dumps(data), content_type='application/json')
+
+    def test_read_own_writes(self):
+        response = self.patch({'like': True})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'book': self.book_1.id, 'like': True, 'in_bookmarks': False, 'rate': None},
+                         response.json())
+        response = self.patch({'rate': 4})
+        self.assertEqual({'book': self.book_1.id, 'like': True, 'in_bookmarks': False, 'rate': 4},
+                         response.json())
+        self.assertFalse(UserBookRelation.objects.exists())
+
+        response = self.client.get(self.url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual({'book': self.book_1.id, 'like': True, 'in_bookmarks': False, 'rate': 4},
+                         response.json())
+
+        get_buffer().flush()
+        relation = UserBookRelation.objects.get(user=self.user, book=self.book_1)
+        self.assertEqual((True, 4), (relation.like, relation.rate))
+        self.book_1.refresh_from_db()
+        self.assertEqual(1, self.book_1.likes_count)
+        self.assertEqual(response.json(), self.client.get(self.url).json())
+
+    def test_bulk_after_patch(self):
+        # PATCH и bulk - один буфер: побеждает более поздняя запись
+        bulk_url = reverse('userbookrelation-bulk')
+        self.patch({'like': True, 'rate': 3})
+        response = self.client.post(bulk_url, json.dumps([{'book': self.book_1.id, 'like': False}]),
+                                    content_type='application/json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([{'book': self.book_1.id, 'status': 'ok', 'like': False,
+                           'in_bookmarks': False, 'rate': 3}], response.json())
+        self.assertFalse(UserBookRelation.objects.exists())
+        self.assertEqual({'book': self.book_1.id, 'like': False, 'in_bookmarks': False, 'rate': 3},
+                         self.client.get(self.url).json())
+        self.patch({'rate': 5})
+        response = self.client.post(f'{bulk_url}?fields=rate',
+                                    json.dumps([{'book': self.book_1.id, 'in_bookmarks': True}]),
+                                    content_type='application/json')
+        self.assertEqual([{'book': self.book_1.id, 'status': 'ok', 'rate': 5}], response.json())
+
+        get_buffer().flush()
+        relation = UserBookRelation.objects.get(user=self.user, book=self.book_1)
+        self.assertEqual((False, True, 5), (relation.like, relation.in_bookmarks, relation.rate))
+        self.book_1.refresh_from_db()
+        self.assertEqual((0, 1, 5, 1), (self.book_1.likes_count, self.book_1.bookmarks_count,
+                                        self.book_1.rating_sum, self.book_1.rating_count))
+
+    def test_invalid(self):
+        response = self.patch({'rate': 6})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.url = reverse('userbookrelation-detail', args=(self.book_1.id + 100,))
+        response = self.patch({'like': True})
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+        self.assertEqual({}, get_buffer().pending)
+
+    def test_setting_change_flushes(self):
+        self.patch({'like': True})
+        journal = get_buffer().journal_path
+        with override_settings(BOOKS_WRITE_BEHIND=False):
+            self.assertTrue(UserBookRelation.objects.get(user=self.user, book=self.book_1).like)
+            self.assertFalse(os.path.exists(journal))
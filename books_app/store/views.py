@@ -1,29 +1,202 @@
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.mixins import UpdateModelMixin
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
-from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.mixins import ListModelMixin, UpdateModelMixin
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet, GenericViewSet, ReadOnlyModelViewSet
 
-from store.models import Book, UserBookRelation
+from store.cache import cache_stats, cached_response, user_generation_key
+from store.conditional import book_validators, conditional_response, list_validators, \
+    set_validators, write_etag
+from store.export import EXPORT_FORMATS
+from store.facets import book_facets, with_facets
+from store.filters import BookFilter
+from store.leaderboard import top_books
+from store.logic import apply_relation_changes, upsert_relation
+from store.middleware import timing
+from store.models import Author, Book, SimilarBook, UserBookRelation
+from store.pagination import AuthorPagination, KeysetPagination, LibraryPagination
 from store.permissions import IsOwnerOrStaffOrReadOnly
-from store.serializers import BookSerializer, UserBookRelationSerializer
+from store.search import BookOrderingFilter, BookSearchFilter
+from store.serializers import AuthorSerializer, BookFastReader, BookSerializer, \
+    BulkUserBookRelationSerializer, FacetQuerySerializer, FieldsQuerySerializer, \
+    LeaderboardQuerySerializer, LeaderboardSerializer, LibrarySerializer, SimilarBookSerializer, \
+    SimilarQuerySerializer, UserBookRelationSerializer
+from store.write_behind import get_buffer, relation_data, relations_data
+
+
+def requested_fields(request, serializer_class):
+    # ?fields= / ?exclude=: None - все поля serializer_class
+    params = FieldsQuerySerializer(data=request.query_params,
+                                   context={'fields': list(serializer_class.Meta.fields)})
+    params.is_valid(raise_exception=True)
+    return params.validated_data['fields']
+
+
+def only_fields(data, fields):
+    return data if fields is None else {name: data[name] for name in fields}
 
 
 class BookViewSet(ModelViewSet):
-    queryset = Book.objects.all()
+    queryset = Book.objects.annotated().order_by('id')
     serializer_class = BookSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, BookSearchFilter, BookOrderingFilter]
     permission_classes = [IsOwnerOrStaffOrReadOnly]
-    filterset_fields = ['price']
+    pagination_class = KeysetPagination
+    filterset_class = BookFilter
     search_fields = ['name', 'author_name']
+    # GET можно читать с реплики (store.routers)
+    replica_reads = True
     ordering_fields = ['price', 'author_name']
 
+    def list(self, request, *args, **kwargs):
+        facets = self.requested_facets(request)
+        fields = requested_fields(request, BookSerializer)
+        etag, last_modified = list_validators(request)
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = cached_response(request, lambda: self.fast_list(request, facets, fields))
+        return set_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        fields = requested_fields(request, BookSerializer)
+        etag, last_modified = book_validators(request, kwargs[self.lookup_field])
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = cached_response(request, lambda: self.fast_retrieve(request, fields))
+        return set_validators(response, etag, last_modified)
+
+    def requested_facets(self, request):
+        params = FacetQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return params.validated_data.get('facets')
+
+    def fast_list(self, request, facets=None, fields=None):
+        # то же, что ListModelMixin.list, но через BookFastReader
+        reader = BookFastReader(fields)
+        books = self.filter_queryset(self.get_queryset())
+        queryset = reader.queryset(books, self.paginator.get_ordering(request, books, self))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            with timing(request, 'serialize'):
+                data = self.paginator.get_paginated_data(reader.many(page))
+        else:
+            with timing(request, 'serialize'):
+                data = reader.many(queryset)
+        if facets:
+            # по всему отфильтрованному списку, а не по странице
+            data = with_facets(data, book_facets(books, facets))
+        return Response(data)
+
+    def fast_retrieve(self, request, fields=None):
+        reader = BookFastReader(fields)
+        queryset = reader.queryset(self.get_queryset())
+        row = get_object_or_404(queryset, pk=self.kwargs[self.lookup_field])
+        self.check_object_permissions(request, row)
+        with timing(request, 'serialize'):
+            data = reader.to_representation(row)
+        return Response(data)
+
+    def update(self, request, *args, **kwargs):
+        # If-Match / If-Unmodified-Since: оптимистичная блокировка
+        with transaction.atomic():
+            etag, last_modified = book_validators(request, kwargs[self.lookup_field], lock=True)
+            if etag is not None:
+                response = conditional_response(request, write_etag(request, etag), last_modified)
+                if response is not None:
+                    return response
+            response = super().update(request, *args, **kwargs)
+        return set_validators(response, *book_validators(request, kwargs[self.lookup_field]))
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            etag, last_modified = book_validators(request, kwargs[self.lookup_field], lock=True)
+            if etag is not None:
+                response = conditional_response(request, write_etag(request, etag), last_modified)
+                if response is not None:
+                    return response
+            return super().destroy(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         # присвоить пользователя книге который ее создал
         serializer.validated_data['owner'] = self.request.user
         serializer.save()
 
+    @action(detail=False)
+    def export(self, request):
+        # весь каталог потоком: ?export_format=ndjson|csv + те же filter/search/ordering
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': [f'Choose one of: {", ".join(EXPORT_FORMATS)}.']})
+        lines, content_type, filename = EXPORT_FORMATS[export_format]
+        reader = BookFastReader(requested_fields(request, BookSerializer))
+        queryset = reader.queryset(self.filter_queryset(self.get_queryset()))
+        chunk_size = getattr(settings, 'BOOKS_EXPORT_CHUNK_SIZE', 2000)
+        response = StreamingHttpResponse(lines(reader, queryset.iterator(chunk_size=chunk_size)),
+                                         content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=False)
+    def top(self, request):
+        # ?by=likes|rating|bayesian&limit=N[&min_votes=K]: порядок уже лежит в индексе,
+        # каталог не сортируется
+        params = LeaderboardQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return cached_response(request, lambda: Response(self.leaderboard(**params.validated_data)))
+
+    def leaderboard(self, by, limit, min_votes=None):
+        books = LeaderboardSerializer(top_books(by, limit, min_votes), many=True).data
+        return {'by': by, 'results': [{'rank': rank, **book}
+                                      for rank, book in enumerate(books, start=1)]}
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        # готовые соседи из SimilarBook (manage.py build_similar_books), без расчетов в запросе
+        params = SimilarQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return cached_response(request, lambda: Response(self.similar_books(
+            pk, params.validated_data['limit'])))
+
+    def similar_books(self, pk, limit):
+        book = get_object_or_404(Book.objects.only('id'), pk=pk)
+        rows = SimilarBook.objects.filter(book=book).select_related('similar__owner') \
+            .order_by('-score', 'similar_id')[:limit]
+        return SimilarBookSerializer(rows, many=True).data
+
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(cache_stats())
+
+
+class AuthorViewSet(ReadOnlyModelViewSet):
+    """
+    Authors with their precomputed book count, likes and rating; their
+    books are ``/book/?author=<id>``.
+    """
+    queryset = Author.objects.order_by('id')
+    serializer_class = AuthorSerializer
+    filter_backends = [SearchFilter, OrderingFilter]
+    pagination_class = AuthorPagination
+    search_fields = ['name']
+    # name уникален - индекс годится и для keyset
+    ordering_fields = ['name']
+    replica_reads = True
+
+    def list(self, request, *args, **kwargs):
+        return cached_response(request, lambda: super(AuthorViewSet, self).list(request))
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response(request, lambda: super(AuthorViewSet, self).retrieve(request))
+
 
 class UserBookRelationView(UpdateModelMixin, GenericViewSet):
     permission_classes = [IsAuthenticated]
@@ -31,11 +204,117 @@ class UserBookRelationView(UpdateModelMixin, GenericViewSet):
     serializer_class = UserBookRelationSerializer
     lookup_field = 'book'
 
-    def get_object(self):
-        obj, created = UserBookRelation.objects.get_or_create(user=self.request.user,
-                                                        book_id=self.kwargs['book'])
-        print('created', created)
-        return obj
+    def retrieve(self, request, *args, **kwargs):
+        # без создания связи; с еще не сохраненными изменениями пользователя
+        fields = requested_fields(request, UserBookRelationSerializer)
+        book = get_object_or_404(Book.objects.only('id'), pk=self.kwargs['book'])
+        return Response(relation_data(request.user.id, book.id, fields))
+
+    def update(self, request, *args, **kwargs):
+        # книга берется из URL, сохраняются только присланные поля
+        fields = requested_fields(request, UserBookRelationSerializer)
+        if not isinstance(request.data, dict):
+            raise ParseError('Expected an object.')
+        data = {key: value for key, value in request.data.items() if key != 'book'}
+        serializer = BulkUserBookRelationSerializer(data=data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        book = get_object_or_404(Book.objects.only('id'), pk=self.kwargs['book'])
+
+        buffer = get_buffer()
+        if buffer is not None:
+            # write-behind: изменение в журнал и буфер, в базу - пачкой позже
+            if serializer.validated_data:
+                buffer.add(request.user.id, book.id, serializer.validated_data)
+            return Response(relation_data(request.user.id, book.id, fields))
+
+        relation = upsert_relation(request.user.id, book.id, serializer.validated_data)
+        return Response(only_fields(UserBookRelationSerializer(relation).data, fields))
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        # [{"book": 1, "like": true}, {"book": 2, "rate": 5}, ...] одной транзакцией
+        fields = requested_fields(request, UserBookRelationSerializer)
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+        max_items = getattr(settings, 'BOOKS_BULK_MAX_ITEMS', 500)
+        if len(items) > max_items:
+            raise ValidationError({'non_field_errors': [f'At most {max_items} items are allowed.']})
+
+        item_serializers = [BulkUserBookRelationSerializer(data=item, partial=True)
+                       if isinstance(item, dict) else None for item in items]
+        for serializer in item_serializers:
+            if serializer is not None:
+                serializer.is_valid()
+        requested = {serializer.validated_data['book'] for serializer in item_serializers
+                     if serializer is not None and 'book' in serializer.validated_data}
+        existing = set(Book.objects.filter(id__in=requested).values_list('id', flat=True))
+
+        results = []
+        changes = {}
+        for item, serializer in zip(items, item_serializers):
+            if serializer is None:
+                results.append({'status': 'error',
+                                'errors': {'non_field_errors': ['Expected an object.']}})
+                continue
+            errors = dict(serializer.errors)
+            data = dict(serializer.validated_data)
+            book_id = data.pop('book', None)
+            if book_id is None and 'book' not in errors:
+                errors['book'] = ['This field is required.']
+            elif book_id is not None and book_id not in existing:
+                errors['book'] = [f'Invalid pk "{book_id}" - object does not exist.']
+            if errors:
+                results.append({'book': item.get('book'), 'status': 'error', 'errors': errors})
+                continue
+            # несколько записей для одной книги - побеждает последняя
+            changes.setdefault((request.user.id, book_id), {}).update(data)
+            results.append({'book': book_id, 'status': 'ok'})
+
+        buffer = get_buffer()
+        if buffer is not None:
+            # как PATCH: через буфер, иначе более поздний flush затрет эту запись
+            for (user_id, book_id), data in changes.items():
+                if data:
+                    buffer.add(user_id, book_id, data)
+            saved = relations_data(request.user.id, [book_id for _, book_id in changes], fields)
+        else:
+            relations = apply_relation_changes(changes)
+            saved = {book_id: only_fields(UserBookRelationSerializer(relation).data, fields)
+                     for (_, book_id), relation in relations.items()}
+        for result in results:
+            if result['status'] == 'ok':
+                result.update(saved[result['book']])
+        return Response(results, status=status.HTTP_200_OK)
+
+
+class LibraryView(ListModelMixin, GenericViewSet):
+    """
+    The current user's liked, bookmarked and rated books, newest first:
+    one keyset page of relations joined with their books. Cached per user
+    until the user changes one of their relations.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = LibrarySerializer
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    pagination_class = LibraryPagination
+    filterset_fields = {
+        'like': ['exact'],
+        'in_bookmarks': ['exact'],
+        'rate': ['exact', 'gte', 'lte', 'isnull'],
+    }
+    ordering_fields = ['id']
+    ordering = ['-id']
+
+    def get_queryset(self):
+        return UserBookRelation.objects.filter(user=self.request.user) \
+            .select_related('book__owner')
+
+    def list(self, request, *args, **kwargs):
+        timeout = getattr(settings, 'BOOKS_LIBRARY_CACHE_TIMEOUT', 60)
+        return cached_response(request, lambda: super(LibraryView, self).list(request),
+                               generation_key=user_generation_key(request.user.id),
+                               timeout=timeout)
 
 
 def auth(request):
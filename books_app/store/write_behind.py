@@ -0,0 +1,286 @@
+"""
+Write-behind buffer for relation PATCHes (likes, bookmarks, rates).
+
+With ``BOOKS_WRITE_BEHIND`` on, a PATCH is appended to this process's
+journal (fsync before the answer), merged into an in-memory buffer where
+the last write per (user, book) wins, and saved by a background thread
+every ``BOOKS_WRITE_BEHIND_INTERVAL`` seconds with one
+``apply_relation_changes`` batch.
+
+The pending changes live in the memory of one process, and only that
+process reads them back (``relation_data``): read-your-writes holds only
+when every relation PATCH and GET goes to the same process. So
+write-behind needs a single worker process (e.g. ``gunicorn --workers 1
+--threads N``). The buffer takes an exclusive ``flock`` on
+``BOOKS_WRITE_BEHIND_DIR``, and a second live process using the directory
+gets ImproperlyConfigured instead of a buffer of its own.
+
+The process keeps its ``journal-<pid>.log`` in that directory under an
+exclusive ``flock`` as well. A journal whose
+lock can be taken belongs to a dead process: it is replayed and removed
+when the next buffer starts. Applying a change twice gives the same rows
+and counters, so a crash between the flush and the journal cleanup is
+harmless.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+from glob import glob
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+from store.logic import apply_relation_changes
+from store.models import Book, UserBookRelation
+
+logger = logging.getLogger('store.write_behind')
+
+FIELDS = ('like', 'in_bookmarks', 'rate')
+
+
+def merge(changes, user_id, book_id, data):
+    # последняя запись побеждает по каждому полю
+    changes.setdefault((user_id, book_id), {}).update(data)
+
+
+def read_journal(path, changes=None):
+    """Merge the journal entries into ``changes``; a torn last line is skipped."""
+    changes = {} if changes is None else changes
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                user_id, book_id, data = json.loads(line)
+            except ValueError:
+                logger.warning('Skipping a broken line in %s', path)
+                continue
+            merge(changes, user_id, book_id, data)
+    return changes
+
+
+def save_changes(changes):
+    """
+    ``apply_relation_changes`` without the pairs whose book or user is gone,
+    so one deleted book doesn't fail the whole batch.
+    """
+    book_ids = {book_id for _, book_id in changes}
+    user_ids = {user_id for user_id, _ in changes}
+    existing_books = set(Book.objects.filter(id__in=book_ids).values_list('id', flat=True))
+    existing_users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    changes = {key: data for key, data in changes.items()
+               if key[0] in existing_users and key[1] in existing_books}
+    return apply_relation_changes(changes)
+
+
+class WriteBehindBuffer:
+    def __init__(self, directory, interval=1.0, max_pending=10000):
+        self.directory = str(directory)
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = {}
+        # сохраняемые прямо сейчас: их еще должен видеть pending_for
+        self.flushing = {}
+        self.lock = threading.Lock()
+        # один flush за раз: фоновый поток, переполнение, остановка
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.owner = None
+        self.journal = None
+        self.journal_path = os.path.join(self.directory, f'journal-{os.getpid()}.log')
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.owner = self.lock_directory()
+        self.journal = open(self.journal_path, 'ab')
+        fcntl.flock(self.journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.recover()
+        self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+        self.thread.start()
+        return self
+
+    def lock_directory(self):
+        # один процесс на каталог: pending_for не видит буферы других процессов
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise ImproperlyConfigured(
+                f'{self.directory} is used by another write-behind process; '
+                'BOOKS_WRITE_BEHIND needs a single worker process.')
+        return fd
+
+    def release_directory(self):
+        if self.owner is not None:
+            os.close(self.owner)
+            self.owner = None
+
+    def recover(self):
+        """Save and remove the journals left by dead processes."""
+        for path in sorted(glob(os.path.join(self.directory, 'journal-*.log'))):
+            if path == self.journal_path:
+                continue
+            with open(path, 'rb') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # журнал живого процесса
+                changes = read_journal(path)
+                save_changes(changes)
+                os.remove(path)
+            logger.info('Recovered %s relation changes from %s', len(changes), path)
+        # свой журнал: тот же pid после перезапуска
+        if os.path.getsize(self.journal_path):
+            save_changes(read_journal(self.journal_path))
+            self.journal.truncate(0)
+
+    def add(self, user_id, book_id, data):
+        """Journal the change durably and queue it."""
+        line = json.dumps([user_id, book_id, data], separators=(',', ':')).encode() + b'\n'
+        with self.lock:
+            self.journal.write(line)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            merge(self.pending, user_id, book_id, data)
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def pending_for(self, user_id, book_id):
+        key = (user_id, book_id)
+        with self.lock:
+            return {**self.flushing.get(key, {}), **self.pending.get(key, {})}
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                changes, self.pending = self.pending, {}
+                self.flushing = changes
+                journaled = self.journal.tell()
+            if not changes:
+                return 0
+            try:
+                save_changes(changes)
+            except Exception:
+                with self.lock:
+                    # вернуть в буфер, более новые записи важнее
+                    for key, data in changes.items():
+                        self.pending[key] = {**data, **self.pending.get(key, {})}
+                    self.flushing = {}
+                raise
+            with self.lock:
+                self.flushing = {}
+                self.trim_journal(journaled)
+            return len(changes)
+
+    def trim_journal(self, offset):
+        # оставить только записи, добавленные во время flush
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        self.journal.truncate(0)
+        self.journal.seek(0)
+        if tail:
+            self.journal.write(tail)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Write-behind flush failed, will retry')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        """Stop the worker and flush what is left; the journal stays on failure."""
+        if self.journal is None or self.journal.closed:
+            return
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+        os.remove(self.journal_path)
+        self.journal.close()
+        self.release_directory()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """The process buffer, started on first use; None when write-behind is off."""
+    global _buffer
+    if not getattr(settings, 'BOOKS_WRITE_BEHIND', False):
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer(
+                settings.BOOKS_WRITE_BEHIND_DIR,
+                interval=getattr(settings, 'BOOKS_WRITE_BEHIND_INTERVAL', 1.0),
+                max_pending=getattr(settings, 'BOOKS_WRITE_BEHIND_MAX_PENDING', 10000),
+            ).start()
+            atexit.register(_buffer.stop)
+    return _buffer
+
+
+def stop_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is not None:
+            buffer, _buffer = _buffer, None
+            atexit.unregister(buffer.stop)
+            buffer.stop()
+
+
+@receiver(setting_changed)
+def reset_buffer(setting, **kwargs):
+    if setting.startswith('BOOKS_WRITE_BEHIND'):
+        stop_buffer()
+
+
+def relation_data(user_id, book_id, fields=None):
+    """
+    The relation as the user sees it: saved values plus pending changes.
+    ``fields`` narrows both the SELECT and the result.
+    """
+    names = [field for field in FIELDS if fields is None or field in fields]
+    data = None
+    if names:
+        data = UserBookRelation.objects.filter(user_id=user_id, book_id=book_id) \
+            .values(*names).first()
+    return with_pending(user_id, book_id, data, names, fields)
+
+
+def relations_data(user_id, book_ids, fields=None):
+    """``relation_data`` for several books of one user with one SELECT."""
+    names = [field for field in FIELDS if fields is None or field in fields]
+    saved = {}
+    if names:
+        saved = {row.pop('book_id'): row for row in UserBookRelation.objects.filter(
+            user_id=user_id, book_id__in=book_ids).values('book_id', *names)}
+    return {book_id: with_pending(user_id, book_id, saved.get(book_id), names, fields)
+            for book_id in book_ids}
+
+
+def with_pending(user_id, book_id, data, names, fields):
+    # сохраненные значения (None - связи нет) + изменения из буфера
+    if data is None:
+        data = {field: UserBookRelation._meta.get_field(field).get_default() for field in names}
+    buffer = get_buffer()
+    if buffer is not None:
+        data.update({field: value for field, value in buffer.pending_for(user_id, book_id).items()
+                     if field in names})
+    if fields is not None and 'book' not in fields:
+        return data
+    return {'book': book_id, **data}